@@ -0,0 +1,194 @@
+"""
+Admission control and load shedding.
+
+Every HTTP request is classified by method and path into one of four route
+classes, each with its own concurrency limit, bounded wait queue and maximum
+queueing time:
+
+- hash_heavy:  password hashing on the event loop (login, register, reset, profile update)
+- db_read:     cheap reads (GET /users/me, /authenticated-route, admin listings)
+- db_write:    other writes
+- external_io: calls to OAuth providers or SMTP while the request waits
+
+A request that finds its class full waits in FIFO order; if the queue is full,
+or it cannot start within the class's max wait, it gets an immediate 503 with
+Retry-After instead of holding a connection (and a DB session) open. A login
+surge then fills the hash_heavy queue and sheds there, while /users/me keeps
+its own slots.
+
+Limits are per worker and configured with ADMISSION_<CLASS>_LIMIT,
+ADMISSION_<CLASS>_QUEUE and ADMISSION_<CLASS>_MAX_WAIT_MS.
+"""
+import asyncio
+import json
+import math
+import os
+import re
+from collections import deque
+from typing import Optional
+
+ADMISSION_CONTROL_ENABLED = os.getenv("ADMISSION_CONTROL_ENABLED", "true").lower() == "true"
+
+# Never queued or shed: docs, the profiling endpoints needed to diagnose overload,
+# and long-lived event streams (which would otherwise hold a db_read slot while open)
+ADMISSION_EXEMPT_PREFIXES = ("/docs", "/redoc", "/openapi.json", "/admin/profiling", "/events/users/stream", "/users/me/events")
+
+
+def _env_int(name: str, default: int) -> int:
+    return int(os.getenv(name, str(default)))
+
+
+class RouteClass:
+    """Concurrency slots plus a bounded FIFO wait queue for one class of routes."""
+
+    def __init__(self, name: str, limit: int, queue_size: int, max_wait_ms: int):
+        self.name = name
+        self.limit = limit
+        self.queue_size = queue_size
+        self.max_wait = max_wait_ms / 1000
+        self.active = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        self.admitted = 0
+        self.rejected_queue_full = 0
+        self.rejected_timeout = 0
+
+    @classmethod
+    def from_env(cls, name: str, limit: int, queue_size: int, max_wait_ms: int) -> "RouteClass":
+        prefix = f"ADMISSION_{name.upper()}"
+        return cls(
+            name,
+            limit=_env_int(f"{prefix}_LIMIT", limit),
+            queue_size=_env_int(f"{prefix}_QUEUE", queue_size),
+            max_wait_ms=_env_int(f"{prefix}_MAX_WAIT_MS", max_wait_ms),
+        )
+
+    async def acquire(self) -> bool:
+        """Take a slot, waiting at most max_wait. False means the request should be shed."""
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            self.admitted += 1
+            return True
+        if len(self._waiters) >= self.queue_size:
+            self.rejected_queue_full += 1
+            return False
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=self.max_wait)
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # The slot was handed over just as the wait expired; keep it
+                self.admitted += 1
+                return True
+            self._waiters.remove(waiter)
+            waiter.cancel()
+            self.rejected_timeout += 1
+            return False
+        except asyncio.CancelledError:
+            # Client went away while queued; pass on a slot that was already handed over
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            else:
+                self._waiters.remove(waiter)
+                waiter.cancel()
+            raise
+        self.admitted += 1
+        return True
+
+    def release(self) -> None:
+        """Free a slot, handing it directly to the oldest waiter if there is one."""
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(True)
+                return
+        self.active -= 1
+
+    def retry_after(self) -> int:
+        return max(1, math.ceil(self.max_wait))
+
+    def stats(self) -> dict:
+        return {
+            "limit": self.limit,
+            "queue_size": self.queue_size,
+            "max_wait_ms": int(self.max_wait * 1000),
+            "active": self.active,
+            "queued": len(self._waiters),
+            "admitted": self.admitted,
+            "rejected_queue_full": self.rejected_queue_full,
+            "rejected_timeout": self.rejected_timeout,
+        }
+
+
+# Argon2 runs on the event loop, so only a few hash-heavy requests should be in flight at once
+route_classes = {
+    "hash_heavy": RouteClass.from_env("hash_heavy", limit=4, queue_size=32, max_wait_ms=2000),
+    "db_read": RouteClass.from_env("db_read", limit=64, queue_size=256, max_wait_ms=500),
+    "db_write": RouteClass.from_env("db_write", limit=16, queue_size=64, max_wait_ms=1000),
+    "external_io": RouteClass.from_env("external_io", limit=16, queue_size=32, max_wait_ms=1000),
+}
+
+# First match wins; anything unmatched is db_read for GET/HEAD and db_write otherwise
+ROUTE_RULES: list[tuple[frozenset, re.Pattern, str]] = [
+    (frozenset({"POST"}), re.compile(r"^/auth/jwt/login$"), "hash_heavy"),
+    (frozenset({"POST"}), re.compile(r"^/auth/register$"), "hash_heavy"),
+    (frozenset({"POST"}), re.compile(r"^/auth/reset-password$"), "hash_heavy"),
+    # May carry a new password
+    (frozenset({"PATCH"}), re.compile(r"^/users/(me|[^/]+)$"), "hash_heavy"),
+    (frozenset({"GET"}), re.compile(r"^/auth/[^/]+/callback$"), "external_io"),
+    (frozenset({"POST"}), re.compile(r"^/email/test$"), "external_io"),
+]
+
+
+def classify(method: str, path: str) -> Optional[str]:
+    """Route class name for a request, or None if it bypasses admission control."""
+    if method == "OPTIONS" or path.startswith(ADMISSION_EXEMPT_PREFIXES):
+        return None
+    for methods, pattern, class_name in ROUTE_RULES:
+        if method in methods and pattern.match(path):
+            return class_name
+    return "db_read" if method in ("GET", "HEAD") else "db_write"
+
+
+def admission_stats() -> dict:
+    return {name: route_class.stats() for name, route_class in route_classes.items()}
+
+
+class AdmissionControlMiddleware:
+    """Queue or shed requests per route class before they reach the application."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        class_name = classify(scope["method"], scope["path"])
+        if class_name is None:
+            await self.app(scope, receive, send)
+            return
+
+        route_class = route_classes[class_name]
+        if not await route_class.acquire():
+            await self._reject(route_class, send)
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            route_class.release()
+
+    @staticmethod
+    async def _reject(route_class: RouteClass, send) -> None:
+        body = json.dumps({"detail": "Server is busy, please retry shortly", "route_class": route_class.name}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(route_class.retry_after()).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
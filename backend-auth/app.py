@@ -12,22 +12,109 @@ from fastapi import Depends, FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import RedirectResponse
 
-from db import User, create_db_and_tables, get_user_db
+from db import SHARD_DATABASE_URLS, User, create_db_and_tables, engine, get_user_db, replica_router
 from fastapi_users.db import SQLAlchemyUserDatabase
 from schemas import UserCreate, UserRead, UserUpdate
 from users import auth_backend, current_active_user, fastapi_users, get_user_manager
 from dependencies import admin_required
 from oauth import oauth_clients, FRONTEND_URL
+from routers.admin import router as admin_router
+from routers.avatars import router as avatars_router
+from routers.events import router as events_router
+from routers.profile import router as profile_router
+from routers.profiling import router as profiling_router
+from profiling import PROFILING_HEADER_TOKEN, ProfilingMiddleware
+from admission import ADMISSION_CONTROL_ENABLED, AdmissionControlMiddleware
+from idempotency import IDEMPOTENCY_ENABLED, IdempotencyMiddleware
+from resilience import DeadlineMiddleware, DependencyUnavailable, dependency
+from traffic_capture import TRAFFIC_CAPTURE_PATH, TrafficCaptureMiddleware, traffic_recorder
+from tracing import TRACING_ENABLED, TracingMiddleware, instrument_engine as trace_engine, tracer
+from token_socket import token_socket_server
+from sql_instrumentation import QueryStatsMiddleware, instrument_engine
+from services.verification_campaign import shutdown_campaigns
+from services.email_outbox import relay as email_outbox_relay
+from services.login_audit import audit_writer
+from services.activity_tracker import activity_tracker
+from services.user_events import event_hub
+from services.session_push import session_push_hub
+from services.maintenance import maintenance_scheduler
+from services import avatars
+from services.avatars import discord_avatar_source
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan manager - handles startup and shutdown"""
     await create_db_and_tables()
+    if SHARD_DATABASE_URLS:
+        from sharding import shard_set
+        await shard_set.create_tables()
+    replica_router.start()
+    email_outbox_relay.start()
+    audit_writer.start()
+    activity_tracker.start()
+    await event_hub.start()
+    session_push_hub.start()
+    maintenance_scheduler.start()
+    await traffic_recorder.start()
+    tracer.start()
+    await token_socket_server.start()
     yield
+    await token_socket_server.stop()
+    await traffic_recorder.stop()
+    await avatars.close()
+    await maintenance_scheduler.stop()
+    await session_push_hub.stop()
+    await event_hub.stop()
+    await shutdown_campaigns()
+    await email_outbox_relay.stop()
+    # Flush buffered login audit events before the process exits
+    await audit_writer.stop()
+    await activity_tracker.stop()
+    await replica_router.stop()
+    if SHARD_DATABASE_URLS:
+        from sharding import shard_set
+        await shard_set.dispose()
+    # Last, so spans from shutdown work are exported too
+    await tracer.stop()
 
 
 app = FastAPI(lifespan=lifespan)
 
+# Per-request SQL counters, slow-query log and N+1 warnings
+shard_engines = []
+if SHARD_DATABASE_URLS:
+    from sharding import shard_set
+    shard_engines = shard_set.engines
+for db_engine in [engine, *replica_router.replicas, *shard_engines]:
+    instrument_engine(db_engine.sync_engine)
+    if TRACING_ENABLED:
+        trace_engine(db_engine.sync_engine)
+app.add_middleware(QueryStatsMiddleware)
+
+# Header-triggered request profiling - only installed when a token is configured
+if PROFILING_HEADER_TOKEN:
+    app.add_middleware(ProfilingMiddleware, token=PROFILING_HEADER_TOKEN)
+
+# Per-route-class concurrency limits; added before CORS so shed responses still get CORS headers
+if ADMISSION_CONTROL_ENABLED:
+    app.add_middleware(AdmissionControlMiddleware)
+
+# Duplicate registrations, reset requests and OAuth callbacks replay the first response;
+# outside admission control so waiting duplicates and replays do not take slots
+if IDEMPOTENCY_ENABLED:
+    app.add_middleware(IdempotencyMiddleware)
+
+# Per-request deadline budget for outbound calls; outside admission control so queueing time counts
+app.add_middleware(DeadlineMiddleware)
+
+# Request shape/timing capture for testing/replay.py - only installed when a capture path is configured
+if TRAFFIC_CAPTURE_PATH:
+    app.add_middleware(TrafficCaptureMiddleware)
+
+# Request spans and W3C trace context - outermost but CORS, so queueing and replays are inside the span
+if TRACING_ENABLED:
+    app.add_middleware(TracingMiddleware)
+
 # Add CORS middleware to allow frontend requests
 cors_origins_str = os.getenv("BACKEND_CORS_ORIGINS", os.getenv("CORS_ORIGINS", "http://localhost:5173,http://localhost:3000"))
 cors_origins = [origin.strip() for origin in cors_origins_str.split(",")]
@@ -37,6 +124,7 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["traceresponse"],
 )
 
 # Include auth router
@@ -58,11 +146,17 @@ app.include_router(
     prefix="/auth",
     tags=["auth"],
 )
+# Must come before the users router: it replaces GET /users/me with an ETag-aware version
+app.include_router(profile_router)
+app.include_router(avatars_router)
 app.include_router(
     fastapi_users.get_users_router(UserRead, UserUpdate),
     prefix="/users",
     tags=["users"],
 )
+app.include_router(admin_router)
+app.include_router(events_router)
+app.include_router(profiling_router)
 
 # OAuth Routes
 from fastapi_users.authentication import CookieTransport
@@ -137,6 +231,7 @@ async def oauth_callback(
             error_msg = "user_denied"
         elif error == "invalid_request":
             error_msg = "invalid_request"
+        await audit_writer.record(f"oauth:{provider}", f"provider_error:{error_msg}", request=request)
         error_url = f"{FRONTEND_URL}/login?error={error_msg}"
         return RedirectResponse(url=error_url)
     
@@ -187,6 +282,7 @@ async def oauth_callback(
             
             # Validate email is available
             if not user_email:
+                await audit_writer.record(f"oauth:{provider}", "email_not_available", request=request)
                 error_url = f"{FRONTEND_URL}/login?error=email_not_available"
                 return RedirectResponse(url=error_url)
             
@@ -205,7 +301,7 @@ async def oauth_callback(
                     try:
                         user = await user_manager.get_by_email(user_email)
                         # Link Discord OAuth account to existing user
-                        await user_db.add_oauth_account(user, provider, discord_id)
+                        await user_db.add_oauth_account(user, {"oauth_name": provider, "access_token": access_token, "account_id": discord_id, "account_email": user_email})
                     except Exception:
                         # Create new user with random password (OAuth users don't use password)
                         import secrets
@@ -227,14 +323,20 @@ async def oauth_callback(
                         user_manager.validate_password = skip_validation
                         try:
                             user = await user_manager.create(user_create)
-                            await user_db.add_oauth_account(user, provider, discord_id)
+                            await user_db.add_oauth_account(user, {"oauth_name": provider, "access_token": access_token, "account_id": discord_id, "account_email": user_email})
                         finally:
                             # Restore original validation
                             user_manager.validate_password = original_validate
                 
+                user = await user_manager.set_avatar(user, discord_avatar_source(discord_id, discord_avatar))
+                # Done with the database: the connection goes back before the redirect is sent
+                await user_db.session.release()
+
                 # Generate JWT token
                 jwt_strategy = get_jwt_strategy()
                 token = await jwt_strategy.write_token(user)
+                await audit_writer.record(f"oauth:{provider}", "success", email=user.email, user_id=user.id, request=request)
+                activity_tracker.touch(user.id, login=True)
                 
                 # Redirect to frontend with token
                 token_url = f"{FRONTEND_URL}/login?token={token}"
@@ -242,16 +344,23 @@ async def oauth_callback(
         
         # Handle other OAuth providers (Google, etc.) with httpx-oauth
         else:
+            provider_dependency = dependency(f"oauth:{provider}")
+            
             # Exchange code for access token
-            access_token_response = await oauth_client.get_access_token(
-                code,
-                callback_redirect_uri,
+            access_token_response = await provider_dependency.call(
+                lambda timeout: oauth_client.get_access_token(code, callback_redirect_uri)
             )
             
-            # Get user info from OAuth provider
-            user_id, user_email = await oauth_client.get_id_email(
-                access_token_response["access_token"]
-            )
+            # Get user info from OAuth provider (and the profile photo, when the client can read it)
+            if hasattr(oauth_client, "get_id_email_avatar"):
+                user_id, user_email, avatar_source = await provider_dependency.call(
+                    lambda timeout: oauth_client.get_id_email_avatar(access_token_response["access_token"])
+                )
+            else:
+                user_id, user_email = await provider_dependency.call(
+                    lambda timeout: oauth_client.get_id_email(access_token_response["access_token"])
+                )
+                avatar_source = None
             
             # Get or create user using proper dependency injection
             async for user_manager in get_user_manager(user_db):
@@ -267,7 +376,7 @@ async def oauth_callback(
                     try:
                         user = await user_manager.get_by_email(user_email)
                         # Link OAuth account to existing user
-                        await user_db.add_oauth_account(user, provider, user_id)
+                        await user_db.add_oauth_account(user, {"oauth_name": provider, "access_token": access_token_response["access_token"], "account_id": user_id, "account_email": user_email})
                     except Exception:
                         # Create new user with random password (OAuth users don't use password)
                         import secrets
@@ -289,14 +398,20 @@ async def oauth_callback(
                         user_manager.validate_password = skip_validation
                         try:
                             user = await user_manager.create(user_create)
-                            await user_db.add_oauth_account(user, provider, user_id)
+                            await user_db.add_oauth_account(user, {"oauth_name": provider, "access_token": access_token_response["access_token"], "account_id": user_id, "account_email": user_email})
                         finally:
                             # Restore original validation
                             user_manager.validate_password = original_validate
                 
+                user = await user_manager.set_avatar(user, avatar_source)
+                # Done with the database: the connection goes back before the redirect is sent
+                await user_db.session.release()
+
                 # Generate JWT token
                 jwt_strategy = get_jwt_strategy()
                 token = await jwt_strategy.write_token(user)
+                await audit_writer.record(f"oauth:{provider}", "success", email=user.email, user_id=user.id, request=request)
+                activity_tracker.touch(user.id, login=True)
                 
                 # Redirect to frontend with token
                 token_url = f"{FRONTEND_URL}/login?token={token}"
@@ -304,8 +419,15 @@ async def oauth_callback(
                 
     except ValueError as e:
         # Handle validation errors
+        await audit_writer.record(f"oauth:{provider}", "validation_error", request=request)
         error_url = f"{FRONTEND_URL}/login?error=validation_error"
         return RedirectResponse(url=error_url)
+    except DependencyUnavailable as e:
+        # Provider circuit open, too many calls in flight, or out of request budget
+        print(f"⚠️  OAuth {provider} callback failed fast: {str(e)}")
+        await audit_writer.record(f"oauth:{provider}", "provider_unavailable", request=request)
+        error_url = f"{FRONTEND_URL}/login?error=provider_unavailable"
+        return RedirectResponse(url=error_url)
     except httpx.HTTPStatusError as e:
         # Handle HTTP errors from OAuth API
         if e.response.status_code == 400:
@@ -314,10 +436,12 @@ async def oauth_callback(
             error_msg = "invalid_token"
         else:
             error_msg = "oauth_failed"
+        await audit_writer.record(f"oauth:{provider}", error_msg, request=request)
         error_url = f"{FRONTEND_URL}/login?error={error_msg}"
         return RedirectResponse(url=error_url)
     except Exception:
         # Handle all other errors - do not expose error details
+        await audit_writer.record(f"oauth:{provider}", "oauth_failed", request=request)
         error_url = f"{FRONTEND_URL}/login?error=oauth_failed"
         return RedirectResponse(url=error_url)
 
@@ -0,0 +1 @@
+# Microbenchmarks for hot paths of the auth service (run from backend-auth/ with python -m benchmarks.<name>)
@@ -0,0 +1,67 @@
+"""
+read_token throughput: fastapi-users' JWTStrategy versus the per-worker
+CachedJWTStrategy used by the auth backend.
+
+Usage (from backend-auth/):
+    python -m benchmarks.read_token [--tokens 100] [--iterations 50000]
+
+The user manager is a stub whose get() returns immediately, so the numbers are
+the token handling alone (the real one adds a primary-key lookup per request).
+Each round cycles through --tokens distinct tokens, like that many clients
+repeating requests with their bearer token.
+"""
+import argparse
+import asyncio
+import time
+import uuid
+
+from fastapi_users.authentication import JWTStrategy
+
+from users import JWT_LIFETIME_SECONDS, SECRET, CachedJWTStrategy
+
+
+class _StubUser:
+    def __init__(self, user_id: uuid.UUID):
+        self.id = user_id
+
+
+class _StubUserManager:
+    def parse_id(self, value) -> uuid.UUID:
+        return uuid.UUID(value)
+
+    async def get(self, user_id: uuid.UUID) -> _StubUser:
+        return _StubUser(user_id)
+
+
+async def _run(strategy, tokens: list[str], iterations: int) -> float:
+    manager = _StubUserManager()
+    started = time.perf_counter()
+    for index in range(iterations):
+        user = await strategy.read_token(tokens[index % len(tokens)], manager)
+        assert user is not None
+    return iterations / (time.perf_counter() - started)
+
+
+async def main(token_count: int, iterations: int) -> None:
+    baseline = JWTStrategy(secret=SECRET, lifetime_seconds=JWT_LIFETIME_SECONDS)
+    cached = CachedJWTStrategy(secret=SECRET, lifetime_seconds=JWT_LIFETIME_SECONDS)
+    tokens = [await baseline.write_token(_StubUser(uuid.uuid4())) for _ in range(token_count)]
+
+    # Warm-up (and fills the cache, as steady-state traffic would)
+    await _run(baseline, tokens, min(iterations, 1000))
+    await _run(cached, tokens, min(iterations, 1000))
+
+    baseline_rate = await _run(baseline, tokens, iterations)
+    cached_rate = await _run(cached, tokens, iterations)
+    print(f"⏱️  read_token, {token_count} distinct tokens, {iterations} calls")
+    print(f"   JWTStrategy        {baseline_rate:12,.0f} calls/s  {1e6 / baseline_rate:7.2f} µs/call")
+    print(f"   CachedJWTStrategy  {cached_rate:12,.0f} calls/s  {1e6 / cached_rate:7.2f} µs/call  ({cached_rate / baseline_rate:.1f}x)")
+    print(f"   cache: {cached.stats()}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--tokens", type=int, default=100, help="Distinct bearer tokens")
+    parser.add_argument("--iterations", type=int, default=50000, help="read_token calls per strategy")
+    args = parser.parse_args()
+    asyncio.run(main(args.tokens, args.iterations))
@@ -0,0 +1,119 @@
+"""
+Token checks over the internal token socket versus the HTTP path.
+
+Usage (from backend-auth/):
+    python -m benchmarks.token_socket [--users 100] [--requests 20000] [--concurrency 32] [--unix]
+
+Starts the app on testing.harness (SQLite, or HARNESS_POSTGRES_URL) behind a
+real uvicorn server on localhost, plus the token socket (TCP, or a Unix socket
+with --unix), and answers the same question each way for --users signed-in users:
+
+- HTTP:   GET /users/me with the bearer token (keep-alive, --concurrency
+          requests in flight), i.e. what a co-located service can do today,
+- CLAIMS: the same user lookup over one pipelined socket connection with
+          --concurrency requests in flight,
+- VALIDATE: token check only, no database, same pipelining.
+
+Client and server share one process and event loop, so the numbers are a
+per-request cost comparison rather than a capacity figure.
+"""
+import argparse
+import asyncio
+import os
+import statistics
+import tempfile
+import time
+
+import httpx
+
+from testing.harness import AuthServiceHarness, bearer
+
+
+def _summary(label: str, latencies: list[float], elapsed: float, errors: int) -> str:
+    latencies.sort()
+    p99 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))]
+    return (f"   {label:<9} {len(latencies) / elapsed:10,.0f} req/s  mean {statistics.fmean(latencies):7.3f}ms  "
+            f"p99 {p99:7.3f}ms  errors {errors}")
+
+
+async def _drive(operation, requests: int, concurrency: int) -> tuple[list[float], float, int]:
+    latencies: list[float] = []
+    errors = 0
+    counter = iter(range(requests))
+
+    async def worker():
+        nonlocal errors
+        for index in counter:
+            started = time.perf_counter()
+            if not await operation(index):
+                errors += 1
+            latencies.append((time.perf_counter() - started) * 1000)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    return latencies, time.perf_counter() - started, errors
+
+
+async def main(args) -> None:
+    socket_dir = tempfile.mkdtemp(prefix="token-socket-")
+    env = {"IDEMPOTENCY_ENABLED": "false", "TOKEN_SOCKET_PORT": "0", "TOKEN_SOCKET_PATH": ""}
+    if args.unix:
+        env["TOKEN_SOCKET_PATH"] = os.path.join(socket_dir, "token.sock")
+    else:
+        env["TOKEN_SOCKET_PORT"] = str(args.socket_port)
+    async with AuthServiceHarness(env=env) as harness:
+        import uvicorn
+
+        from token_socket import OP_CLAIMS, OP_VALIDATE, STATUS_OK, TokenSocketClient
+
+        population = await harness.seed_users(args.users, verified_ratio=1.0, inactive_ratio=0.0)
+        tokens = [await harness.login(**population.credentials(index)) for index in range(args.users)]
+
+        server = uvicorn.Server(uvicorn.Config(harness.app, host="127.0.0.1", port=args.http_port, lifespan="off",
+                                               log_level="warning", access_log=False))
+        serving = asyncio.create_task(server.serve())
+        while not server.started:
+            await asyncio.sleep(0.01)
+
+        http = httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.http_port}",
+                                 limits=httpx.Limits(max_connections=args.concurrency))
+        client = await TokenSocketClient.connect(path=env["TOKEN_SOCKET_PATH"], port=args.socket_port)
+        try:
+            async def over_http(index: int) -> bool:
+                response = await http.get("/users/me", headers=bearer(tokens[index % len(tokens)]))
+                return response.status_code == 200
+
+            async def claims(index: int) -> bool:
+                status, _ = await client.request(OP_CLAIMS, tokens[index % len(tokens)])
+                return status == STATUS_OK
+
+            async def validate(index: int) -> bool:
+                status, _ = await client.request(OP_VALIDATE, tokens[index % len(tokens)])
+                return status == STATUS_OK
+
+            transport = "unix socket" if args.unix else "TCP socket"
+            print(f"⏱️  {args.requests} requests per path, {args.concurrency} in flight, {args.users} users, {transport}")
+            for label, operation in (("HTTP", over_http), ("CLAIMS", claims), ("VALIDATE", validate)):
+                # Warm-up: connections, token cache, statement cache
+                await _drive(operation, min(args.requests, 500), args.concurrency)
+                latencies, elapsed, errors = await _drive(operation, args.requests, args.concurrency)
+                print(_summary(label, latencies, elapsed, errors))
+            from token_socket import token_socket_server
+            print(f"   socket: {token_socket_server.stats()}")
+        finally:
+            await client.close()
+            await http.aclose()
+            server.should_exit = True
+            await serving
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--users", type=int, default=100, help="Signed-in users whose tokens are checked")
+    parser.add_argument("--requests", type=int, default=20000, help="Requests per path")
+    parser.add_argument("--concurrency", type=int, default=32, help="Requests in flight")
+    parser.add_argument("--unix", action="store_true", help="Use a Unix socket instead of TCP for the token socket")
+    parser.add_argument("--http-port", type=int, default=18000)
+    parser.add_argument("--socket-port", type=int, default=18001)
+    args = parser.parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,54 @@
+"""
+Script to calibrate Argon2 password hashing cost for this host
+Usage: python calibrate_password_hash.py [--target-ms 250] [--max-memory-kib 262144] [--parallelism 1] [--write]
+
+Run it on the hardware the auth workers run on. With --write the chosen
+parameters are saved to PASSWORD_HASH_PARAMS_FILE and used by the app (and
+create_admin_user.py) on the next start; existing hashes are upgraded on login.
+"""
+import argparse
+import json
+
+from password_hashing import PASSWORD_HASH_PARAMS_FILE, PASSWORD_HASH_TARGET_MS, calibrate, load_hash_parameters, measure_hash_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark Argon2id on this host and pick hash parameters")
+    parser.add_argument("--target-ms", type=float, default=PASSWORD_HASH_TARGET_MS, help="Target time per hash in milliseconds")
+    parser.add_argument("--max-memory-kib", type=int, default=262144, help="Upper bound for memory_cost (KiB)")
+    parser.add_argument("--min-memory-kib", type=int, default=19456, help="Lower bound for memory_cost (KiB)")
+    parser.add_argument("--parallelism", type=int, default=1, help="Argon2 lanes per hash")
+    parser.add_argument("--samples", type=int, default=5, help="Hashes timed per candidate (median is used)")
+    parser.add_argument("--write", action="store_true", help=f"Save the result to {PASSWORD_HASH_PARAMS_FILE}")
+    args = parser.parse_args()
+
+    current = load_hash_parameters()
+    current_ms = measure_hash_ms(current["time_cost"], current["memory_cost"], current["parallelism"], args.samples)
+    print(f"Current parameters: {current} -> {current_ms:.1f}ms per hash")
+
+    print(f"Calibrating for {args.target_ms:.0f}ms per hash...")
+    result = calibrate(
+        target_ms=args.target_ms,
+        max_memory_kib=args.max_memory_kib,
+        min_memory_kib=args.min_memory_kib,
+        parallelism=args.parallelism,
+        samples=args.samples,
+    )
+    print(f"✅ Selected: time_cost={result['time_cost']} memory_cost={result['memory_cost']} "
+          f"parallelism={result['parallelism']} -> {result['measured_ms']}ms per hash")
+    if result["measured_ms"] > args.target_ms:
+        print(f"⚠️  Even the cheapest allowed parameters exceed {args.target_ms:.0f}ms on this host; "
+              f"lower --min-memory-kib or raise --target-ms")
+    # One login costs roughly one hash of CPU time on one core
+    print(f"   ≈ {1000 / result['measured_ms']:.1f} logins/second per core")
+
+    if args.write:
+        with open(PASSWORD_HASH_PARAMS_FILE, "w") as f:
+            json.dump(result, f, indent=2)
+        print(f"✅ Written to {PASSWORD_HASH_PARAMS_FILE}. Restart the auth workers to apply.")
+    else:
+        print("Run again with --write to apply.")
+
+
+if __name__ == "__main__":
+    main()
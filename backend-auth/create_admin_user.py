@@ -1,16 +1,20 @@
 """
 Script to create or update an admin user
-Usage: python create_admin_user.py <email> <password>
+Usage: python create_admin_user.py <email> [password]
+
+Without a password an existing user is promoted and keeps their password.
+
+Goes through the same user database layer as the service, so with
+SHARD_DATABASE_URLS set the user is found and written on its shard.
 """
 import asyncio
 import os
 import sys
 
-from fastapi_users.password import PasswordHelper
-from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine, async_sessionmaker
-from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 
-from db import User, Base
+from db import SHARD_DATABASE_URLS, OAuthAccount, User, UserDatabase
+from password_hashing import password_helper
 
 # Get database URL from environment
 DATABASE_URL = os.getenv(
@@ -22,55 +26,57 @@ DATABASE_URL = os.getenv(
 engine = create_async_engine(DATABASE_URL)
 async_session_maker = async_sessionmaker(engine, expire_on_commit=False)
 
-password_helper = PasswordHelper()
+
+def user_database(session):
+    """The user table on DATABASE_URL, or on the shards when users are sharded."""
+    if SHARD_DATABASE_URLS:
+        from sharding import ShardedUserDatabase, shard_set
+        return ShardedUserDatabase(session, shard_set)
+    return UserDatabase(session, User, OAuthAccount)
 
 
 async def create_or_update_admin(email: str, password: str):
     """Create or update a user to be an admin"""
     async with async_session_maker() as session:
+        user_db = user_database(session)
         # Check if user exists
-        result = await session.execute(
-            select(User).where(User.email == email)
-        )
-        user = result.scalar_one_or_none()
+        user = await user_db.get_by_email(email)
         
         if user:
             print(f"User {email} already exists. Updating to admin...")
             # Update existing user
-            user.role = "admin"
-            user.is_verified = True
-            user.is_active = True
+            update_dict = {
+                "role": "admin",
+                "is_verified": True,
+                "is_active": True,
+                "profile_version": User.profile_version + 1,
+            }
             
             # Update password if provided
             if password:
-                hashed_password = password_helper.hash(password)
-                user.hashed_password = hashed_password
+                update_dict["hashed_password"] = password_helper.hash(password)
                 print("Password updated.")
             
-            await session.commit()
+            # Records the user.role_changed event with the write
+            user = await user_db.update(user, update_dict)
             print(f"✅ User {email} updated to admin successfully!")
+        elif not password:
+            print(f"❌ User {email} does not exist; a password is needed to create it")
+            sys.exit(1)
         else:
             print(f"Creating new admin user {email}...")
             # Create new user
-            hashed_password = password_helper.hash(password)
-            
-            new_user = User(
-                email=email,
-                hashed_password=hashed_password,
-                role="admin",
-                is_verified=True,
-                is_active=True
-            )
-            
-            session.add(new_user)
-            await session.commit()
+            user = await user_db.create({
+                "email": email,
+                "hashed_password": password_helper.hash(password),
+                "role": "admin",
+                "is_verified": True,
+                "is_active": True,
+            })
             print(f"✅ Admin user {email} created successfully!")
         
         # Verify the user
-        result = await session.execute(
-            select(User).where(User.email == email)
-        )
-        user = result.scalar_one()
+        user = await user_db.get(user.id)
         print(f"\nUser details:")
         print(f"  Email: {user.email}")
         print(f"  Role: {user.role}")
@@ -79,18 +85,21 @@ async def create_or_update_admin(email: str, password: str):
 
 
 async def main():
-    if len(sys.argv) < 3:
-        print("Usage: python create_admin_user.py <email> <password>")
+    if len(sys.argv) < 2:
+        print("Usage: python create_admin_user.py <email> [password]")
         print("Example: python create_admin_user.py admin@example.com mypassword")
         sys.exit(1)
     
     email = sys.argv[1]
-    password = sys.argv[2]
+    password = sys.argv[2] if len(sys.argv) > 2 else ""
     
     await create_or_update_admin(email, password)
     
-    # Close the engine
+    # Close the engines
     await engine.dispose()
+    if SHARD_DATABASE_URLS:
+        from sharding import shard_set
+        await shard_set.dispose()
 
 
 if __name__ == "__main__":
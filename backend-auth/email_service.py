@@ -1,9 +1,14 @@
+import asyncio
 import os
 import aiosmtplib
+from contextlib import asynccontextmanager
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from typing import Optional
 
+from resilience import DependencyUnavailable, dependency
+from tracing import traced
+
 # SMTP Configuration
 SMTP_HOST = os.getenv("SMTP_HOST", "smtp.gmail.com")
 SMTP_PORT = int(os.getenv("SMTP_PORT", "587"))
@@ -12,6 +17,16 @@ SMTP_PASSWORD = os.getenv("SMTP_PASSWORD", "")
 EMAILS_FROM_EMAIL = os.getenv("EMAILS_FROM_EMAIL", SMTP_USERNAME)
 EMAILS_FROM_NAME = os.getenv("EMAILS_FROM_NAME", "Nova‑XFinity Support")
 EMAILS_ENABLED = os.getenv("EMAILS_ENABLED", "true").lower() == "true"
+SMTP_USE_TLS = os.getenv("SMTP_USE_TLS", "true").lower() == "true"
+# Upper bound for connect / each SMTP command; a request's own deadline can shorten it
+SMTP_TIMEOUT_SECONDS = float(os.getenv("SMTP_TIMEOUT_SECONDS", "10"))
+
+# SMTP connection pool (used for bulk sends)
+SMTP_POOL_SIZE = int(os.getenv("SMTP_POOL_SIZE", "10"))
+SMTP_POOL_MAX_MESSAGES_PER_CONNECTION = int(os.getenv("SMTP_POOL_MAX_MESSAGES_PER_CONNECTION", "100"))
+
+# Circuit breaker / bulkhead shared by every SMTP send in this worker
+smtp_dependency = dependency("smtp", timeout=SMTP_TIMEOUT_SECONDS, bulkhead_limit=100)
 
 # Frontend URL for email links
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
@@ -73,6 +88,126 @@ def validate_smtp_config() -> tuple[bool, list[str]]:
 SMTP_CONFIG_VALID, SMTP_CONFIG_WARNINGS = validate_smtp_config()
 
 
+def build_message(
+    to_email: str,
+    subject: str,
+    html_content: str,
+    text_content: Optional[str] = None,
+) -> MIMEMultipart:
+    """Build a multipart (text + HTML) email message."""
+    message = MIMEMultipart("alternative")
+    message["From"] = f"{EMAILS_FROM_NAME} <{EMAILS_FROM_EMAIL}>"
+    message["To"] = to_email
+    message["Subject"] = subject
+    
+    # Add text and HTML parts
+    if text_content:
+        text_part = MIMEText(text_content, "plain")
+        message.attach(text_part)
+    
+    html_part = MIMEText(html_content, "html")
+    message.attach(html_part)
+    return message
+
+
+class SMTPConnectionPool:
+    """
+    Pool of authenticated SMTP connections for bulk sending.
+    
+    ``aiosmtplib.send`` opens, authenticates and closes a connection for every
+    message. The pool keeps up to ``size`` connections open, which also caps the
+    number of concurrent sends, and recycles each connection after
+    ``max_messages_per_connection`` messages (most providers limit this).
+    """
+    
+    def __init__(
+        self,
+        size: int = SMTP_POOL_SIZE,
+        max_messages_per_connection: int = SMTP_POOL_MAX_MESSAGES_PER_CONNECTION,
+    ):
+        self.size = size
+        self.max_messages_per_connection = max_messages_per_connection
+        self._idle: asyncio.LifoQueue = asyncio.LifoQueue()
+        self._slots = asyncio.Semaphore(size)
+        self._sent_on: dict[int, int] = {}
+        self._closed = False
+    
+    async def _connect(self) -> aiosmtplib.SMTP:
+        smtp = aiosmtplib.SMTP(
+            hostname=SMTP_HOST,
+            port=SMTP_PORT,
+            username=SMTP_USERNAME,
+            password=SMTP_PASSWORD,
+            use_tls=SMTP_USE_TLS,
+            timeout=SMTP_TIMEOUT_SECONDS,
+        )
+        await smtp.connect()
+        self._sent_on[id(smtp)] = 0
+        return smtp
+    
+    async def _discard(self, smtp: aiosmtplib.SMTP) -> None:
+        self._sent_on.pop(id(smtp), None)
+        try:
+            if smtp.is_connected:
+                await smtp.quit()
+        except Exception:
+            smtp.close()
+    
+    @asynccontextmanager
+    async def _checkout(self):
+        """Check out a connected SMTP client, opening one if none is idle (the caller holds a pool slot)."""
+        if self._closed:
+            raise RuntimeError("SMTP connection pool is closed")
+        smtp = None
+        while not self._idle.empty():
+            candidate = self._idle.get_nowait()
+            if candidate.is_connected:
+                smtp = candidate
+                break
+            await self._discard(candidate)
+        if smtp is None:
+            smtp = await self._connect()
+        try:
+            yield smtp
+        except BaseException:
+            await self._discard(smtp)
+            raise
+        if self._closed or self._sent_on.get(id(smtp), 0) >= self.max_messages_per_connection:
+            await self._discard(smtp)
+        else:
+            self._idle.put_nowait(smtp)
+    
+    @traced("smtp.send", "client", root=True)
+    async def send(self, message: MIMEMultipart) -> None:
+        """
+        Send a message over a pooled connection, reconnecting once if the server dropped it.
+        
+        Runs under the SMTP circuit breaker once a pool slot is free, so time spent
+        waiting for a connection does not count against the SMTP timeout. Raises
+        DependencyUnavailable without sending while the circuit is open.
+        """
+        async with self._slots:
+            await smtp_dependency.call(lambda timeout: self._send(message, timeout))
+    
+    async def _send(self, message: MIMEMultipart, timeout: float) -> None:
+        for attempt in range(2):
+            try:
+                async with self._checkout() as smtp:
+                    await smtp.send_message(message, timeout=timeout)
+                    self._sent_on[id(smtp)] = self._sent_on.get(id(smtp), 0) + 1
+                return
+            except aiosmtplib.SMTPServerDisconnected:
+                if attempt == 1:
+                    raise
+    
+    async def close(self) -> None:
+        """Close every idle connection. Checked-out connections close on release."""
+        self._closed = True
+        while not self._idle.empty():
+            await self._discard(self._idle.get_nowait())
+
+
+@traced("smtp.send", "client", root=True)
 async def send_email(
     to_email: str,
     subject: str,
@@ -110,28 +245,20 @@ async def send_email(
     
     try:
         # Create message
-        message = MIMEMultipart("alternative")
-        message["From"] = f"{EMAILS_FROM_NAME} <{EMAILS_FROM_EMAIL}>"
-        message["To"] = to_email
-        message["Subject"] = subject
-        
-        # Add text and HTML parts
-        if text_content:
-            text_part = MIMEText(text_content, "plain")
-            message.attach(text_part)
-        
-        html_part = MIMEText(html_content, "html")
-        message.attach(html_part)
+        message = build_message(to_email, subject, html_content, text_content)
         
         # Send email
         print(f"📧 Sending verification email to: {to_email}")
-        smtp_response = await aiosmtplib.send(
-            message,
-            hostname=SMTP_HOST,
-            port=SMTP_PORT,
-            username=SMTP_USERNAME,
-            password=SMTP_PASSWORD,
-            use_tls=True,
+        smtp_response = await smtp_dependency.call(
+            lambda timeout: aiosmtplib.send(
+                message,
+                hostname=SMTP_HOST,
+                port=SMTP_PORT,
+                username=SMTP_USERNAME,
+                password=SMTP_PASSWORD,
+                use_tls=SMTP_USE_TLS,
+                timeout=timeout,
+            )
         )
         
         print(f"📤 SMTP Status: success")
@@ -139,6 +266,10 @@ async def send_email(
         print(f"   SMTP Response: {smtp_response}")
         return True
         
+    except DependencyUnavailable as e:
+        # Fail fast while SMTP is down instead of holding the request open
+        print(f"❌ [EMAIL ERROR] Not sending email to {to_email}: {str(e)}")
+        return False
     except Exception as e:
         print(f"❌ Failed to send email to {to_email}: {str(e)}")
         import traceback
@@ -147,17 +278,8 @@ async def send_email(
         return False
 
 
-async def send_verification_email(email: str, token: str) -> bool:
-    """Send email verification email."""
-    print(f"📧 Sending verification email to: {email}")
-    print(f"   Token: {token[:20]}...")
-    print(f"   SMTP Host: {SMTP_HOST}")
-    print(f"   SMTP Port: {SMTP_PORT}")
-    print(f"   SMTP Username: {SMTP_USERNAME}")
-    print(f"   SMTP Password: {'*' * len(SMTP_PASSWORD) if SMTP_PASSWORD else 'NOT SET'}")
-    print(f"   Emails Enabled: {EMAILS_ENABLED}")
-    print(f"   SMTP Config Valid: {SMTP_CONFIG_VALID}")
-    
+def render_verification_email(token: str) -> tuple[str, str, str]:
+    """Render the verification email. Returns (subject, html_content, text_content)."""
     verification_url = f"{FRONTEND_URL}/verify-email?token={token}"
     
     html_content = f"""
@@ -196,9 +318,25 @@ async def send_verification_email(email: str, token: str) -> bool:
     This link will expire in 24 hours.
     """
     
+    return "Verify Your Email Address", html_content, text_content
+
+
+async def send_verification_email(email: str, token: str) -> bool:
+    """Send email verification email."""
+    print(f"📧 Sending verification email to: {email}")
+    print(f"   Token: {token[:20]}...")
+    print(f"   SMTP Host: {SMTP_HOST}")
+    print(f"   SMTP Port: {SMTP_PORT}")
+    print(f"   SMTP Username: {SMTP_USERNAME}")
+    print(f"   SMTP Password: {'*' * len(SMTP_PASSWORD) if SMTP_PASSWORD else 'NOT SET'}")
+    print(f"   Emails Enabled: {EMAILS_ENABLED}")
+    print(f"   SMTP Config Valid: {SMTP_CONFIG_VALID}")
+    
+    subject, html_content, text_content = render_verification_email(token)
+    
     result = await send_email(
         to_email=email,
-        subject="Verify Your Email Address",
+        subject=subject,
         html_content=html_content,
         text_content=text_content,
     )
@@ -211,8 +349,8 @@ async def send_verification_email(email: str, token: str) -> bool:
     return result
 
 
-async def send_password_reset_email(email: str, token: str) -> bool:
-    """Send password reset email."""
+def render_password_reset_email(token: str) -> tuple[str, str, str]:
+    """Render the password reset email. Returns (subject, html_content, text_content)."""
     reset_url = f"{FRONTEND_URL}/reset-password?token={token}"
     
     html_content = f"""
@@ -252,9 +390,16 @@ async def send_password_reset_email(email: str, token: str) -> bool:
     This link will expire in 1 hour.
     """
     
+    return "Reset Your Password", html_content, text_content
+
+
+async def send_password_reset_email(email: str, token: str) -> bool:
+    """Send password reset email."""
+    subject, html_content, text_content = render_password_reset_email(token)
+    
     return await send_email(
         to_email=email,
-        subject="Reset Your Password",
+        subject=subject,
         html_content=html_content,
         text_content=text_content,
     )
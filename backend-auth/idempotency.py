@@ -0,0 +1,376 @@
+"""
+Idempotency for registration, password reset requests and OAuth callbacks.
+
+Double-clicks and client retries on these endpoints repeat expensive work
+(password hashing, SMTP sends, provider token exchanges that then fail
+because the code was already used). IdempotencyMiddleware keys such requests:
+
+- POST /auth/register and POST /auth/forgot-password by the client's
+  Idempotency-Key header (requests without one are not deduplicated),
+- GET /auth/{provider}/callback by the provider, the OAuth code and state and
+  the browser's cookies, for concurrent duplicates only (see below).
+
+The first request with a key runs; its response is stored for the key's TTL
+and replayed (with Idempotent-Replayed: true) to later requests with the same
+key. Duplicates that arrive while the first is still running wait for it
+instead of redoing the work. Reusing a key with a different body is answered
+with 422. 5xx, 408 and 429 responses are not stored, so a retry runs again.
+
+Responses that carry credentials (a Set-Cookie header, or a redirect with a
+token in its URL) are never stored. OAuth callbacks answer with exactly such a
+redirect, so they are only merged while the first request is in flight, in
+this worker's memory: a callback URL seen later (logs, history, a proxy) does
+not replay a session, and no token is written to idempotency_record.
+
+Stores: "memory" (per worker, the default) or "database" (the
+idempotency_record table, shared by all workers; duplicates on other workers
+poll the row until the first request completes).
+"""
+import asyncio
+import hashlib
+import json
+import os
+import re
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from urllib.parse import parse_qs
+
+from sqlalchemy import delete, update
+from sqlalchemy.exc import IntegrityError
+
+IDEMPOTENCY_ENABLED = os.getenv("IDEMPOTENCY_ENABLED", "true").lower() == "true"
+# "memory" (per worker) or "database" (shared across workers)
+IDEMPOTENCY_BACKEND = os.getenv("IDEMPOTENCY_BACKEND", "memory").lower()
+IDEMPOTENCY_TTL_SECONDS = float(os.getenv("IDEMPOTENCY_TTL_SECONDS", "86400"))
+# How long a duplicate waits for the first request before giving up with 409
+IDEMPOTENCY_WAIT_SECONDS = float(os.getenv("IDEMPOTENCY_WAIT_SECONDS", "30"))
+IDEMPOTENCY_MAX_ENTRIES = int(os.getenv("IDEMPOTENCY_MAX_ENTRIES", "20000"))
+IDEMPOTENCY_MAX_BODY_BYTES = 64 * 1024
+IDEMPOTENCY_KEY_MAX_LENGTH = 255
+_DATABASE_POLL_INTERVAL = 0.1
+
+# (method, path pattern, key source); "oauth_code" routes are merged in flight only
+IDEMPOTENT_ROUTES = (
+    ("POST", re.compile(r"^/auth/register$"), "header"),
+    ("POST", re.compile(r"^/auth/forgot-password$"), "header"),
+    ("GET", re.compile(r"^/auth/(?P<provider>[^/]+)/callback$"), "oauth_code"),
+)
+_UNCACHEABLE_STATUSES = {408, 429}
+_TOKEN_IN_URL = re.compile(r"[?&#](access_|refresh_|id_)?token=", re.IGNORECASE)
+
+OWNER, REPLAY, MISMATCH, BUSY = "owner", "replay", "mismatch", "busy"
+
+stats = {"owners": 0, "replayed": 0, "coalesced": 0, "mismatches": 0, "busy": 0}
+
+
+def _cacheable(status: int) -> bool:
+    return status < 500 and status not in _UNCACHEABLE_STATUSES
+
+
+def _carries_credentials(headers: list) -> bool:
+    for name, value in headers:
+        name = name.lower()
+        if name == "set-cookie" or (name == "location" and _TOKEN_IN_URL.search(value)):
+            return True
+    return False
+
+
+def _aware(value: datetime) -> datetime:
+    # SQLite returns naive datetimes for DateTime(timezone=True)
+    return value if value.tzinfo is not None else value.replace(tzinfo=timezone.utc)
+
+
+class _MemoryEntry:
+    __slots__ = ("fingerprint", "expires_at", "done", "response")
+
+    def __init__(self, fingerprint: str, ttl: float):
+        self.fingerprint = fingerprint
+        self.expires_at = time.monotonic() + ttl
+        self.done = asyncio.Event()
+        self.response: Optional[dict] = None
+
+
+class MemoryIdempotencyStore:
+    """In-flight requests and stored responses of this worker (responses in a bounded LRU)."""
+
+    def __init__(self, max_entries: int = IDEMPOTENCY_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._in_flight: dict[str, _MemoryEntry] = {}
+        self._completed: OrderedDict[str, _MemoryEntry] = OrderedDict()
+
+    async def begin(self, key: str, fingerprint: str, ttl: float) -> tuple[str, Optional[dict]]:
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        while True:
+            entry = self._in_flight.get(key)
+            if entry is None:
+                entry = self._completed.get(key)
+                if entry is not None and entry.expires_at < time.monotonic():
+                    del self._completed[key]
+                    entry = None
+            if entry is None:
+                self._in_flight[key] = _MemoryEntry(fingerprint, ttl)
+                return OWNER, None
+            if entry.fingerprint != fingerprint:
+                return MISMATCH, None
+            if entry.done.is_set():
+                return REPLAY, entry.response
+            stats["coalesced"] += 1
+            try:
+                await asyncio.wait_for(entry.done.wait(), timeout=max(0.0, deadline - time.monotonic()))
+            except asyncio.TimeoutError:
+                return BUSY, None
+            if entry.response is not None:
+                return REPLAY, entry.response
+            # Not answered with a usable response: run again as the new owner
+
+    async def complete(self, key: str, response: Optional[dict], keep: bool = True) -> None:
+        """Hand the response to waiting duplicates; keep=False does not store it for later ones."""
+        entry = self._in_flight.pop(key, None)
+        if entry is None:
+            return
+        if response is not None:
+            entry.response = response
+            if keep:
+                self._completed[key] = entry
+                while len(self._completed) > self.max_entries:
+                    self._completed.popitem(last=False)
+        entry.done.set()
+
+
+class DatabaseIdempotencyStore:
+    """idempotency_record rows shared by every worker; same-worker duplicates wait in memory first."""
+
+    def __init__(self):
+        self._local = MemoryIdempotencyStore()
+
+    async def begin(self, key: str, fingerprint: str, ttl: float) -> tuple[str, Optional[dict]]:
+        outcome, response = await self._local.begin(key, fingerprint, ttl)
+        if outcome != OWNER:
+            return outcome, response
+        try:
+            outcome, response = await self._claim(key, fingerprint, ttl)
+        except BaseException:
+            await self._local.complete(key, None)
+            raise
+        if outcome != OWNER:
+            await self._local.complete(key, response if outcome == REPLAY else None)
+        return outcome, response
+
+    async def _claim(self, key: str, fingerprint: str, ttl: float) -> tuple[str, Optional[dict]]:
+        from db import IdempotencyRecord, async_session_maker
+
+        deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+        waited = False
+        while True:
+            now = datetime.now(timezone.utc)
+            async with async_session_maker() as session:
+                session.add(IdempotencyRecord(key=key, fingerprint=fingerprint, expires_at=now + timedelta(seconds=ttl)))
+                try:
+                    await session.commit()
+                    return OWNER, None
+                except IntegrityError:
+                    await session.rollback()
+                record = await session.get(IdempotencyRecord, key)
+                if record is None:
+                    continue
+                if record.fingerprint != fingerprint:
+                    return MISMATCH, None
+                abandoned_before = now - timedelta(seconds=IDEMPOTENCY_WAIT_SECONDS)
+                abandoned = record.status == "in_progress" and _aware(record.created_at) < abandoned_before
+                if _aware(record.expires_at) < now or abandoned:
+                    # Expired, or its owner died mid-request: delete (unless another worker just did) and claim again
+                    await session.execute(delete(IdempotencyRecord).where(
+                        IdempotencyRecord.key == key,
+                        (IdempotencyRecord.expires_at < now)
+                        | ((IdempotencyRecord.status == "in_progress") & (IdempotencyRecord.created_at < abandoned_before)),
+                    ))
+                    await session.commit()
+                    continue
+                if record.status == "completed":
+                    return REPLAY, {
+                        "status": record.response_status,
+                        "headers": record.response_headers,
+                        "body": record.response_body,
+                    }
+            if not waited:
+                stats["coalesced"] += 1
+                waited = True
+            if time.monotonic() >= deadline:
+                return BUSY, None
+            await asyncio.sleep(_DATABASE_POLL_INTERVAL)
+
+    async def complete(self, key: str, response: Optional[dict]) -> None:
+        from db import IdempotencyRecord, async_session_maker
+
+        try:
+            async with async_session_maker() as session:
+                if response is None:
+                    await session.execute(delete(IdempotencyRecord).where(IdempotencyRecord.key == key))
+                else:
+                    await session.execute(
+                        update(IdempotencyRecord)
+                        .where(IdempotencyRecord.key == key)
+                        .values(
+                            status="completed",
+                            response_status=response["status"],
+                            response_headers=response["headers"],
+                            response_body=response["body"],
+                        )
+                    )
+                await session.commit()
+        except Exception as e:
+            # Duplicates then run again once the record is considered abandoned
+            print(f"⚠️  Could not store idempotent response: {type(e).__name__} - {str(e)}")
+        finally:
+            await self._local.complete(key, response)
+
+
+def _request_key(scope, headers: dict, source: str, match: re.Match) -> tuple[Optional[str], float]:
+    """(store key, ttl), or (None, 0) if the request carries no key. Raises ValueError for unusable keys."""
+    if source == "header":
+        client_key = headers.get(b"idempotency-key", b"").decode("latin-1").strip()
+        if not client_key:
+            return None, 0
+        if len(client_key) > IDEMPOTENCY_KEY_MAX_LENGTH:
+            raise ValueError(f"Idempotency-Key must be at most {IDEMPOTENCY_KEY_MAX_LENGTH} characters")
+        ttl = IDEMPOTENCY_TTL_SECONDS
+    else:
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+        code = query.get("code", [""])[0]
+        if not code or "error" in query:
+            return None, 0
+        # Same code, state and browser: a reload or double-submitted redirect, not someone else's URL
+        state = query.get("state", [""])[0]
+        cookies = hashlib.sha256(headers.get(b"cookie", b"")).hexdigest()
+        client_key = f"{match.group('provider')}:{code}:{state}:{cookies}"
+        ttl = 0
+    # Hashed: keys (and OAuth codes) are never kept in clear
+    digest = hashlib.sha256(f"{scope['method']} {scope['path']}\n{client_key}".encode()).hexdigest()
+    return digest, ttl
+
+
+async def _send_json(send, status: int, detail: str, extra_headers: list = ()) -> None:
+    body = json.dumps({"detail": detail}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": status,
+        "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode()), *extra_headers],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _send_stored(send, response: dict) -> None:
+    headers = [(name.encode("latin-1"), value.encode("latin-1")) for name, value in response["headers"]]
+    await send({
+        "type": "http.response.start",
+        "status": response["status"],
+        "headers": [*headers, (b"idempotent-replayed", b"true")],
+    })
+    await send({"type": "http.response.body", "body": response["body"]})
+
+
+class IdempotencyMiddleware:
+    """Runs a keyed request once and replays its response to duplicates."""
+
+    def __init__(self, app, store=None):
+        self.app = app
+        if store is None:
+            store = DatabaseIdempotencyStore() if IDEMPOTENCY_BACKEND == "database" else MemoryIdempotencyStore()
+        self.store = store
+        # OAuth callbacks: concurrent duplicates on this worker only, nothing kept afterwards
+        self.in_flight_store = MemoryIdempotencyStore()
+
+    def _route(self, scope):
+        for method, pattern, source in IDEMPOTENT_ROUTES:
+            if scope["method"] == method:
+                match = pattern.match(scope["path"])
+                if match:
+                    return source, match
+        return None, None
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        source, match = self._route(scope)
+        if source is None:
+            await self.app(scope, receive, send)
+            return
+        try:
+            key, ttl = _request_key(scope, dict(scope["headers"]), source, match)
+        except ValueError as e:
+            await _send_json(send, 400, str(e))
+            return
+        if key is None:
+            await self.app(scope, receive, send)
+            return
+
+        # Buffer the body to fingerprint it, then hand it to the app unchanged
+        body = bytearray()
+        more_body = True
+        while more_body:
+            message = await receive()
+            if message["type"] != "http.request":
+                return
+            body.extend(message.get("body", b""))
+            more_body = message.get("more_body", False)
+        body = bytes(body)
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        if len(body) > IDEMPOTENCY_MAX_BODY_BYTES:
+            await self.app(scope, replay_receive, send)
+            return
+
+        in_flight_only = source == "oauth_code"
+        store = self.in_flight_store if in_flight_only else self.store
+        outcome, stored = await store.begin(key, hashlib.sha256(body).hexdigest(), ttl)
+        if outcome == REPLAY:
+            stats["replayed"] += 1
+            await _send_stored(send, stored)
+            return
+        if outcome == MISMATCH:
+            stats["mismatches"] += 1
+            await _send_json(send, 422, "Idempotency-Key was already used with a different request")
+            return
+        if outcome == BUSY:
+            stats["busy"] += 1
+            await _send_json(send, 409, "A request with this Idempotency-Key is still in progress",
+                             [(b"retry-after", b"1")])
+            return
+
+        stats["owners"] += 1
+        response = {"status": 0, "headers": [], "body": bytearray()}
+
+        async def send_and_keep(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [
+                    (name.decode("latin-1"), value.decode("latin-1")) for name, value in message.get("headers", [])
+                ]
+            elif message["type"] == "http.response.body":
+                response["body"].extend(message.get("body", b""))
+            await send(message)
+
+        stored = None
+        try:
+            await self.app(scope, replay_receive, send_and_keep)
+            if _cacheable(response["status"]) and len(response["body"]) <= IDEMPOTENCY_MAX_BODY_BYTES:
+                stored = {"status": response["status"], "headers": response["headers"], "body": bytes(response["body"])}
+        finally:
+            if in_flight_only:
+                await store.complete(key, stored, keep=False)
+            else:
+                await store.complete(key, None if stored and _carries_credentials(stored["headers"]) else stored)
+
+
+def idempotency_stats() -> dict:
+    return {"enabled": IDEMPOTENCY_ENABLED, "backend": IDEMPOTENCY_BACKEND, **stats}
@@ -0,0 +1,64 @@
+"""
+Simple migration script to add the 'claimed_at' column to the shard directory tables
+(user_email_directory, oauth_account_directory) on every SHARD_DATABASE_URLS database.
+A directory row whose user is missing is only reclaimed once it is older than
+SHARD_DIRECTORY_CLAIM_GRACE_SECONDS. Existing rows get the migration time.
+Run this once to update existing databases.
+
+Usage:
+    python migrations/add_directory_claimed_at.py
+"""
+import asyncio
+import os
+import sys
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+# Add parent directory to path
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SHARD_DATABASE_URLS = [url.strip() for url in os.getenv("SHARD_DATABASE_URLS", "").split(",") if url.strip()]
+
+TABLES = ("user_email_directory", "oauth_account_directory")
+
+
+async def migrate_shard(url: str):
+    """Add claimed_at to the directory tables of one shard if it doesn't exist."""
+    engine = create_async_engine(url)
+    
+    async with engine.begin() as conn:
+        for table_name in TABLES:
+            # Check if column exists
+            check_query = text("""
+                SELECT column_name 
+                FROM information_schema.columns 
+                WHERE table_name=:table_name AND column_name='claimed_at'
+            """)
+            result = await conn.execute(check_query, {"table_name": table_name})
+            column_exists = result.fetchone() is not None
+            
+            if not column_exists:
+                print(f"Adding 'claimed_at' column to '{table_name}' table...")
+                # now() is stable: PostgreSQL 11+ stores it as a fast default, no table rewrite
+                await conn.execute(text(
+                    f"ALTER TABLE {table_name} ADD COLUMN claimed_at TIMESTAMP WITH TIME ZONE DEFAULT now() NOT NULL"
+                ))
+                print(f"✅ Successfully added 'claimed_at' column!")
+            else:
+                print(f"✅ '{table_name}.claimed_at' column already exists. Skipping.")
+    
+    await engine.dispose()
+
+
+async def migrate():
+    if not SHARD_DATABASE_URLS:
+        print("✅ SHARD_DATABASE_URLS is not set: there are no directory tables. Skipping.")
+        return
+    for url in SHARD_DATABASE_URLS:
+        await migrate_shard(url)
+
+
+if __name__ == "__main__":
+    print("Running migration: add_directory_claimed_at")
+    asyncio.run(migrate())
+    print("Migration complete!")
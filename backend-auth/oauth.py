@@ -1,6 +1,11 @@
 import os
+import httpx
+import httpx_oauth.clients.google as google_oauth
 from httpx_oauth.clients.google import GoogleOAuth2
+from httpx_oauth.exceptions import GetIdEmailError, GetProfileError
+from services.avatars import google_avatar_source
 from services.oauth.discord_oauth import DiscordOAuthService
+from tracing import traced_transport
 
 # OAuth Client IDs and Secrets
 GOOGLE_CLIENT_ID = os.getenv("GOOGLE_CLIENT_ID", "")
@@ -13,12 +18,46 @@ TWITTER_CLIENT_SECRET = os.getenv("TWITTER_CLIENT_SECRET", "")
 
 FRONTEND_URL = os.getenv("FRONTEND_URL", "http://localhost:3000")
 
+
+
+class GoogleProfileOAuth2(GoogleOAuth2):
+    """GoogleOAuth2 that also reads the profile photo, in the same People API request."""
+
+    def get_httpx_client(self) -> httpx.AsyncClient:
+        # Token exchange and profile requests become spans of the callback's trace
+        return httpx.AsyncClient(transport=traced_transport())
+
+    async def get_profile(self, token: str) -> dict:
+        async with self.get_httpx_client() as client:
+            response = await client.get(
+                # Looked up at call time, like the base class does
+                google_oauth.PROFILE_ENDPOINT,
+                params={"personFields": "emailAddresses,photos"},
+                headers={**self.request_headers, "Authorization": f"Bearer {token}"},
+            )
+            if response.status_code >= 400:
+                raise GetProfileError(response=response)
+            return response.json()
+
+    async def get_id_email_avatar(self, token: str) -> tuple[str, str | None, str | None]:
+        """(account id, primary email, avatar source URL or None)"""
+        try:
+            profile = await self.get_profile(token)
+        except GetProfileError as e:
+            raise GetIdEmailError(response=e.response) from e
+        user_id = profile["resourceName"]
+        user_email = next(
+            email["value"] for email in profile["emailAddresses"] if email["metadata"]["primary"]
+        )
+        return user_id, user_email, google_avatar_source(profile)
+
+
 # OAuth Clients - only create if credentials are provided (and not empty strings)
 oauth_clients = {}
 
 if GOOGLE_CLIENT_ID and GOOGLE_CLIENT_SECRET and GOOGLE_CLIENT_ID.strip() and GOOGLE_CLIENT_SECRET.strip():
     print(f"✅ Google OAuth client initialized")
-    oauth_clients["google"] = GoogleOAuth2(
+    oauth_clients["google"] = GoogleProfileOAuth2(
         GOOGLE_CLIENT_ID,
         GOOGLE_CLIENT_SECRET,
     )
@@ -0,0 +1,190 @@
+"""
+Password hashing configuration.
+
+Argon2id parameters come from PASSWORD_HASH_PARAMS_FILE (written by
+calibrate_password_hash.py for the host the workers run on), overridden by the
+ARGON2_* environment variables, falling back to the argon2-cffi defaults.
+
+Hashes made with other parameters (or with bcrypt) still verify, and
+UserManager.authenticate replaces them with a current hash on the next
+successful login (saved as a rehash, not as a password change). hash_version_distribution() reports how many stored hashes
+are on each parameter set, so the migration can be followed.
+"""
+import json
+import os
+import re
+import statistics
+import time
+from collections import Counter
+from typing import Optional
+
+import argon2
+from fastapi_users.password import PasswordHelper
+from pwdlib import PasswordHash
+from pwdlib.hashers.argon2 import Argon2Hasher
+from pwdlib.hashers.bcrypt import BcryptHasher
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import SHARD_DATABASE_URLS, User
+from tracing import span
+
+PASSWORD_HASH_PARAMS_FILE = os.getenv("PASSWORD_HASH_PARAMS_FILE") or os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "password_hash_params.json"
+)
+PASSWORD_HASH_TARGET_MS = float(os.getenv("PASSWORD_HASH_TARGET_MS", "250"))
+
+# "$argon2id$v=19$m=65536,t=3,p=4" or "$2b$12" - everything before the salt
+HASH_VERSION_PATTERN = r"^\$argon2[a-z]*\$v=[0-9]+\$[^$]+|^\$2[abxy]?\$[0-9]+"
+_HASH_VERSION = re.compile(HASH_VERSION_PATTERN)
+
+
+def load_hash_parameters() -> dict:
+    """Argon2 parameters: calibration file, then environment overrides, then library defaults."""
+    params = {
+        "time_cost": argon2.DEFAULT_TIME_COST,
+        "memory_cost": argon2.DEFAULT_MEMORY_COST,
+        "parallelism": argon2.DEFAULT_PARALLELISM,
+    }
+    if os.path.exists(PASSWORD_HASH_PARAMS_FILE):
+        try:
+            with open(PASSWORD_HASH_PARAMS_FILE) as f:
+                calibrated = json.load(f)
+            params.update({key: int(calibrated[key]) for key in params if key in calibrated})
+        except (OSError, ValueError) as e:
+            print(f"⚠️  Ignoring unreadable password hash parameters file {PASSWORD_HASH_PARAMS_FILE}: {str(e)}")
+    for key in params:
+        value = os.getenv(f"ARGON2_{key.upper()}")
+        if value:
+            params[key] = int(value)
+    return params
+
+
+def hash_version(hashed_password: Optional[str]) -> str:
+    """Algorithm and cost parameters of a stored hash, e.g. "argon2id$v=19$m=65536,t=3,p=4"."""
+    match = _HASH_VERSION.match(hashed_password or "")
+    return match.group(0).lstrip("$") if match else "unknown"
+
+
+class TunedPasswordHelper(PasswordHelper):
+    """PasswordHelper with configurable Argon2 parameters and verification counters."""
+
+    def __init__(self, params: Optional[dict] = None):
+        self.params = params or load_hash_parameters()
+        super().__init__(PasswordHash((Argon2Hasher(**self.params), BcryptHasher())))
+        self.current_version = hash_version(self.hash("calibration-probe"))
+        self.verifications = 0
+        self.rehashes = 0
+        self.verify_seconds = 0.0
+
+    def hash(self, password: str) -> str:
+        with span("password.hash"):
+            return super().hash(password)
+
+    def verify_and_update(self, plain_password: str, hashed_password: str) -> tuple[bool, Optional[str]]:
+        started = time.perf_counter()
+        with span("password.verify", **{"password.hash_version": hash_version(hashed_password)}):
+            verified, updated_hash = super().verify_and_update(plain_password, hashed_password)
+        self.verify_seconds += time.perf_counter() - started
+        self.verifications += 1
+        if updated_hash is not None:
+            self.rehashes += 1
+            print(f"🔁 Rehashing password from {hash_version(hashed_password)} to {self.current_version}")
+        return verified, updated_hash
+
+    def stats(self) -> dict:
+        return {
+            "current_version": self.current_version,
+            "parameters": self.params,
+            "verifications": self.verifications,
+            "rehashes": self.rehashes,
+            "avg_verify_ms": round(self.verify_seconds * 1000 / self.verifications, 2) if self.verifications else None,
+        }
+
+
+password_helper = TunedPasswordHelper()
+
+
+def measure_hash_ms(time_cost: int, memory_cost: int, parallelism: int, samples: int = 5) -> float:
+    """Median wall time of one hash with these parameters on this host."""
+    hasher = argon2.PasswordHasher(time_cost=time_cost, memory_cost=memory_cost, parallelism=parallelism)
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        hasher.hash("calibration-probe")
+        timings.append((time.perf_counter() - started) * 1000)
+    return statistics.median(timings)
+
+
+def calibrate(
+    target_ms: float = PASSWORD_HASH_TARGET_MS,
+    max_memory_kib: int = 262144,
+    min_memory_kib: int = 19456,
+    parallelism: int = 1,
+    samples: int = 5,
+) -> dict:
+    """
+    Pick Argon2id parameters whose hash time is as close to target_ms as
+    possible without exceeding it.
+
+    Memory is preferred over iterations: start from max_memory_kib at t=1 and
+    halve the memory while a single pass is too slow (not below
+    min_memory_kib), then raise the time cost while the next step still fits.
+    """
+    memory_cost, time_cost = max_memory_kib, 1
+    elapsed = measure_hash_ms(time_cost, memory_cost, parallelism, samples)
+    while elapsed > target_ms and memory_cost // 2 >= min_memory_kib:
+        memory_cost //= 2
+        elapsed = measure_hash_ms(time_cost, memory_cost, parallelism, samples)
+    while True:
+        candidate = measure_hash_ms(time_cost + 1, memory_cost, parallelism, samples)
+        if candidate > target_ms:
+            break
+        time_cost, elapsed = time_cost + 1, candidate
+    return {
+        "time_cost": time_cost,
+        "memory_cost": memory_cost,
+        "parallelism": parallelism,
+        "measured_ms": round(elapsed, 1),
+        "target_ms": target_ms,
+    }
+
+
+async def _count_hash_versions(session: AsyncSession, counts: Counter) -> None:
+    if session.bind.dialect.name == "postgresql":
+        version = func.substring(User.hashed_password, HASH_VERSION_PATTERN)
+        result = await session.execute(select(version, func.count()).group_by(version))
+        for prefix, users in result:
+            counts[prefix.lstrip("$") if prefix else "unknown"] += users
+    else:
+        # No regex substring elsewhere (e.g. SQLite in local runs): aggregate in Python
+        result = await session.stream(select(User.hashed_password).execution_options(yield_per=1000))
+        async for (hashed_password,) in result:
+            counts[hash_version(hashed_password)] += 1
+
+
+async def hash_version_distribution(session: AsyncSession) -> dict:
+    """
+    Number of users per stored hash version, and how many are not on the current one.
+    With sharded users every shard is counted; `session` is used otherwise.
+    """
+    counts: Counter = Counter()
+    if SHARD_DATABASE_URLS:
+        from sharding import user_session_makers
+
+        for session_maker in user_session_makers():
+            async with session_maker() as shard_session:
+                await _count_hash_versions(shard_session, counts)
+    else:
+        await _count_hash_versions(session, counts)
+
+    current = password_helper.current_version
+    return {
+        "current_version": current,
+        "versions": [
+            {"version": version, "users": users, "current": version == current}
+            for version, users in counts.most_common()
+        ],
+        "outdated_users": sum(users for version, users in counts.items() if version != current),
+        "runtime": password_helper.stats(),
+    }
@@ -0,0 +1,222 @@
+"""
+On-demand profiling for live auth workers.
+
+- SamplingProfiler: a background thread samples the event loop thread's Python
+  stack every few milliseconds and aggregates the samples as folded stacks
+  ("frame;frame;frame count" lines), the input format of flamegraph.pl,
+  inferno and speedscope. Time spent blocking the loop (password hashing,
+  print I/O, synchronous SQLAlchemy work) shows up under the frames doing it;
+  an idle loop shows up under the selector.
+- describe_tasks(): what every pending asyncio task is currently awaiting.
+- ProfilingMiddleware: profiles requests that carry the X-Profile header.
+
+Nothing runs unless asked for: there is no sampler thread outside a profiling
+window, and the middleware is only installed when PROFILING_HEADER_TOKEN is set.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from typing import Optional
+
+# Requests carrying "X-Profile: <token>" are profiled. Unset disables the header trigger.
+PROFILING_HEADER_TOKEN = os.getenv("PROFILING_HEADER_TOKEN", "")
+PROFILING_DEFAULT_INTERVAL_MS = float(os.getenv("PROFILING_DEFAULT_INTERVAL_MS", "5"))
+PROFILING_MAX_SECONDS = float(os.getenv("PROFILING_MAX_SECONDS", "60"))
+PROFILING_MAX_STACK_DEPTH = 128
+
+
+class ProfilerBusy(Exception):
+    """Raised when a profiling window is already open on this worker."""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    module = frame.f_globals.get("__name__", "?")
+    name = getattr(code, "co_qualname", code.co_name)
+    # ';' separates frames and ' ' separates the count in the folded format
+    return f"{module}:{name}:{frame.f_lineno}".replace(";", ",").replace(" ", "_")
+
+
+def _fold_stack(frame) -> str:
+    labels = []
+    while frame is not None and len(labels) < PROFILING_MAX_STACK_DEPTH:
+        labels.append(_frame_label(frame))
+        frame = frame.f_back
+    labels.reverse()
+    return ";".join(labels)
+
+
+class SamplingProfiler:
+    """Samples one thread's stack from a helper thread until stopped."""
+
+    def __init__(self, thread_id: int, interval: float):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.started_at = 0.0
+        self.duration = 0.0
+        self._stop_event = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+    def _run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                self.samples[_fold_stack(frame)] += 1
+            # Drop the reference right away so the frame can be released
+            del frame
+
+    def start(self) -> None:
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(target=self._run, name="auth-sampling-profiler", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> Counter:
+        self._stop_event.set()
+        self._thread.join()
+        self.duration = time.monotonic() - self.started_at
+        return self.samples
+
+    def folded(self) -> str:
+        return "\n".join(f"{stack} {count}" for stack, count in self.samples.most_common()) + "\n"
+
+
+class ProfilerController:
+    """
+    Owns the single profiling window of this worker.
+
+    Explicit windows (profile_for) and header-triggered requests share it:
+    the sampler starts with the first flagged request and stops when the last
+    one finishes.
+    """
+
+    def __init__(self):
+        self._profiler: Optional[SamplingProfiler] = None
+        self._header_requests = 0
+        self.captures: deque = deque(maxlen=20)
+
+    @property
+    def active(self) -> bool:
+        return self._profiler is not None
+
+    def _start(self, interval_ms: float) -> SamplingProfiler:
+        profiler = SamplingProfiler(threading.get_ident(), interval_ms / 1000)
+        profiler.start()
+        self._profiler = profiler
+        return profiler
+
+    async def profile_for(self, seconds: float, interval_ms: float = PROFILING_DEFAULT_INTERVAL_MS) -> SamplingProfiler:
+        if self.active:
+            raise ProfilerBusy()
+        seconds = min(seconds, PROFILING_MAX_SECONDS)
+        profiler = self._start(interval_ms)
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            profiler.stop()
+            self._profiler = None
+        return profiler
+
+    def begin_request(self) -> bool:
+        """Start (or join) a header-triggered window. False if an explicit window is open."""
+        if self._header_requests == 0:
+            if self.active:
+                return False
+            self._start(PROFILING_DEFAULT_INTERVAL_MS)
+        self._header_requests += 1
+        return True
+
+    def end_request(self, method: str, path: str) -> str:
+        """Leave a header-triggered window and store the capture. Returns its id."""
+        self._header_requests -= 1
+        profiler = self._profiler
+        capture_id = uuid.uuid4().hex[:12]
+        if self._header_requests == 0:
+            profiler.stop()
+            self._profiler = None
+        self.captures.append({
+            "id": capture_id,
+            "method": method,
+            "path": path,
+            "captured_at": time.time(),
+            # Concurrent flagged requests share one sampler, so their samples overlap
+            "folded": profiler.folded(),
+        })
+        return capture_id
+
+    def get_capture(self, capture_id: str) -> Optional[dict]:
+        for capture in self.captures:
+            if capture["id"] == capture_id:
+                return capture
+        return None
+
+
+controller = ProfilerController()
+
+
+def _describe_awaitable(awaitable) -> list[str]:
+    """Follow a coroutine's cr_await chain down to the innermost awaited object."""
+    chain = []
+    while awaitable is not None and len(chain) < PROFILING_MAX_STACK_DEPTH:
+        frame = getattr(awaitable, "cr_frame", None) or getattr(awaitable, "gi_frame", None)
+        if frame is not None:
+            chain.append(f"{_frame_label(frame)} ({frame.f_code.co_filename})")
+        next_awaitable = getattr(awaitable, "cr_await", None) or getattr(awaitable, "gi_yieldfrom", None)
+        if next_awaitable is None and frame is None:
+            chain.append(repr(awaitable)[:200])
+        awaitable = next_awaitable
+    return chain
+
+
+def describe_tasks() -> list[dict]:
+    """Snapshot of every asyncio task in this worker and what it is awaiting."""
+    current = asyncio.current_task()
+    tasks = []
+    for task in asyncio.all_tasks():
+        if task is current:
+            continue
+        coro = task.get_coro()
+        tasks.append({
+            "name": task.get_name(),
+            "coroutine": getattr(coro, "__qualname__", repr(coro)),
+            "done": task.done(),
+            "awaiting": _describe_awaitable(coro),
+        })
+    tasks.sort(key=lambda task: task["coroutine"])
+    return tasks
+
+
+class ProfilingMiddleware:
+    """Profile requests carrying X-Profile: <PROFILING_HEADER_TOKEN>; adds X-Profile-Id to the response."""
+
+    def __init__(self, app, token: str = PROFILING_HEADER_TOKEN):
+        self.app = app
+        self.token = token.encode()
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        flagged = any(name == b"x-profile" and value == self.token for name, value in scope["headers"])
+        if not flagged or not controller.begin_request():
+            await self.app(scope, receive, send)
+            return
+
+        capture_id = None
+
+        async def send_with_capture(message):
+            nonlocal capture_id
+            if message["type"] == "http.response.start":
+                capture_id = controller.end_request(scope["method"], scope["path"])
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", capture_id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_capture)
+        finally:
+            if capture_id is None:
+                controller.end_request(scope["method"], scope["path"])
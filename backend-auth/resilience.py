@@ -0,0 +1,263 @@
+"""
+Resilience for outbound dependencies (SMTP, OAuth providers).
+
+Each dependency call goes through Dependency.call(), which combines:
+
+- a circuit breaker: after CIRCUIT_FAILURE_THRESHOLD consecutive failures the
+  dependency is considered down for CIRCUIT_RESET_SECONDS and calls fail
+  immediately with DependencyUnavailable; then one probe call is let through
+  and closes the circuit again if it succeeds;
+- a bulkhead: at most BULKHEAD_LIMIT calls in flight per dependency; extra
+  callers fail fast instead of queueing behind a slow provider;
+- a deadline budget: DeadlineMiddleware gives every request a deadline
+  (REQUEST_DEADLINE_SECONDS, or less if the client sends X-Request-Timeout-Ms),
+  and each call gets min(dependency timeout, time left) so a request never
+  outlives its budget waiting on a provider.
+
+Client errors (HTTP 4xx other than 429, permanent SMTP 5xx replies) are the
+caller's problem and do not count as failures. Settings can be overridden per dependency, e.g.
+CIRCUIT_SMTP_FAILURE_THRESHOLD or DEPENDENCY_OAUTH_DISCORD_TIMEOUT_SECONDS.
+"""
+import asyncio
+import os
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Optional, TypeVar
+
+REQUEST_DEADLINE_SECONDS = float(os.getenv("REQUEST_DEADLINE_SECONDS", "15"))
+CIRCUIT_FAILURE_THRESHOLD = int(os.getenv("CIRCUIT_FAILURE_THRESHOLD", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+BULKHEAD_LIMIT = int(os.getenv("BULKHEAD_LIMIT", "20"))
+DEPENDENCY_TIMEOUT_SECONDS = float(os.getenv("DEPENDENCY_TIMEOUT_SECONDS", "10"))
+
+T = TypeVar("T")
+
+
+class DependencyUnavailable(Exception):
+    """A dependency call was refused (open circuit, full bulkhead) or ran out of deadline budget."""
+
+    def __init__(self, dependency: str, reason: str, retry_after: Optional[float] = None):
+        super().__init__(f"{dependency} unavailable: {reason}")
+        self.dependency = dependency
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+# Absolute deadline (time.monotonic()) of the work in progress, if any
+_deadline: ContextVar[Optional[float]] = ContextVar("request_deadline", default=None)
+
+
+@contextmanager
+def deadline_scope(seconds: float):
+    """Limit everything inside the block to `seconds` (never extends an outer deadline)."""
+    deadline = time.monotonic() + seconds
+    outer = _deadline.get()
+    token = _deadline.set(deadline if outer is None else min(outer, deadline))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def remaining_budget() -> Optional[float]:
+    """Seconds left before the current deadline, or None without one."""
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def is_client_error(exc: BaseException) -> bool:
+    """
+    Errors about this particular request rather than the dependency's health:
+    HTTP 4xx (except 429) and permanent SMTP 5xx replies such as a refused recipient.
+    """
+    status = getattr(getattr(exc, "response", None), "status_code", None)
+    if isinstance(status, int):
+        return 400 <= status < 500 and status != 429
+    smtp_code = getattr(exc, "code", None)
+    return isinstance(smtp_code, int) and 500 <= smtp_code < 600
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker with a single half-open probe."""
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD, reset_timeout: float = CIRCUIT_RESET_SECONDS):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def retry_after(self) -> float:
+        return max(0.0, self.opened_at + self.reset_timeout - time.monotonic())
+
+    def allow(self) -> bool:
+        """Whether a call may go out now. In half-open state only one probe at a time."""
+        if self.state == self.OPEN:
+            if self.retry_after() > 0:
+                return False
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+        return True
+
+    def record_success(self) -> None:
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            self.state = self.OPEN
+            self.opened_at = time.monotonic()
+
+    def release_probe(self) -> None:
+        """A probe ended without a verdict (client error, cancellation)."""
+        self._probe_in_flight = False
+
+
+class Bulkhead:
+    """Fail-fast cap on concurrent calls."""
+
+    def __init__(self, limit: int = BULKHEAD_LIMIT):
+        self.limit = limit
+        self.in_flight = 0
+
+    def try_acquire(self) -> bool:
+        if self.in_flight >= self.limit:
+            return False
+        self.in_flight += 1
+        return True
+
+    def release(self) -> None:
+        self.in_flight -= 1
+
+
+class Dependency:
+    """Circuit breaker, bulkhead and timeout budget for one outbound dependency."""
+
+    def __init__(
+        self,
+        name: str,
+        timeout: float = DEPENDENCY_TIMEOUT_SECONDS,
+        failure_threshold: int = CIRCUIT_FAILURE_THRESHOLD,
+        reset_timeout: float = CIRCUIT_RESET_SECONDS,
+        bulkhead_limit: int = BULKHEAD_LIMIT,
+        min_budget: float = 0.05,
+    ):
+        key = name.upper().replace(":", "_").replace("-", "_")
+        self.name = name
+        self.timeout = float(os.getenv(f"DEPENDENCY_{key}_TIMEOUT_SECONDS", str(timeout)))
+        self.breaker = CircuitBreaker(
+            failure_threshold=int(os.getenv(f"CIRCUIT_{key}_FAILURE_THRESHOLD", str(failure_threshold))),
+            reset_timeout=float(os.getenv(f"CIRCUIT_{key}_RESET_SECONDS", str(reset_timeout))),
+        )
+        self.bulkhead = Bulkhead(int(os.getenv(f"BULKHEAD_{key}_LIMIT", str(bulkhead_limit))))
+        self.min_budget = min_budget
+        self.calls = 0
+        self.failures = 0
+        self.rejected = 0
+
+    @property
+    def available(self) -> bool:
+        """False while the circuit is open (cheap check for callers that can defer work)."""
+        return not (self.breaker.state == CircuitBreaker.OPEN and self.breaker.retry_after() > 0)
+
+    def _reject(self, reason: str, retry_after: Optional[float] = None) -> DependencyUnavailable:
+        self.rejected += 1
+        return DependencyUnavailable(self.name, reason, retry_after)
+
+    async def call(self, operation: Callable[[float], Awaitable[T]]) -> T:
+        """
+        Run operation(timeout) under the breaker, bulkhead and deadline budget.
+        `timeout` is the time the operation may take; pass it on to the client
+        library so its own timeouts fire first.
+        """
+        timeout = self.timeout
+        budget = remaining_budget()
+        if budget is not None:
+            if budget < self.min_budget:
+                raise self._reject("request deadline exceeded")
+            timeout = min(timeout, budget)
+        if not self.breaker.allow():
+            raise self._reject("circuit open", self.breaker.retry_after())
+        if not self.bulkhead.try_acquire():
+            self.breaker.release_probe()
+            raise self._reject("too many concurrent calls")
+
+        self.calls += 1
+        try:
+            result = await asyncio.wait_for(operation(timeout), timeout=timeout)
+        except asyncio.CancelledError:
+            self.breaker.release_probe()
+            raise
+        except Exception as e:
+            if is_client_error(e):
+                self.breaker.release_probe()
+            else:
+                self.failures += 1
+                self.breaker.record_failure()
+                if self.breaker.state == CircuitBreaker.OPEN:
+                    print(f"⚠️  Circuit open for {self.name} after {type(e).__name__}: failing fast for {self.breaker.reset_timeout:.0f}s")
+            raise
+        finally:
+            self.bulkhead.release()
+        self.breaker.record_success()
+        return result
+
+    def stats(self) -> dict:
+        return {
+            "state": self.breaker.state,
+            "consecutive_failures": self.breaker.failures,
+            "retry_after": round(self.breaker.retry_after(), 1) if self.breaker.state == CircuitBreaker.OPEN else None,
+            "in_flight": self.bulkhead.in_flight,
+            "bulkhead_limit": self.bulkhead.limit,
+            "timeout": self.timeout,
+            "calls": self.calls,
+            "failures": self.failures,
+            "rejected": self.rejected,
+        }
+
+
+_dependencies: dict[str, Dependency] = {}
+
+
+def dependency(name: str, **settings) -> Dependency:
+    """The shared Dependency for a name, created with `settings` on first use."""
+    if name not in _dependencies:
+        _dependencies[name] = Dependency(name, **settings)
+    return _dependencies[name]
+
+
+def dependency_stats() -> dict:
+    return {name: dep.stats() for name, dep in _dependencies.items()}
+
+
+class DeadlineMiddleware:
+    """Give each request a deadline; clients may shorten it with X-Request-Timeout-Ms."""
+
+    def __init__(self, app, default_seconds: float = REQUEST_DEADLINE_SECONDS):
+        self.app = app
+        self.default_seconds = default_seconds
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        seconds = self.default_seconds
+        for name, value in scope["headers"]:
+            if name == b"x-request-timeout-ms":
+                try:
+                    seconds = min(seconds, max(0.0, int(value) / 1000))
+                except ValueError:
+                    pass
+                break
+        with deadline_scope(seconds):
+            await self.app(scope, receive, send)
@@ -0,0 +1,189 @@
+"""
+Admin API routes.
+Every route requires an authenticated user with role='admin'.
+"""
+import uuid
+
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from admission import admission_stats
+from db import User, get_async_session
+from dependencies import admin_required
+from idempotency import idempotency_stats
+from password_hashing import hash_version_distribution
+from resilience import dependency_stats
+from schemas import AdminUserPage
+from services import admin_users, verification_campaign
+from services.maintenance import maintenance_scheduler
+from services.session_push import session_push_hub
+from sql_instrumentation import SQL_DEBUG_HEADERS, recent_requests
+from token_socket import token_socket_server
+from tracing import tracer
+
+router = APIRouter(prefix="/admin", tags=["admin"])
+
+
+@router.get("/users", response_model=AdminUserPage)
+async def list_users(
+    limit: int = Query(50, ge=1, le=admin_users.MAX_PAGE_SIZE),
+    cursor: str | None = None,
+    role: str | None = None,
+    is_verified: bool | None = None,
+    is_active: bool | None = None,
+    oauth_provider: str | None = None,
+    include_oauth_accounts: bool = False,
+    include_total: bool = True,
+    session: AsyncSession = Depends(get_async_session),
+    admin_user: User = Depends(admin_required),
+):
+    """
+    List users ordered by email, one page at a time.
+    Pass the returned next_cursor to get the following page. total_estimate is
+    an estimate from database statistics, not an exact count.
+    """
+    try:
+        return await admin_users.list_users(
+            session,
+            limit=limit,
+            cursor=cursor,
+            role=role,
+            is_verified=is_verified,
+            is_active=is_active,
+            oauth_provider=oauth_provider,
+            include_oauth_accounts=include_oauth_accounts,
+            include_total=include_total,
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+
+@router.post("/verification-campaigns", status_code=status.HTTP_202_ACCEPTED)
+async def start_verification_campaign(
+    batch_size: int = Query(verification_campaign.DEFAULT_BATCH_SIZE, ge=1, le=5000),
+    concurrency: int = Query(verification_campaign.DEFAULT_CONCURRENCY, ge=1, le=50),
+    admin_user: User = Depends(admin_required),
+):
+    """Re-send verification emails to every unverified, active user in the background. One campaign runs at a time."""
+    try:
+        campaign = await verification_campaign.start_campaign(batch_size, concurrency)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    return verification_campaign.campaign_to_dict(campaign)
+
+
+@router.get("/verification-campaigns/{campaign_id}")
+async def get_verification_campaign(
+    campaign_id: uuid.UUID,
+    admin_user: User = Depends(admin_required),
+):
+    """Progress of a verification campaign."""
+    campaign = await verification_campaign.get_campaign(campaign_id)
+    if campaign is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Campaign not found")
+    return verification_campaign.campaign_to_dict(campaign)
+
+
+@router.post("/verification-campaigns/{campaign_id}/resume", status_code=status.HTTP_202_ACCEPTED)
+async def resume_verification_campaign(
+    campaign_id: uuid.UUID,
+    admin_user: User = Depends(admin_required),
+):
+    """Resume a cancelled, failed or interrupted campaign from its last checkpoint."""
+    try:
+        campaign = await verification_campaign.resume_campaign(campaign_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
+    if campaign is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Campaign not found")
+    return verification_campaign.campaign_to_dict(campaign)
+
+
+@router.post("/verification-campaigns/{campaign_id}/cancel")
+async def cancel_verification_campaign(
+    campaign_id: uuid.UUID,
+    admin_user: User = Depends(admin_required),
+):
+    """Stop a running campaign (on whichever worker runs it). It can be resumed later."""
+    cancelled = await verification_campaign.cancel_campaign(campaign_id)
+    if not cancelled:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Campaign is not running")
+    campaign = await verification_campaign.get_campaign(campaign_id)
+    return verification_campaign.campaign_to_dict(campaign)
+
+
+@router.get("/sql/requests")
+async def recent_sql_requests(admin_user: User = Depends(admin_required)):
+    """
+    SQL debug panel: query count, time, rows and top statements of the last
+    requests on this worker. Only populated when SQL_DEBUG_HEADERS=true.
+    """
+    if not SQL_DEBUG_HEADERS:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="SQL debugging is disabled")
+    return {"requests": list(reversed(recent_requests))}
+
+
+@router.get("/admission")
+async def admission_control_stats(admin_user: User = Depends(admin_required)):
+    """Per route class limits, current load and shed counts on this worker."""
+    return admission_stats()
+
+
+@router.get("/idempotency")
+async def idempotency_status(admin_user: User = Depends(admin_required)):
+    """Idempotent requests run, replayed and coalesced on this worker."""
+    return idempotency_stats()
+
+
+@router.get("/dependencies")
+async def outbound_dependency_stats(admin_user: User = Depends(admin_required)):
+    """Circuit breaker state, in-flight calls and failure counts per outbound dependency on this worker."""
+    return dependency_stats()
+
+
+@router.get("/password-hashes")
+async def password_hash_versions(
+    session: AsyncSession = Depends(get_async_session),
+    admin_user: User = Depends(admin_required),
+):
+    """
+    Stored password hashes grouped by algorithm and cost parameters.
+    Outdated hashes are upgraded on the user's next login. runtime holds this
+    worker's verification count, rehash count and average verify time.
+    """
+    return await hash_version_distribution(session)
+
+
+@router.get("/maintenance")
+async def maintenance_status(admin_user: User = Depends(admin_required)):
+    """Maintenance scheduler state on this worker and the results of its last run."""
+    return maintenance_scheduler.stats()
+
+
+@router.get("/session-push")
+async def session_push_status(admin_user: User = Depends(admin_required)):
+    """Open /users/me/events streams and delivered messages on this worker."""
+    return session_push_hub.stats()
+
+
+@router.get("/tracing")
+async def tracing_status(admin_user: User = Depends(admin_required)):
+    """Sampling, exporter and exported/dropped span counts of this worker's tracer."""
+    return tracer.stats()
+
+
+@router.get("/token-socket")
+async def token_socket_status(admin_user: User = Depends(admin_required)):
+    """Listening sockets, open connections and request counts of this worker's token socket."""
+    return token_socket_server.stats()
+
+
+@router.post("/maintenance/run")
+async def run_maintenance(admin_user: User = Depends(admin_required)):
+    """
+    Run every maintenance job now, on this worker. Only the current leader (or a
+    worker that can become leader) runs them; others answer 409.
+    """
+    if not await maintenance_scheduler.leader.try_acquire():
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Another worker is the maintenance leader")
+    return await maintenance_scheduler.run_all()
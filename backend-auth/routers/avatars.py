@@ -0,0 +1,89 @@
+"""
+Cached OAuth avatars (see services/avatars.py).
+
+GET /users/{user_id}/avatar?v=<version>&size=<px> is public, like the
+provider CDN URLs it replaces, so <img> tags can load it without a token.
+With the current version (the avatar_url in UserRead carries it) a cached
+file is served straight from disk without a database lookup, and may be
+cached by browsers and proxies for a year; without it the user is looked up
+and the response may be cached for AVATAR_UNVERSIONED_MAX_AGE seconds.
+"""
+import os
+import re
+import uuid
+
+from fastapi import APIRouter, HTTPException, Query, Request, Response, status
+from fastapi.responses import FileResponse
+
+from db import async_session_maker, get_user_db
+from resilience import DependencyUnavailable
+from routers.profile import etag_matches
+from services.avatars import (
+    AVATAR_DEFAULT_SIZE,
+    AVATAR_MEDIA_TYPE,
+    AVATAR_SIZES,
+    AvatarUnavailable,
+    avatar_key,
+    cached_path,
+    ensure_cached,
+    file_etag,
+)
+
+AVATAR_UNVERSIONED_MAX_AGE = int(os.getenv("AVATAR_UNVERSIONED_MAX_AGE", "300"))
+_VERSION = re.compile(r"^[0-9a-f]{32}$")
+
+router = APIRouter(prefix="/users", tags=["users"])
+
+
+async def _avatar_source(user_id: uuid.UUID) -> str | None:
+    # Short-lived session: most requests never get here
+    async with async_session_maker() as session:
+        async for user_db in get_user_db(session):
+            user = await user_db.get(user_id)
+    return user.avatar_source if user is not None else None
+
+
+@router.get("/{user_id}/avatar")
+async def get_user_avatar(
+    user_id: uuid.UUID,
+    request: Request,
+    size: int = Query(AVATAR_DEFAULT_SIZE),
+    v: str | None = Query(None, max_length=64),
+):
+    """The user's OAuth profile picture as a square WebP of `size` pixels."""
+    if size not in AVATAR_SIZES:
+        raise HTTPException(
+            status_code=422,
+            detail=f"size must be one of {', '.join(map(str, AVATAR_SIZES))}",
+        )
+
+    path = None
+    versioned = False
+    if v and _VERSION.match(v) and os.path.exists(cached_path(v, size)):
+        path, versioned = cached_path(v, size), True
+    if path is None:
+        source = await _avatar_source(user_id)
+        if not source:
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="No avatar")
+        versioned = v == avatar_key(source)
+        try:
+            path = await ensure_cached(source, size)
+        except AvatarUnavailable as e:
+            print(f"⚠️  Avatar for {user_id} unavailable: {str(e)}")
+            raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Avatar unavailable")
+        except DependencyUnavailable as e:
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Avatar temporarily unavailable",
+                headers={"Retry-After": str(int(e.retry_after or 30))},
+            )
+
+    etag = await file_etag(path)
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable" if versioned else f"public, max-age={AVATAR_UNVERSIONED_MAX_AGE}",
+    }
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    # FileResponse streams the file (or hands it to the server via the ASGI pathsend extension)
+    return FileResponse(path, media_type=AVATAR_MEDIA_TYPE, headers=headers)
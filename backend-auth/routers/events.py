@@ -0,0 +1,80 @@
+"""
+User change feed for downstream services.
+
+Readable with the X-Events-Token header (USER_EVENTS_TOKEN) or an admin's
+bearer token. The stream authenticates with a short-lived session of its own
+so an open stream does not hold a database connection.
+"""
+import secrets
+
+from fastapi import APIRouter, Depends, Header, HTTPException, Query, Request, status
+from fastapi.responses import StreamingResponse
+
+from services.user_events import (
+    MAX_EVENTS_PAGE_SIZE,
+    USER_EVENTS_TOKEN,
+    event_to_dict,
+    fetch_events,
+    latest_event_id,
+    stream_events,
+)
+from users import active_user_from_token
+
+router = APIRouter(prefix="/events", tags=["events"])
+
+
+async def events_consumer(request: Request) -> str:
+    """Allow service consumers holding USER_EVENTS_TOKEN, or active admins."""
+    events_token = request.headers.get("x-events-token")
+    if events_token and USER_EVENTS_TOKEN and secrets.compare_digest(events_token, USER_EVENTS_TOKEN):
+        return "service"
+
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+    user = await active_user_from_token(token)
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+    if user.role != "admin":
+        raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+    return f"admin:{user.id}"
+
+
+@router.get("/users")
+async def list_user_events(
+    cursor: int = Query(0, ge=0),
+    limit: int = Query(100, ge=1, le=MAX_EVENTS_PAGE_SIZE),
+    consumer: str = Depends(events_consumer),
+):
+    """
+    User events with id > cursor, oldest first. Pass next_cursor back to get the
+    following page; an empty page returns the same cursor.
+    """
+    events = await fetch_events(cursor, limit)
+    return {
+        "items": [event_to_dict(event) for event in events],
+        "next_cursor": events[-1].id if events else cursor,
+    }
+
+
+@router.get("/users/stream")
+async def stream_user_events(
+    cursor: int | None = Query(None, ge=0),
+    last_event_id: str | None = Header(None),
+    consumer: str = Depends(events_consumer),
+):
+    """
+    Server-sent events stream of user events.
+    Resumes after `cursor` or the Last-Event-ID header; without either, starts
+    with events written from now on.
+    """
+    if cursor is None and last_event_id and last_event_id.isdigit():
+        cursor = int(last_event_id)
+    if cursor is None:
+        cursor = await latest_event_id()
+    print(f"📡 User event stream opened by {consumer} from cursor {cursor}")
+    return StreamingResponse(
+        stream_events(cursor),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
@@ -0,0 +1,121 @@
+"""
+Current user profile route with conditional GET support.
+
+Registered ahead of the fastapi-users users router so it serves GET /users/me.
+The ETag is derived from the user's profile_version, which UserManager bumps on
+every write, so an unchanged profile is answered with 304 and no body.
+
+GET /users/me/events pushes changes to the account as server-sent events
+instead (see services/session_push.py); browsers open it with a ticket from
+POST /users/me/events/ticket.
+"""
+import hashlib
+
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, status
+from fastapi.responses import StreamingResponse
+
+from db import User
+from schemas import UserRead
+from services.profile_cache import profile_cache
+from services.session_push import (
+    SESSION_PUSH_ENABLED,
+    SESSION_PUSH_TICKET_SECONDS,
+    issue_stream_ticket,
+    redeem_stream_ticket,
+    session_push_hub,
+)
+from users import active_user_by_id, active_user_from_token, current_active_user, jwt_strategy
+
+router = APIRouter(prefix="/users", tags=["users"])
+
+# Changes whenever the UserRead shape changes, so clients re-fetch after a deploy
+_SCHEMA_TAG = hashlib.sha1(",".join(sorted(UserRead.model_fields)).encode()).hexdigest()[:8]
+
+CACHE_HEADERS = {
+    "Cache-Control": "private, no-cache",
+    "Vary": "Authorization",
+}
+
+
+def profile_etag(user: User) -> str:
+    return f'"{user.id.hex}-{user.profile_version}-{_SCHEMA_TAG}"'
+
+
+def etag_matches(if_none_match: str | None, etag: str) -> bool:
+    if not if_none_match:
+        return False
+    for candidate in if_none_match.split(","):
+        candidate = candidate.strip()
+        if candidate == "*" or candidate.removeprefix("W/") == etag:
+            return True
+    return False
+
+
+@router.get("/me", response_model=UserRead)
+async def get_current_user_profile(request: Request, user: User = Depends(current_active_user)):
+    """Return the current user. Supports If-None-Match."""
+    etag = profile_etag(user)
+    headers = {**CACHE_HEADERS, "ETag": etag}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    body = profile_cache.get(user.id, user.profile_version)
+    if body is None:
+        body = UserRead.model_validate(user, from_attributes=True).model_dump_json().encode()
+        profile_cache.put(user.id, user.profile_version, body)
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def _bearer_token(request: Request) -> str | None:
+    scheme, _, token = request.headers.get("authorization", "").partition(" ")
+    return token if scheme.lower() == "bearer" and token else None
+
+
+@router.post("/me/events/ticket")
+async def create_event_stream_ticket(request: Request, user: User = Depends(current_active_user)):
+    """
+    Exchange the bearer token for a ticket that opens one GET /users/me/events
+    stream. Valid for SESSION_PUSH_TICKET_SECONDS; request a new one to reconnect.
+    """
+    if not SESSION_PUSH_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session push is disabled")
+    _, expires_at = jwt_strategy.verified_claims(_bearer_token(request))
+    return {"ticket": issue_stream_ticket(user.id, expires_at), "expires_in": SESSION_PUSH_TICKET_SECONDS}
+
+
+@router.get("/me/events")
+async def stream_current_user_events(request: Request, ticket: str | None = Query(None)):
+    """
+    Server-sent events about the current user's account: a "ready" message with
+    the current state, then verified, role_changed, profile_updated, and
+    deactivated, deleted, token_revoked or token_expired, after which the
+    stream ends and the client should sign out.
+
+    Takes the bearer token in the Authorization header or, for EventSource
+    (which cannot set headers), a stream ticket in the ticket query parameter.
+    Access tokens are not accepted in the URL.
+    """
+    if not SESSION_PUSH_ENABLED:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Session push is disabled")
+    token = _bearer_token(request)
+    if token is not None:
+        user = await active_user_from_token(token)
+        expires_at = jwt_strategy.verified_claims(token)[1] if user is not None else None
+    else:
+        redeemed = redeem_stream_ticket(ticket)
+        user = await active_user_by_id(redeemed[0]) if redeemed is not None else None
+        expires_at = redeemed[1] if redeemed is not None else None
+    if user is None:
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Unauthorized")
+    if session_push_hub.full():
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many open event streams",
+            headers={"Retry-After": "30"},
+        )
+    subscriber = session_push_hub.subscribe(user.id, expires_at)
+    return StreamingResponse(
+        session_push_hub.stream(subscriber, user),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
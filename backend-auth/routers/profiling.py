@@ -0,0 +1,57 @@
+"""
+Admin profiling routes.
+Sampling windows, header-triggered captures and the asyncio task view.
+"""
+from fastapi import APIRouter, Depends, HTTPException, Query, status
+from fastapi.responses import PlainTextResponse
+
+from db import User
+from dependencies import admin_required
+from profiling import PROFILING_MAX_SECONDS, ProfilerBusy, controller, describe_tasks
+
+router = APIRouter(prefix="/admin/profiling", tags=["admin"])
+
+
+@router.post("/sample", response_class=PlainTextResponse)
+async def sample(
+    seconds: float = Query(10, gt=0, le=PROFILING_MAX_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=100),
+    admin_user: User = Depends(admin_required),
+):
+    """
+    Sample this worker's event loop for `seconds` and return folded stacks.
+    Pipe the output into flamegraph.pl / inferno-flamegraph, or open it in speedscope.
+    """
+    try:
+        profiler = await controller.profile_for(seconds, interval_ms)
+    except ProfilerBusy:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="A profiling window is already open on this worker")
+    return PlainTextResponse(
+        profiler.folded(),
+        headers={"X-Profile-Samples": str(sum(profiler.samples.values()))},
+    )
+
+
+@router.get("/tasks")
+async def tasks(admin_user: User = Depends(admin_required)):
+    """Every pending asyncio task on this worker and the await chain it is suspended in."""
+    return {"tasks": describe_tasks()}
+
+
+@router.get("/captures")
+async def list_captures(admin_user: User = Depends(admin_required)):
+    """Recent header-triggered captures (X-Profile request header)."""
+    return {
+        "captures": [
+            {key: value for key, value in capture.items() if key != "folded"}
+            for capture in controller.captures
+        ]
+    }
+
+
+@router.get("/captures/{capture_id}", response_class=PlainTextResponse)
+async def get_capture(capture_id: str, admin_user: User = Depends(admin_required)):
+    capture = controller.get_capture(capture_id)
+    if capture is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Capture not found")
+    return PlainTextResponse(capture["folded"])
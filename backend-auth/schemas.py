@@ -1,10 +1,21 @@
 import uuid
+from datetime import datetime
 
 from fastapi_users import schemas
+from pydantic import BaseModel, Field, computed_field
+
+from services.avatars import avatar_url
 
 
 class UserRead(schemas.BaseUser[uuid.UUID]):
     role: str
+    # The provider URL stays server-side; clients get the cached copy's URL
+    avatar_source: str | None = Field(default=None, exclude=True)
+
+    @computed_field
+    @property
+    def avatar_url(self) -> str | None:
+        return avatar_url(self.id, self.avatar_source)
 
 
 class UserCreate(schemas.BaseUserCreate):
@@ -13,3 +24,21 @@ class UserCreate(schemas.BaseUserCreate):
 
 class UserUpdate(schemas.BaseUserUpdate):
     role: str | None = None
+
+
+class OAuthAccountRead(BaseModel):
+    oauth_name: str
+    account_id: str
+    account_email: str
+
+
+class AdminUserRead(UserRead):
+    last_login_at: datetime | None = None
+    last_seen_at: datetime | None = None
+    oauth_accounts: list[OAuthAccountRead] | None = None
+
+
+class AdminUserPage(BaseModel):
+    items: list[AdminUserRead]
+    next_cursor: str | None = None
+    total_estimate: int | None = None
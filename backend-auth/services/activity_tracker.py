@@ -0,0 +1,152 @@
+"""
+Activity Tracker Service
+Write-coalesced last_login_at / last_seen_at tracking.
+
+touch() only updates an in-memory dict holding the latest timestamp per user.
+Every ACTIVITY_FLUSH_INTERVAL seconds the dict is swapped out and written with
+UPDATE "user" ... FROM (VALUES ...) statements of up to ACTIVITY_FLUSH_CHUNK
+rows, so each user costs at most one row write per interval and worker however
+many requests they make. Timestamps only move forward, so flushes from several
+workers can arrive in any order.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from sqlalchemy import bindparam, case, cast, column, update, values
+
+from db import SHARD_DATABASE_URLS, User, async_session_maker
+
+ACTIVITY_TRACKING_ENABLED = os.getenv("ACTIVITY_TRACKING_ENABLED", "true").lower() == "true"
+ACTIVITY_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_FLUSH_INTERVAL", "5"))
+ACTIVITY_FLUSH_CHUNK = int(os.getenv("ACTIVITY_FLUSH_CHUNK", "1000"))
+
+
+def _latest(current, incoming):
+    """SQL expression keeping the later of the stored and incoming timestamp."""
+    return case(
+        (incoming.is_(None), current),
+        (current.is_(None), incoming),
+        (current < incoming, incoming),
+        else_=current,
+    )
+
+
+class ActivityTracker:
+    def __init__(self, flush_interval: float = ACTIVITY_FLUSH_INTERVAL, chunk_size: int = ACTIVITY_FLUSH_CHUNK):
+        self.flush_interval = flush_interval
+        self.chunk_size = chunk_size
+        # user id -> (last seen, last login or None)
+        self._pending: dict[uuid.UUID, tuple[datetime, Optional[datetime]]] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._wakeup = asyncio.Event()
+
+    def touch(self, user_id: uuid.UUID, login: bool = False) -> None:
+        """Record activity for a user. O(1), no I/O."""
+        if self._task is None:
+            return
+        now = datetime.now(timezone.utc)
+        previous = self._pending.get(user_id)
+        last_login = now if login else (previous[1] if previous else None)
+        self._pending[user_id] = (now, last_login)
+
+    def start(self) -> None:
+        if ACTIVITY_TRACKING_ENABLED and self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop tracking and write whatever is still pending."""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        # Let a flush in progress finish instead of cancelling it mid-update
+        self._stopping = True
+        self._wakeup.set()
+        await asyncio.gather(task, return_exceptions=True)
+        await self.flush()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            await self.flush()
+
+    async def flush(self) -> int:
+        """Write pending activity. Returns the number of users updated."""
+        if not self._pending:
+            return 0
+        pending, self._pending = self._pending, {}
+        rows = [(user_id, seen, login) for user_id, (seen, login) in pending.items()]
+        try:
+            for session_maker, target_rows in self._targets(rows):
+                async with session_maker() as session:
+                    if session.bind.dialect.name == "postgresql":
+                        for start in range(0, len(target_rows), self.chunk_size):
+                            await session.execute(self._values_update(target_rows[start:start + self.chunk_size]))
+                    else:
+                        # UPDATE ... FROM (VALUES ...) AS t (cols) is PostgreSQL syntax; elsewhere
+                        # (e.g. SQLite in local runs) fall back to an executemany UPDATE
+                        await session.execute(
+                            self._executemany_update(),
+                            [{"b_id": user_id, "b_seen": seen, "b_login": login} for user_id, seen, login in target_rows],
+                        )
+                    await session.commit()
+        except Exception as e:
+            # Put the batch back unless newer activity arrived meanwhile (rewriting is harmless)
+            for user_id, entry in pending.items():
+                self._pending.setdefault(user_id, entry)
+            print(f"❌ Failed to flush activity for {len(rows)} users: {type(e).__name__} - {str(e)}")
+            return 0
+        return len(rows)
+
+    @staticmethod
+    def _targets(rows: list[tuple]) -> list[tuple]:
+        """(session maker, rows) per database holding the users; one pair unless users are sharded."""
+        if not SHARD_DATABASE_URLS:
+            return [(async_session_maker, rows)]
+        from sharding import shard_set
+        by_shard: dict[str, list[tuple]] = {}
+        for row in rows:
+            by_shard.setdefault(shard_set.for_user(row[0]).name, []).append(row)
+        return [(shard_set.shards[name].session_maker, shard_rows) for name, shard_rows in by_shard.items()]
+
+    @staticmethod
+    def _values_update(rows: list[tuple]):
+        table = User.__table__
+        activity = values(
+            column("id", table.c.id.type),
+            column("seen_at", table.c.last_seen_at.type),
+            column("login_at", table.c.last_login_at.type),
+            name="activity",
+        ).data(rows)
+        return (
+            update(table)
+            .where(table.c.id == activity.c.id)
+            .values(
+                last_seen_at=_latest(table.c.last_seen_at, activity.c.seen_at),
+                # A VALUES column that is NULL in every row is typed as text by PostgreSQL
+                last_login_at=_latest(table.c.last_login_at, cast(activity.c.login_at, table.c.last_login_at.type)),
+            )
+        )
+
+    @staticmethod
+    def _executemany_update():
+        table = User.__table__
+        return (
+            update(table)
+            .where(table.c.id == bindparam("b_id", type_=table.c.id.type))
+            .values(
+                last_seen_at=_latest(table.c.last_seen_at, bindparam("b_seen", type_=table.c.last_seen_at.type)),
+                last_login_at=_latest(table.c.last_login_at, bindparam("b_login", type_=table.c.last_login_at.type)),
+            )
+        )
+
+
+activity_tracker = ActivityTracker()
@@ -0,0 +1,181 @@
+"""
+Admin User Directory Service
+Keyset-paginated user listing with filters and cheap total count estimates.
+
+Pages are ordered by email and continue from an opaque cursor (the last email
+of the previous page), so page N costs the same as page 1. Totals come from
+planner statistics (pg_class.reltuples, or the row estimate of EXPLAIN when
+filters are applied) instead of COUNT(*), which has to scan every row.
+
+With sharded users (SHARD_DATABASE_URLS) every shard returns its own first
+limit + 1 rows after the cursor; the page is the first limit of those merged
+by email, and the total is the sum of the shards' estimates.
+"""
+import asyncio
+import base64
+import json
+from typing import Optional
+
+from sqlalchemy import Select, bindparam, exists, func, select, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import noload, selectinload
+
+from db import SHARD_DATABASE_URLS, OAuthAccount, User
+
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(email: str) -> str:
+    return base64.urlsafe_b64encode(email.encode()).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> str:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        return base64.urlsafe_b64decode(padded.encode()).decode()
+    except (ValueError, UnicodeDecodeError):
+        raise ValueError("Invalid cursor")
+
+
+def filtered_users_query(
+    role: Optional[str] = None,
+    is_verified: Optional[bool] = None,
+    is_active: Optional[bool] = None,
+    oauth_provider: Optional[str] = None,
+) -> Select:
+    statement = select(User)
+    if role is not None:
+        statement = statement.where(User.role == role)
+    # "= false" (not "IS false") so PostgreSQL matches the NOT is_verified / NOT is_active partial indexes
+    if is_verified is not None:
+        statement = statement.where(User.is_verified == is_verified)
+    if is_active is not None:
+        statement = statement.where(User.is_active == is_active)
+    if oauth_provider is not None:
+        statement = statement.where(
+            exists().where(
+                OAuthAccount.user_id == User.id,
+                OAuthAccount.oauth_name == oauth_provider,
+            )
+        )
+    return statement
+
+
+def _explain(statement: Select):
+    """
+    EXPLAIN (FORMAT JSON) of the statement. The filter values (role,
+    oauth_provider, ...) stay bound parameters; they are never pasted into the
+    SQL text.
+    """
+    # Named placeholders, which text() turns back into bind parameters
+    compiled = statement.with_only_columns(User.id).compile(dialect=postgresql.dialect(paramstyle="named"))
+    return text(f"EXPLAIN (FORMAT JSON) {compiled}").bindparams(
+        *(bindparam(name, value, type_=compiled.binds[name].type) for name, value in compiled.params.items())
+    )
+
+
+async def estimate_count(session: AsyncSession, statement: Select, filtered: bool) -> Optional[int]:
+    """
+    Estimated number of rows the (unpaginated) statement returns.
+
+    PostgreSQL only uses planner statistics; other databases (e.g. SQLite in
+    local runs) fall back to an exact count.
+    """
+    if session.bind.dialect.name != "postgresql":
+        return await session.scalar(select(func.count()).select_from(statement.subquery()))
+
+    if not filtered:
+        reltuples = await session.scalar(
+            text("SELECT reltuples::bigint FROM pg_class WHERE oid = 'public.\"user\"'::regclass")
+            .execution_options(read_only=True)
+        )
+        # -1 means the table was never analyzed; fall through to EXPLAIN
+        if reltuples is not None and reltuples >= 0:
+            return int(reltuples)
+
+    plan = await session.scalar(_explain(statement).execution_options(read_only=True))
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+async def _sharded_page(
+    page_statement: Select, statement: Select, filtered: bool, include_total: bool
+) -> tuple[list[User], Optional[int]]:
+    from sharding import user_session_makers
+
+    async def shard_page(session_maker) -> tuple[list[User], Optional[int]]:
+        async with session_maker() as session:
+            users = list((await session.execute(page_statement)).scalars())
+            total = await estimate_count(session, statement, filtered) if include_total else None
+            return users, total
+
+    pages = await asyncio.gather(*(shard_page(session_maker) for session_maker in user_session_makers()))
+    users = sorted((user for shard_users, _ in pages for user in shard_users), key=lambda user: user.email)
+    total_estimate = sum(total or 0 for _, total in pages) if include_total else None
+    return users, total_estimate
+
+
+async def list_users(
+    session: AsyncSession,
+    limit: int = 50,
+    cursor: Optional[str] = None,
+    role: Optional[str] = None,
+    is_verified: Optional[bool] = None,
+    is_active: Optional[bool] = None,
+    oauth_provider: Optional[str] = None,
+    include_oauth_accounts: bool = False,
+    include_total: bool = True,
+) -> dict:
+    """
+    Return one page of users as {"items", "next_cursor", "total_estimate"}.
+
+    OAuth accounts are only loaded (with one extra SELECT ... IN query per page)
+    when include_oauth_accounts is set; otherwise the joined relationship load
+    is disabled.
+    """
+    limit = max(1, min(limit, MAX_PAGE_SIZE))
+    filtered = any(value is not None for value in (role, is_verified, is_active, oauth_provider))
+    statement = filtered_users_query(role, is_verified, is_active, oauth_provider)
+
+    page_statement = statement
+    if cursor:
+        page_statement = page_statement.where(User.email > decode_cursor(cursor))
+    loader = selectinload(User.oauth_accounts) if include_oauth_accounts else noload(User.oauth_accounts)
+    # Fetch one extra row to know whether another page exists
+    page_statement = page_statement.options(loader).order_by(User.email).limit(limit + 1)
+
+    if SHARD_DATABASE_URLS:
+        users, total_estimate = await _sharded_page(page_statement, statement, filtered, include_total)
+    else:
+        users = list((await session.execute(page_statement)).scalars())
+        total_estimate = await estimate_count(session, statement, filtered) if include_total else None
+    next_cursor = encode_cursor(users[limit - 1].email) if len(users) > limit else None
+    users = users[:limit]
+
+    items = []
+    for user in users:
+        item = {
+            "id": user.id,
+            "email": user.email,
+            "role": user.role,
+            "is_active": user.is_active,
+            "is_verified": user.is_verified,
+            "is_superuser": user.is_superuser,
+            "last_login_at": user.last_login_at,
+            "last_seen_at": user.last_seen_at,
+            "oauth_accounts": None,
+        }
+        if include_oauth_accounts:
+            item["oauth_accounts"] = [
+                {
+                    "oauth_name": account.oauth_name,
+                    "account_id": account.account_id,
+                    "account_email": account.account_email,
+                }
+                for account in user.oauth_accounts
+            ]
+        items.append(item)
+
+    return {"items": items, "next_cursor": next_cursor, "total_estimate": total_estimate}
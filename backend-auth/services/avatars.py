@@ -0,0 +1,211 @@
+"""
+Avatar Service
+Caches OAuth profile pictures on local disk so the frontend never hotlinks
+provider CDNs.
+
+A user's avatar_source is the provider's image URL, recorded at OAuth login.
+The first request for it downloads the image once (concurrent requests wait
+for that download), resizes it to every AVATAR_SIZES square in a thread and
+writes the results to AVATAR_CACHE_DIR. Later requests are answered from the
+files, without touching the provider or, when the URL carries the current
+version, the database.
+
+File names derive from a hash of the source URL (avatar_key), which is also
+the version in the public avatar URL: a new picture has a new URL, so cached
+copies can be kept for a year. ETags are content hashes of the files.
+AVATAR_CACHE_DIR is a cache: deleting it only costs re-downloads.
+"""
+import asyncio
+import hashlib
+import io
+import os
+from collections import OrderedDict
+from typing import Optional
+from urllib.parse import urlparse
+
+import httpx
+
+from resilience import dependency
+from tracing import traced_transport
+
+AVATAR_CACHE_DIR = os.getenv("AVATAR_CACHE_DIR", "/tmp/finity-avatar-cache")
+AVATAR_SIZES = tuple(int(size) for size in os.getenv("AVATAR_SIZES", "64,128,256").split(","))
+AVATAR_DEFAULT_SIZE = 128 if 128 in AVATAR_SIZES else AVATAR_SIZES[0]
+# Hosts avatars may be downloaded from (suffix match); anything else is never fetched
+AVATAR_ALLOWED_HOSTS = tuple(
+    host.strip().lower()
+    for host in os.getenv("AVATAR_ALLOWED_HOSTS", "cdn.discordapp.com,googleusercontent.com").split(",")
+    if host.strip()
+)
+AVATAR_MAX_DOWNLOAD_BYTES = int(os.getenv("AVATAR_MAX_DOWNLOAD_BYTES", str(5 * 1024 * 1024)))
+# Public base URL of this service, used in the avatar_url returned to clients
+AUTH_PUBLIC_URL = os.getenv("AUTH_PUBLIC_URL", "http://localhost:8000").rstrip("/")
+AVATAR_MEDIA_TYPE = "image/webp"
+_MAX_SOURCE_PIXELS = 40_000_000
+_ETAG_CACHE_SIZE = 50_000
+
+_http_client: Optional[httpx.AsyncClient] = None
+_downloads: dict[str, asyncio.Future] = {}
+_etags: OrderedDict[str, str] = OrderedDict()
+
+
+class AvatarUnavailable(Exception):
+    """The avatar could not be fetched or decoded."""
+
+
+def avatar_key(source: str) -> str:
+    return hashlib.sha256(source.encode()).hexdigest()[:32]
+
+
+def avatar_url(user_id, source: Optional[str], size: Optional[int] = None) -> Optional[str]:
+    """Public URL of a user's cached avatar, or None if the user has none."""
+    if not source:
+        return None
+    size_param = f"&size={size}" if size else ""
+    return f"{AUTH_PUBLIC_URL}/users/{user_id}/avatar?v={avatar_key(source)}{size_param}"
+
+
+def discord_avatar_source(discord_id: str, avatar_hash: Optional[str]) -> Optional[str]:
+    if not avatar_hash:
+        return None
+    extension = "gif" if avatar_hash.startswith("a_") else "png"
+    return f"https://cdn.discordapp.com/avatars/{discord_id}/{avatar_hash}.{extension}?size=512"
+
+
+def google_avatar_source(profile: dict) -> Optional[str]:
+    """The primary, non-default photo of a People API profile."""
+    for photo in profile.get("photos", []):
+        if photo.get("metadata", {}).get("primary") and not photo.get("default") and photo.get("url"):
+            # Google serves any size; ask for one that covers the largest we keep
+            return photo["url"].split("=")[0] + f"=s{max(AVATAR_SIZES) * 2}"
+    return None
+
+
+def allowed_source(source: str) -> bool:
+    parsed = urlparse(source)
+    host = (parsed.hostname or "").lower()
+    return parsed.scheme == "https" and any(host == allowed or host.endswith(f".{allowed}") for allowed in AVATAR_ALLOWED_HOSTS)
+
+
+def cached_path(key: str, size: int) -> str:
+    return os.path.join(AVATAR_CACHE_DIR, key[:2], f"{key}-{size}.webp")
+
+
+def _render(image_bytes: bytes, key: str) -> None:
+    """Decode, square-crop and resize to every size; each file appears atomically."""
+    from PIL import Image, ImageOps
+
+    Image.MAX_IMAGE_PIXELS = _MAX_SOURCE_PIXELS
+    try:
+        with Image.open(io.BytesIO(image_bytes)) as source:
+            # First frame only for animated GIFs
+            source.seek(0)
+            image = source.convert("RGBA")
+    except Exception as e:
+        raise AvatarUnavailable(f"Undecodable image: {type(e).__name__}")
+
+    directory = os.path.dirname(cached_path(key, AVATAR_SIZES[0]))
+    os.makedirs(directory, exist_ok=True)
+    for size in AVATAR_SIZES:
+        resized = ImageOps.fit(image, (size, size), method=Image.Resampling.LANCZOS)
+        buffer = io.BytesIO()
+        resized.save(buffer, format="WEBP", quality=85, method=4)
+        data = buffer.getvalue()
+        path = cached_path(key, size)
+        temporary = f"{path}.{os.getpid()}.tmp"
+        with open(temporary, "wb") as output:
+            output.write(data)
+        os.replace(temporary, path)
+        _remember_etag(path, data)
+
+
+def _remember_etag(path: str, data: bytes) -> str:
+    etag = f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+    _etags[path] = etag
+    _etags.move_to_end(path)
+    while len(_etags) > _ETAG_CACHE_SIZE:
+        _etags.popitem(last=False)
+    return etag
+
+
+async def file_etag(path: str) -> str:
+    """Strong ETag (content hash) of a cached file; hashed once per worker."""
+    etag = _etags.get(path)
+    if etag is None:
+        data = await asyncio.to_thread(_read_file, path)
+        etag = _remember_etag(path, data)
+    return etag
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as cached:
+        return cached.read()
+
+
+def _client() -> httpx.AsyncClient:
+    global _http_client
+    if _http_client is None:
+        _http_client = httpx.AsyncClient(
+            follow_redirects=False,
+            headers={"User-Agent": "finity-auth-avatar-cache"},
+            transport=traced_transport(),
+        )
+    return _http_client
+
+
+async def _download(source: str) -> bytes:
+    async def fetch(timeout: float) -> bytes:
+        async with _client().stream("GET", source, timeout=timeout) as response:
+            response.raise_for_status()
+            if not response.headers.get("content-type", "").startswith("image/"):
+                raise AvatarUnavailable(f"Not an image: {response.headers.get('content-type')}")
+            chunks, size = [], 0
+            async for chunk in response.aiter_bytes():
+                size += len(chunk)
+                if size > AVATAR_MAX_DOWNLOAD_BYTES:
+                    raise AvatarUnavailable("Image too large")
+                chunks.append(chunk)
+            return b"".join(chunks)
+
+    return await dependency("avatar_cdn").call(fetch)
+
+
+async def _fetch_and_render(source: str, key: str) -> None:
+    try:
+        image_bytes = await _download(source)
+    except httpx.HTTPError as e:
+        raise AvatarUnavailable(f"Download failed: {type(e).__name__}")
+    await asyncio.to_thread(_render, image_bytes, key)
+    print(f"🖼️  Cached avatar {key} ({len(image_bytes)} bytes) in sizes {', '.join(map(str, AVATAR_SIZES))}")
+
+
+def _download_finished(key: str, download: asyncio.Future) -> None:
+    _downloads.pop(key, None)
+    if not download.cancelled():
+        # Retrieved here so a failure nobody waited for is not reported as unhandled
+        download.exception()
+
+
+async def ensure_cached(source: str, size: int) -> str:
+    """Path of the cached avatar in `size`, fetching and rendering it first if needed."""
+    key = avatar_key(source)
+    path = cached_path(key, size)
+    if os.path.exists(path):
+        return path
+    if not allowed_source(source):
+        raise AvatarUnavailable("Source host not allowed")
+    download = _downloads.get(key)
+    if download is None:
+        download = asyncio.ensure_future(_fetch_and_render(source, key))
+        _downloads[key] = download
+        download.add_done_callback(lambda done: _download_finished(key, done))
+    # Shielded: a client giving up must not cancel the download others wait for
+    await asyncio.shield(download)
+    return path
+
+
+async def close() -> None:
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
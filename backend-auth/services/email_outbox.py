@@ -0,0 +1,197 @@
+"""
+Email Outbox Service
+Queues auth emails in the email_outbox table and delivers them from a relay worker.
+
+Writers add rows inside their own transaction (see enqueue_email and
+db.UserDatabase.create), so a message exists if and only if the user change
+committed. The relay claims due rows with SELECT ... FOR UPDATE SKIP LOCKED,
+which lets every worker run a relay without sending a row twice, and delivers
+them over a pooled SMTP connection set. Delivery is at-least-once.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from db import EmailOutbox, async_session_maker
+from email_service import (
+    EMAILS_ENABLED,
+    SMTP_CONFIG_VALID,
+    SMTPConnectionPool,
+    build_message,
+    render_password_reset_email,
+    render_verification_email,
+    smtp_dependency,
+)
+
+EMAIL_OUTBOX_BATCH_SIZE = int(os.getenv("EMAIL_OUTBOX_BATCH_SIZE", "50"))
+EMAIL_OUTBOX_POLL_INTERVAL = float(os.getenv("EMAIL_OUTBOX_POLL_INTERVAL", "5"))
+EMAIL_OUTBOX_MAX_ATTEMPTS = int(os.getenv("EMAIL_OUTBOX_MAX_ATTEMPTS", "8"))
+# How long a claimed row stays invisible to other relays before it is retried
+EMAIL_OUTBOX_LEASE_SECONDS = int(os.getenv("EMAIL_OUTBOX_LEASE_SECONDS", "120"))
+
+TEMPLATES = {
+    "verify": render_verification_email,
+    "reset_password": render_password_reset_email,
+}
+
+
+async def enqueue_email(
+    session: AsyncSession,
+    template: str,
+    to_email: str,
+    user_id: Optional[uuid.UUID] = None,
+    token: Optional[str] = None,
+    commit: bool = True,
+) -> EmailOutbox:
+    """
+    Add an outbox row to the caller's session.
+
+    With commit=False the row is only staged and commits with the caller's
+    transaction. Call relay.wake() after committing for immediate delivery.
+    """
+    if template not in TEMPLATES:
+        raise ValueError(f"Unknown email template: {template}")
+    message = EmailOutbox(template=template, to_email=to_email, user_id=user_id, token=token)
+    session.add(message)
+    if commit:
+        await session.commit()
+    return message
+
+
+def _retry_delay(attempts: int) -> timedelta:
+    # 10s, 20s, 40s ... capped at one hour
+    return timedelta(seconds=min(10 * (2 ** (attempts - 1)), 3600))
+
+
+class EmailOutboxRelay:
+    """Background worker that claims pending outbox rows in batches and sends them."""
+
+    def __init__(
+        self,
+        batch_size: int = EMAIL_OUTBOX_BATCH_SIZE,
+        poll_interval: float = EMAIL_OUTBOX_POLL_INTERVAL,
+        max_attempts: int = EMAIL_OUTBOX_MAX_ATTEMPTS,
+        lease_seconds: int = EMAIL_OUTBOX_LEASE_SECONDS,
+    ):
+        self.batch_size = batch_size
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.lease_seconds = lease_seconds
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._pool: Optional[SMTPConnectionPool] = None
+
+    def wake(self) -> None:
+        """Deliver newly queued rows now instead of at the next poll."""
+        self._wakeup.set()
+
+    def start(self) -> None:
+        if self._task is not None:
+            return
+        if EMAILS_ENABLED and not SMTP_CONFIG_VALID:
+            print("⚠️  Email outbox relay not started: SMTP configuration is invalid. Queued emails will stay pending.")
+            return
+        self._stopping = False
+        self._pool = SMTPConnectionPool()
+        self._task = asyncio.create_task(self._run())
+        print("✅ Email outbox relay started")
+
+    async def stop(self) -> None:
+        """Finish the batch in flight, then stop."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self._pool.close()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                delivered = await self.process_batch()
+            except Exception as e:
+                print(f"❌ Email outbox relay error: {type(e).__name__} - {str(e)}")
+                delivered = 0
+            # A full batch means there is probably more waiting
+            if delivered >= self.batch_size:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def _claim(self) -> list[EmailOutbox]:
+        now = datetime.now(timezone.utc)
+        async with async_session_maker() as session:
+            result = await session.execute(
+                select(EmailOutbox)
+                .where(EmailOutbox.status == "pending", EmailOutbox.available_at <= now)
+                .order_by(EmailOutbox.id)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )
+            rows = list(result.scalars())
+            lease_until = now + timedelta(seconds=self.lease_seconds)
+            for row in rows:
+                row.attempts += 1
+                row.available_at = lease_until
+            await session.commit()
+        return rows
+
+    async def process_batch(self) -> int:
+        """Claim and deliver one batch. Returns the number of rows claimed."""
+        if EMAILS_ENABLED and not smtp_dependency.available:
+            # SMTP circuit is open: leave rows pending, without spending attempts, until it may close
+            return 0
+        rows = await self._claim()
+        if not rows:
+            return 0
+        outcomes = await asyncio.gather(*(self._deliver(row) for row in rows), return_exceptions=True)
+
+        now = datetime.now(timezone.utc)
+        async with async_session_maker() as session:
+            for row, outcome in zip(rows, outcomes):
+                row = await session.merge(row, load=False)
+                if outcome is True:
+                    row.status = "sent"
+                    row.sent_at = now
+                    row.token = None
+                    row.last_error = None
+                else:
+                    row.last_error = f"{type(outcome).__name__}: {str(outcome)}"[:500]
+                    if row.attempts >= self.max_attempts:
+                        row.status = "failed"
+                        row.token = None
+                        print(f"❌ Giving up on email to {row.to_email} after {row.attempts} attempts: {row.last_error}")
+                    else:
+                        row.available_at = now + _retry_delay(row.attempts)
+            await session.commit()
+        return len(rows)
+
+    async def _deliver(self, row: EmailOutbox) -> bool:
+        token = row.token
+        if token is None and row.template == "verify":
+            # Rows staged alongside a new user carry no token; mint it at send time
+            from users import generate_verification_token
+            token = generate_verification_token(row.user_id, row.to_email)
+        if token is None:
+            raise ValueError(f"Outbox row {row.id} has no token")
+
+        subject, html_content, text_content = TEMPLATES[row.template](token)
+        if not EMAILS_ENABLED:
+            print(f"⚠️  [EMAIL DISABLED] Would send email to {row.to_email}: {subject}")
+            return True
+        await self._pool.send(build_message(row.to_email, subject, html_content, text_content))
+        print(f"✅ [EMAIL SENT] Outbox email {row.id} to {row.to_email}: {subject}")
+        return True
+
+
+relay = EmailOutboxRelay()
@@ -0,0 +1,205 @@
+"""
+Login Audit Service
+Buffered, batched writer for the login_audit table.
+
+record() only appends to an in-memory queue; a background task flushes the
+queue with one multi-row INSERT whenever batch_size events are waiting or
+flush_interval has passed. When the queue is full, record() waits up to
+LOGIN_AUDIT_ENQUEUE_TIMEOUT for space and then drops the event (and counts it)
+so a slow database cannot stall logins. stop() drains and flushes everything
+still buffered.
+
+On PostgreSQL the table is partitioned by month; ensure_partitions() creates
+upcoming months and drop_old_partitions() removes months past retention.
+"""
+import asyncio
+import os
+import uuid
+from datetime import datetime, timezone
+from typing import Optional
+
+from fastapi import Request
+from sqlalchemy import insert, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from db import LoginAudit, async_session_maker, engine
+
+LOGIN_AUDIT_ENABLED = os.getenv("LOGIN_AUDIT_ENABLED", "true").lower() == "true"
+LOGIN_AUDIT_BUFFER_SIZE = int(os.getenv("LOGIN_AUDIT_BUFFER_SIZE", "10000"))
+LOGIN_AUDIT_BATCH_SIZE = int(os.getenv("LOGIN_AUDIT_BATCH_SIZE", "500"))
+LOGIN_AUDIT_FLUSH_INTERVAL = float(os.getenv("LOGIN_AUDIT_FLUSH_INTERVAL", "2"))
+LOGIN_AUDIT_ENQUEUE_TIMEOUT = float(os.getenv("LOGIN_AUDIT_ENQUEUE_TIMEOUT", "0.05"))
+LOGIN_AUDIT_RETENTION_MONTHS = int(os.getenv("LOGIN_AUDIT_RETENTION_MONTHS", "12"))
+LOGIN_AUDIT_PREMAKE_MONTHS = 2
+
+
+def _month_start(year: int, month: int) -> datetime:
+    # Normalize month overflow/underflow (e.g. month 13 -> January next year)
+    year += (month - 1) // 12
+    month = (month - 1) % 12 + 1
+    return datetime(year, month, 1, tzinfo=timezone.utc)
+
+
+def _partition_name(start: datetime) -> str:
+    return f"login_audit_y{start.year}m{start.month:02d}"
+
+
+async def ensure_partitions(conn: AsyncConnection, months_ahead: int = LOGIN_AUDIT_PREMAKE_MONTHS) -> None:
+    """Create monthly partitions from the current month up to months_ahead (PostgreSQL only)."""
+    if conn.dialect.name != "postgresql":
+        return
+    now = datetime.now(timezone.utc)
+    for offset in range(months_ahead + 1):
+        start = _month_start(now.year, now.month + offset)
+        end = _month_start(start.year, start.month + 1)
+        await conn.execute(text(
+            f'CREATE TABLE IF NOT EXISTS {_partition_name(start)} PARTITION OF login_audit '
+            f"FOR VALUES FROM ('{start.isoformat()}') TO ('{end.isoformat()}')"
+        ))
+
+
+async def drop_old_partitions(conn: AsyncConnection, retention_months: int = LOGIN_AUDIT_RETENTION_MONTHS) -> list[str]:
+    """Drop monthly partitions that end before the retention window. Returns the dropped names."""
+    if conn.dialect.name != "postgresql":
+        return []
+    now = datetime.now(timezone.utc)
+    cutoff = _month_start(now.year, now.month - retention_months)
+    result = await conn.execute(text(
+        "SELECT child.relname FROM pg_inherits "
+        "JOIN pg_class parent ON pg_inherits.inhparent = parent.oid "
+        "JOIN pg_class child ON pg_inherits.inhrelid = child.oid "
+        "WHERE parent.relname = 'login_audit'"
+    ))
+    dropped = []
+    for (name,) in result:
+        try:
+            year, month = int(name[len("login_audit_y"):][:4]), int(name[-2:])
+        except ValueError:
+            continue
+        if _month_start(year, month + 1) <= cutoff:
+            await conn.execute(text(f"DROP TABLE IF EXISTS {name}"))
+            dropped.append(name)
+    return dropped
+
+
+class LoginAuditWriter:
+    """In-memory buffer with size/time triggered batch flushes."""
+
+    def __init__(
+        self,
+        buffer_size: int = LOGIN_AUDIT_BUFFER_SIZE,
+        batch_size: int = LOGIN_AUDIT_BATCH_SIZE,
+        flush_interval: float = LOGIN_AUDIT_FLUSH_INTERVAL,
+        enqueue_timeout: float = LOGIN_AUDIT_ENQUEUE_TIMEOUT,
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.enqueue_timeout = enqueue_timeout
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=buffer_size)
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._partition_month: Optional[tuple[int, int]] = None
+        self.written = 0
+        self.dropped = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    async def record(
+        self,
+        method: str,
+        outcome: str,
+        email: Optional[str] = None,
+        user_id: Optional[uuid.UUID] = None,
+        request: Optional[Request] = None,
+    ) -> None:
+        """Buffer one login event. Never raises; drops the event if the buffer stays full."""
+        if not self.running:
+            return
+        event = {
+            "id": uuid.uuid4(),
+            "occurred_at": datetime.now(timezone.utc),
+            "method": method,
+            "outcome": outcome,
+            "email": email,
+            "user_id": user_id,
+            "ip_address": request.client.host if request is not None and request.client else None,
+            "user_agent": request.headers.get("user-agent", "")[:300] if request is not None else None,
+        }
+        try:
+            self._queue.put_nowait(event)
+            return
+        except asyncio.QueueFull:
+            pass
+        try:
+            await asyncio.wait_for(self._queue.put(event), timeout=self.enqueue_timeout)
+        except asyncio.TimeoutError:
+            self.dropped += 1
+            if self.dropped % 1000 == 1:
+                print(f"⚠️  Login audit buffer full, {self.dropped} events dropped so far")
+
+    def start(self) -> None:
+        if LOGIN_AUDIT_ENABLED and self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop accepting events and flush everything still buffered."""
+        if self._task is None:
+            return
+        task, self._task = self._task, None
+        # Let a flush in progress finish instead of cancelling it mid-insert
+        self._stopping = True
+        await asyncio.gather(task, return_exceptions=True)
+        while not self._queue.empty():
+            await self._flush(self._take(self.batch_size))
+
+    def _take(self, limit: int) -> list[dict]:
+        batch = []
+        while len(batch) < limit and not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        return batch
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while not self._stopping:
+            try:
+                batch = [await asyncio.wait_for(self._queue.get(), timeout=self.flush_interval)]
+            except asyncio.TimeoutError:
+                continue
+            deadline = loop.time() + self.flush_interval
+            while len(batch) < self.batch_size:
+                batch.extend(self._take(self.batch_size - len(batch)))
+                remaining = deadline - loop.time()
+                if len(batch) >= self.batch_size or remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout=remaining))
+                except asyncio.TimeoutError:
+                    break
+            await self._flush(batch)
+
+    async def _flush(self, batch: list[dict]) -> None:
+        if not batch:
+            return
+        try:
+            now = datetime.now(timezone.utc)
+            if self._partition_month != (now.year, now.month):
+                # Once per month per worker: create upcoming partitions, drop expired ones
+                async with engine.begin() as conn:
+                    await ensure_partitions(conn)
+                    for name in await drop_old_partitions(conn):
+                        print(f"🗑️  Dropped login audit partition {name}")
+                self._partition_month = (now.year, now.month)
+            async with async_session_maker() as session:
+                # executemany; SQLAlchemy batches it into multi-row INSERT ... VALUES
+                await session.execute(insert(LoginAudit), batch)
+                await session.commit()
+            self.written += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            print(f"❌ Failed to write {len(batch)} login audit events: {type(e).__name__} - {str(e)}")
+
+
+audit_writer = LoginAuditWriter()
@@ -0,0 +1,402 @@
+"""
+Maintenance Scheduler
+Periodic cleanup jobs, run by one worker of the cluster at a time.
+
+Leader election uses a PostgreSQL session-level advisory lock held on a
+dedicated connection: the worker that gets pg_try_advisory_lock() runs the
+jobs every MAINTENANCE_INTERVAL_SECONDS; the others retry at the same
+interval and take over when the leader's connection goes away. On other
+databases (local SQLite runs) every process considers itself the leader.
+
+Jobs:
+- purge_unverified_users: users never verified and not logged in for
+  UNVERIFIED_USER_RETENTION_DAYS (never admins), with their OAuth accounts;
+  a user.deleted event is recorded for each;
+- prune_orphan_oauth_accounts: oauth_account rows whose user is gone;
+- purge_email_outbox: sent/failed outbox rows past EMAIL_OUTBOX_RETENTION_DAYS;
+- purge_user_events: user_event rows past USER_EVENT_RETENTION_DAYS;
+- purge_login_audit: expired login_audit partitions (row batches elsewhere);
+- purge_idempotency_records: idempotency_record rows past their expires_at;
+- analyze: ANALYZE on tables a run deleted many rows from, and a log hint
+  when dead tuples suggest a manual VACUUM.
+
+Every job deletes in keyset-ordered batches of MAINTENANCE_BATCH_SIZE rows,
+each in its own short transaction, sleeping MAINTENANCE_BATCH_PAUSE_MS
+between batches, so no lock is held for long and the primary is never hit
+with one large DELETE.
+"""
+import asyncio
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import and_, delete, exists, func, or_, select, text, tuple_
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from db import (
+    SHARD_DATABASE_URLS, EmailOutbox, IdempotencyRecord, LoginAudit, OAuthAccount, User, UserEvent,
+    async_session_maker, engine,
+)
+from services.login_audit import LOGIN_AUDIT_RETENTION_MONTHS, drop_old_partitions
+from services.user_events import events_committed, record_events
+
+MAINTENANCE_ENABLED = os.getenv("MAINTENANCE_ENABLED", "true").lower() == "true"
+MAINTENANCE_INTERVAL_SECONDS = float(os.getenv("MAINTENANCE_INTERVAL_SECONDS", "3600"))
+MAINTENANCE_BATCH_SIZE = int(os.getenv("MAINTENANCE_BATCH_SIZE", "500"))
+MAINTENANCE_BATCH_PAUSE_MS = int(os.getenv("MAINTENANCE_BATCH_PAUSE_MS", "200"))
+# ANALYZE a table after a run deleted at least this many rows from it
+MAINTENANCE_ANALYZE_THRESHOLD = int(os.getenv("MAINTENANCE_ANALYZE_THRESHOLD", "10000"))
+UNVERIFIED_USER_RETENTION_DAYS = int(os.getenv("UNVERIFIED_USER_RETENTION_DAYS", "30"))
+EMAIL_OUTBOX_RETENTION_DAYS = int(os.getenv("EMAIL_OUTBOX_RETENTION_DAYS", "14"))
+USER_EVENT_RETENTION_DAYS = int(os.getenv("USER_EVENT_RETENTION_DAYS", "30"))
+
+# Arbitrary constant shared by every worker; identifies the scheduler's advisory lock
+MAINTENANCE_LOCK_KEY = 0x6D61696E74
+# Dead/live tuple ratio above which a VACUUM hint is logged
+VACUUM_HINT_DEAD_RATIO = 0.2
+
+
+def _cutoff(days: int) -> datetime:
+    return datetime.now(timezone.utc) - timedelta(days=days)
+
+
+class AdvisoryLockLeader:
+    """Holds a session-level advisory lock on its own connection while this worker leads."""
+
+    def __init__(self, db_engine: AsyncEngine = engine, key: int = MAINTENANCE_LOCK_KEY):
+        self.engine = db_engine
+        self.key = key
+        self._connection: Optional[AsyncConnection] = None
+
+    @property
+    def is_leader(self) -> bool:
+        return self._connection is not None or self.engine.dialect.name != "postgresql"
+
+    async def try_acquire(self) -> bool:
+        """True if this worker is (still) the leader."""
+        if self.engine.dialect.name != "postgresql":
+            return True
+        if self._connection is not None:
+            try:
+                await self._connection.execute(text("SELECT 1"))
+                await self._connection.commit()
+                return True
+            except Exception:
+                # Connection lost: the lock went with it
+                await self.release()
+        connection = await self.engine.connect()
+        try:
+            acquired = await connection.scalar(select(func.pg_try_advisory_lock(self.key)))
+            # Session-level lock: survives the commit, so the connection does not sit idle in a transaction
+            await connection.commit()
+        except Exception:
+            await connection.close()
+            raise
+        if not acquired:
+            await connection.close()
+            return False
+        self._connection = connection
+        print("👑 This worker is now the maintenance leader")
+        return True
+
+    async def release(self) -> None:
+        if self._connection is None:
+            return
+        connection, self._connection = self._connection, None
+        try:
+            await connection.execute(select(func.pg_advisory_unlock(self.key)))
+            await connection.commit()
+        except Exception:
+            pass
+        finally:
+            await connection.close()
+
+
+class MaintenanceScheduler:
+    """Runs the maintenance jobs periodically while this worker is the leader."""
+
+    def __init__(
+        self,
+        interval: float = MAINTENANCE_INTERVAL_SECONDS,
+        batch_size: int = MAINTENANCE_BATCH_SIZE,
+        batch_pause: float = MAINTENANCE_BATCH_PAUSE_MS / 1000,
+        leader: Optional[AdvisoryLockLeader] = None,
+    ):
+        self.interval = interval
+        self.batch_size = batch_size
+        self.batch_pause = batch_pause
+        self.leader = leader or AdvisoryLockLeader()
+        self.jobs: dict[str, Callable[[], Awaitable[int]]] = {
+            "purge_unverified_users": self.purge_unverified_users,
+            "prune_orphan_oauth_accounts": self.prune_orphan_oauth_accounts,
+            "purge_email_outbox": self.purge_email_outbox,
+            "purge_user_events": self.purge_user_events,
+            "purge_login_audit": self.purge_login_audit,
+            "purge_idempotency_records": self.purge_idempotency_records,
+        }
+        self.last_results: dict[str, dict] = {}
+        self.last_run_at: Optional[datetime] = None
+        self._deleted: dict[tuple[AsyncEngine, str], int] = {}
+        self._running = asyncio.Lock()
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+
+    def start(self) -> None:
+        if MAINTENANCE_ENABLED and self._task is None:
+            self._stopping = False
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop after the batch in progress and give up leadership."""
+        if self._task is None:
+            return
+        self._stopping = True
+        self._wakeup.set()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        await self.leader.release()
+
+    async def _run(self) -> None:
+        while not self._stopping:
+            try:
+                if await self.leader.try_acquire():
+                    await self.run_all()
+            except Exception as e:
+                print(f"❌ Maintenance scheduler error: {type(e).__name__} - {str(e)}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+    async def run_all(self) -> dict[str, dict]:
+        """Run every job once, one after the other. Returns per-job results."""
+        async with self._running:
+            self._deleted = {}
+            for name, job in self.jobs.items():
+                if self._stopping:
+                    break
+                started = time.perf_counter()
+                try:
+                    rows = await job()
+                    result = {"rows": rows, "error": None}
+                    if rows:
+                        print(f"🧹 Maintenance {name}: {rows} rows")
+                except Exception as e:
+                    result = {"rows": None, "error": f"{type(e).__name__}: {str(e)[:200]}"}
+                    print(f"❌ Maintenance {name} failed: {result['error']}")
+                result["seconds"] = round(time.perf_counter() - started, 3)
+                self.last_results[name] = result
+            await self.analyze()
+            self.last_run_at = datetime.now(timezone.utc)
+            return self.last_results
+
+    async def _batches(
+        self,
+        table_engine: AsyncEngine,
+        table: str,
+        delete_batch: Callable[[AsyncConnection, Optional[tuple]], Awaitable[tuple[int, Optional[tuple]]]],
+        after_commit: Optional[Callable[[], Awaitable[None]]] = None,
+    ) -> int:
+        """
+        Call delete_batch(conn, cursor) in its own transaction until it returns a
+        None cursor; it returns (rows deleted, cursor after the last row seen).
+        after_commit runs once each batch's transaction has committed.
+        """
+        total, cursor = 0, None
+        while not self._stopping:
+            async with table_engine.begin() as conn:
+                deleted, cursor = await delete_batch(conn, cursor)
+            if after_commit is not None:
+                await after_commit()
+            total += deleted
+            if cursor is None:
+                break
+            await asyncio.sleep(self.batch_pause)
+        key = (table_engine, table)
+        self._deleted[key] = self._deleted.get(key, 0) + total
+        return total
+
+    def _user_engines(self) -> list[AsyncEngine]:
+        """Where the user tables live: the shards if configured, else DATABASE_URL."""
+        if SHARD_DATABASE_URLS:
+            from sharding import shard_set
+
+            return shard_set.engines
+        return [engine]
+
+    async def purge_unverified_users(self) -> int:
+        cutoff = _cutoff(UNVERIFIED_USER_RETENTION_DAYS)
+        abandoned = and_(
+            User.is_verified.is_(False),
+            User.created_at < cutoff,
+            User.role != "admin",
+            or_(User.last_login_at.is_(None), User.last_login_at < cutoff),
+        )
+        total = 0
+        deleted_ids: list = []
+        event_data = {"reason": "unverified_expired"}
+
+        async def record_deletions():
+            # Users on shards: only for users whose delete has committed
+            if deleted_ids:
+                async with async_session_maker() as session:
+                    await record_events(session, "user.deleted", list(deleted_ids), event_data)
+                deleted_ids.clear()
+
+        async def deletions_committed():
+            events_committed()
+
+        for user_engine in self._user_engines():
+            # Users next to the event table: their events commit with the delete
+            same_database = user_engine is engine
+
+            async def delete_batch(conn: AsyncConnection, cursor: Optional[tuple]):
+                statement = select(User.created_at, User.id).where(abandoned)
+                if cursor is not None:
+                    statement = statement.where(tuple_(User.created_at, User.id) > tuple_(*cursor))
+                rows = (await conn.execute(
+                    statement.order_by(User.created_at, User.id).limit(self.batch_size)
+                )).all()
+                if not rows:
+                    return 0, None
+                ids = [row.id for row in rows]
+                await conn.execute(delete(OAuthAccount).where(OAuthAccount.user_id.in_(ids)))
+                # Re-check the condition: a user may have verified since the SELECT
+                deleted = (await conn.execute(
+                    delete(User).where(User.id.in_(ids), abandoned).returning(User.id)
+                )).scalars().all()
+                if same_database:
+                    await record_events(conn, "user.deleted", list(deleted), event_data, commit=False)
+                else:
+                    deleted_ids.extend(deleted)
+                next_cursor = (rows[-1].created_at, rows[-1].id) if len(rows) == self.batch_size else None
+                return len(deleted), next_cursor
+
+            after_commit = deletions_committed if same_database else record_deletions
+            total += await self._batches(user_engine, "user", delete_batch, after_commit=after_commit)
+        return total
+
+    async def prune_orphan_oauth_accounts(self) -> int:
+        orphaned = ~exists().where(User.id == OAuthAccount.user_id)
+        total = 0
+        for user_engine in self._user_engines():
+
+            async def delete_batch(conn: AsyncConnection, cursor: Optional[tuple]):
+                statement = select(OAuthAccount.id).where(orphaned)
+                if cursor is not None:
+                    statement = statement.where(OAuthAccount.id > cursor[0])
+                ids = (await conn.execute(statement.order_by(OAuthAccount.id).limit(self.batch_size))).scalars().all()
+                if not ids:
+                    return 0, None
+                result = await conn.execute(delete(OAuthAccount).where(OAuthAccount.id.in_(ids), orphaned))
+                return result.rowcount, (ids[-1],) if len(ids) == self.batch_size else None
+
+            total += await self._batches(user_engine, "oauth_account", delete_batch)
+        return total
+
+    async def _purge_by_id(self, model, table: str, condition) -> int:
+        """Batched delete of rows matching condition, walking the integer primary key."""
+
+        async def delete_batch(conn: AsyncConnection, cursor: Optional[tuple]):
+            statement = select(model.id).where(condition)
+            if cursor is not None:
+                statement = statement.where(model.id > cursor[0])
+            ids = (await conn.execute(statement.order_by(model.id).limit(self.batch_size))).scalars().all()
+            if not ids:
+                return 0, None
+            result = await conn.execute(delete(model).where(model.id.in_(ids)))
+            return result.rowcount, (ids[-1],) if len(ids) == self.batch_size else None
+
+        return await self._batches(engine, table, delete_batch)
+
+    async def purge_email_outbox(self) -> int:
+        return await self._purge_by_id(
+            EmailOutbox,
+            "email_outbox",
+            and_(EmailOutbox.status.in_(("sent", "failed")), EmailOutbox.created_at < _cutoff(EMAIL_OUTBOX_RETENTION_DAYS)),
+        )
+
+    async def purge_user_events(self) -> int:
+        return await self._purge_by_id(UserEvent, "user_event", UserEvent.created_at < _cutoff(USER_EVENT_RETENTION_DAYS))
+
+    async def purge_idempotency_records(self) -> int:
+        now = datetime.now(timezone.utc)
+
+        async def delete_batch(conn: AsyncConnection, cursor: Optional[tuple]):
+            # Deleted rows drop out of the next batch's query, so no cursor is needed
+            keys = (await conn.execute(
+                select(IdempotencyRecord.key)
+                .where(IdempotencyRecord.expires_at < now)
+                .order_by(IdempotencyRecord.expires_at)
+                .limit(self.batch_size)
+            )).scalars().all()
+            if not keys:
+                return 0, None
+            result = await conn.execute(delete(IdempotencyRecord).where(IdempotencyRecord.key.in_(keys)))
+            return result.rowcount, (keys[-1],) if len(keys) == self.batch_size else None
+
+        return await self._batches(engine, "idempotency_record", delete_batch)
+
+    async def purge_login_audit(self) -> int:
+        if engine.dialect.name == "postgresql":
+            # Monthly partitions: dropping a whole month is cheaper than deleting its rows
+            async with engine.begin() as conn:
+                dropped = await drop_old_partitions(conn)
+            for name in dropped:
+                print(f"🗑️  Dropped login audit partition {name}")
+            return len(dropped)
+        cutoff = _cutoff(LOGIN_AUDIT_RETENTION_MONTHS * 31)
+
+        async def delete_batch(conn: AsyncConnection, cursor: Optional[tuple]):
+            statement = select(LoginAudit.occurred_at, LoginAudit.id).where(LoginAudit.occurred_at < cutoff)
+            if cursor is not None:
+                statement = statement.where(tuple_(LoginAudit.occurred_at, LoginAudit.id) > tuple_(*cursor))
+            rows = (await conn.execute(
+                statement.order_by(LoginAudit.occurred_at, LoginAudit.id).limit(self.batch_size)
+            )).all()
+            if not rows:
+                return 0, None
+            result = await conn.execute(delete(LoginAudit).where(LoginAudit.id.in_([row.id for row in rows])))
+            return result.rowcount, (rows[-1].occurred_at, rows[-1].id) if len(rows) == self.batch_size else None
+
+        return await self._batches(engine, "login_audit", delete_batch)
+
+    async def analyze(self) -> None:
+        """Refresh planner statistics where a run deleted a lot, and hint at VACUUM when dead tuples pile up."""
+        for (table_engine, table), deleted in self._deleted.items():
+            if deleted < MAINTENANCE_ANALYZE_THRESHOLD:
+                continue
+            try:
+                async with table_engine.connect() as conn:
+                    conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+                    await conn.execute(text(f'ANALYZE "{table}"'))
+                    if table_engine.dialect.name != "postgresql":
+                        continue
+                    stats = (await conn.execute(
+                        text("SELECT n_live_tup, n_dead_tup FROM pg_stat_user_tables WHERE relname = :table"),
+                        {"table": table},
+                    )).first()
+            except Exception as e:
+                print(f"⚠️  ANALYZE {table} failed: {type(e).__name__} - {str(e)}")
+                continue
+            if stats and stats.n_dead_tup > VACUUM_HINT_DEAD_RATIO * max(stats.n_live_tup, 1):
+                print(
+                    f"💡 {table}: {stats.n_dead_tup} dead vs {stats.n_live_tup} live tuples after maintenance; "
+                    f"autovacuum may be lagging, consider VACUUM (ANALYZE) \"{table}\" off-peak"
+                )
+
+    def stats(self) -> dict:
+        return {
+            "enabled": MAINTENANCE_ENABLED,
+            "running": self._task is not None,
+            "leader": self._task is not None and self.leader.is_leader,
+            "interval_seconds": self.interval,
+            "last_run_at": self.last_run_at.isoformat() if self.last_run_at else None,
+            "jobs": self.last_results,
+        }
+
+
+maintenance_scheduler = MaintenanceScheduler()
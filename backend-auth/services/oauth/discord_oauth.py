@@ -7,6 +7,9 @@ import httpx
 from typing import Dict, Optional, Tuple
 from urllib.parse import urlencode
 
+from resilience import dependency
+from tracing import traced_transport
+
 
 class DiscordOAuthService:
     """Custom Discord OAuth2 service with explicit token exchange and user info fetching"""
@@ -35,6 +38,8 @@ class DiscordOAuthService:
         self.client_secret = client_secret
         self.redirect_uri = redirect_uri
         self.scope = scope
+        # Circuit breaker, bulkhead and per-request deadline budget for discord.com
+        self.dependency = dependency("oauth:discord", timeout=10.0)
     
     def get_authorization_url(self, state: Optional[str] = None) -> str:
         """
@@ -88,15 +93,19 @@ class DiscordOAuthService:
             "Content-Type": "application/x-www-form-urlencoded",
         }
         
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(transport=traced_transport()) as client:
             try:
-                response = await client.post(
-                    self.DISCORD_TOKEN_URL,
-                    data=data,
-                    headers=headers,
-                    timeout=10.0
-                )
-                response.raise_for_status()
+                async def post_token(timeout: float) -> httpx.Response:
+                    response = await client.post(
+                        self.DISCORD_TOKEN_URL,
+                        data=data,
+                        headers=headers,
+                        timeout=timeout
+                    )
+                    response.raise_for_status()
+                    return response
+                
+                response = await self.dependency.call(post_token)
                 
                 token_data = response.json()
                 
@@ -147,14 +156,18 @@ class DiscordOAuthService:
             "Authorization": f"Bearer {access_token}",
         }
         
-        async with httpx.AsyncClient() as client:
+        async with httpx.AsyncClient(transport=traced_transport()) as client:
             try:
-                response = await client.get(
-                    self.DISCORD_USER_URL,
-                    headers=headers,
-                    timeout=10.0
-                )
-                response.raise_for_status()
+                async def get_user(timeout: float) -> httpx.Response:
+                    response = await client.get(
+                        self.DISCORD_USER_URL,
+                        headers=headers,
+                        timeout=timeout
+                    )
+                    response.raise_for_status()
+                    return response
+                
+                response = await self.dependency.call(get_user)
                 
                 user_data = response.json()
                 
@@ -0,0 +1,46 @@
+"""
+Profile Response Cache
+Short-lived, per-user cache of the serialized /users/me body.
+
+Entries are keyed by (user id, profile_version), so a cached body can never be
+served for a newer profile; the TTL only bounds memory. UserManager also drops
+a user's entry whenever it writes to that user.
+"""
+import os
+import time
+import uuid
+from collections import OrderedDict
+from typing import Optional
+
+PROFILE_CACHE_TTL_SECONDS = float(os.getenv("PROFILE_CACHE_TTL_SECONDS", "30"))
+PROFILE_CACHE_MAX_ENTRIES = int(os.getenv("PROFILE_CACHE_MAX_ENTRIES", "10000"))
+
+
+class ProfileResponseCache:
+    def __init__(self, ttl: float = PROFILE_CACHE_TTL_SECONDS, max_entries: int = PROFILE_CACHE_MAX_ENTRIES):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[uuid.UUID, tuple[int, float, bytes]] = OrderedDict()
+
+    def get(self, user_id: uuid.UUID, version: int) -> Optional[bytes]:
+        entry = self._entries.get(user_id)
+        if entry is None:
+            return None
+        cached_version, expires_at, body = entry
+        if cached_version != version or expires_at < time.monotonic():
+            del self._entries[user_id]
+            return None
+        self._entries.move_to_end(user_id)
+        return body
+
+    def put(self, user_id: uuid.UUID, version: int, body: bytes) -> None:
+        self._entries[user_id] = (version, time.monotonic() + self.ttl, body)
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: uuid.UUID) -> None:
+        self._entries.pop(user_id, None)
+
+
+profile_cache = ProfileResponseCache()
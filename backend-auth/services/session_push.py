@@ -0,0 +1,283 @@
+"""
+Session Push Service
+Pushes changes to a signed-in user's own account to that user's open sessions,
+so the frontend does not have to poll GET /users/me.
+
+One dispatcher task per worker follows the user_event feed (woken by
+event_hub, like the /events/users stream) and fans each event out to the
+connections of the user it concerns. A connection is a _Subscriber: a user id,
+a short list of pending messages and the future its stream waits on. There
+are no per-connection timers or database sessions; keepalives and token
+expiry are handled by the dispatcher on one tick for all connections, so an
+idle connection costs little more than its stream's coroutine.
+
+Message types sent to the client:
+- ready: first message, the user's current state (compare profile_version)
+- verified, role_changed, profile_updated: refetch /users/me
+- deactivated, deleted, token_revoked (a new password was set),
+  token_expired: the session is over; the stream closes after sending it
+
+token_revoked is sent for a password change or reset, and for any other
+write that sets a new password (an admin edit changing role and password
+together). Upgrading the stored hash at login keeps the password and
+records no event, so it never ends a session. The message tells the client
+to sign out; the access token itself stays valid until it expires, the
+service has no server-side revocation list.
+
+Browsers open the stream with EventSource, which cannot send an Authorization
+header. Instead of the access token in the URL (where it would end up in
+access logs and proxies), they first exchange it for a stream ticket: a JWT
+for the session-push audience only, valid for SESSION_PUSH_TICKET_SECONDS
+and redeemable once per worker. It carries the access token's expiry, so the
+stream still ends with token_expired when the session does.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import AsyncIterator, Optional
+
+import jwt
+from fastapi_users.jwt import decode_jwt, generate_jwt
+
+from services.user_events import (
+    USER_EVENTS_ENABLED,
+    USER_EVENTS_POLL_INTERVAL,
+    event_hub,
+    fetch_events,
+    latest_event_id,
+    user_snapshot,
+)
+from users import SECRET
+
+SESSION_PUSH_ENABLED = os.getenv("SESSION_PUSH_ENABLED", "true").lower() == "true" and USER_EVENTS_ENABLED
+SESSION_PUSH_KEEPALIVE_SECONDS = float(os.getenv("SESSION_PUSH_KEEPALIVE_SECONDS", "25"))
+# Per-worker cap on open push connections; further clients get 503 and fall back to polling
+SESSION_PUSH_MAX_CONNECTIONS = int(os.getenv("SESSION_PUSH_MAX_CONNECTIONS", "20000"))
+# A client this far behind is disconnected (it reconnects and gets a fresh "ready")
+SESSION_PUSH_MAX_PENDING = 32
+SESSION_PUSH_BATCH_SIZE = 500
+SESSION_PUSH_TICKET_SECONDS = int(os.getenv("SESSION_PUSH_TICKET_SECONDS", "30"))
+STREAM_TICKET_AUDIENCE = "finity:session-push"
+
+# user_event type -> (push message type, ends the session)
+PUSHED_EVENTS = {
+    "user.verified": ("verified", False),
+    "user.role_changed": ("role_changed", False),
+    "user.updated": ("profile_updated", False),
+    "user.deactivated": ("deactivated", True),
+    "user.deleted": ("deleted", True),
+    "user.password_changed": ("token_revoked", True),
+}
+
+_KEEPALIVE = ": keepalive\n\n"
+_CLOSE = object()
+
+# jti -> exp of tickets redeemed by this worker, kept until they expire
+_redeemed_tickets: dict[str, float] = {}
+
+
+def issue_stream_ticket(user_id: uuid.UUID, session_expires_at: Optional[float]) -> str:
+    """A short-lived ticket that opens one /users/me/events stream for the user, and nothing else."""
+    return generate_jwt(
+        {
+            "sub": str(user_id),
+            "aud": STREAM_TICKET_AUDIENCE,
+            "jti": uuid.uuid4().hex,
+            "session_exp": session_expires_at,
+        },
+        SECRET,
+        SESSION_PUSH_TICKET_SECONDS,
+    )
+
+
+def redeem_stream_ticket(ticket: Optional[str]) -> Optional[tuple[uuid.UUID, Optional[float]]]:
+    """(user id, session expiry) of a valid ticket not redeemed before, or None."""
+    if not ticket:
+        return None
+    try:
+        claims = decode_jwt(ticket, SECRET, [STREAM_TICKET_AUDIENCE])
+        user_id = uuid.UUID(claims["sub"])
+        jti, expires_at = str(claims["jti"]), float(claims["exp"])
+    except (jwt.PyJWTError, KeyError, TypeError, ValueError):
+        return None
+    now = time.time()
+    for redeemed, redeemed_until in tuple(_redeemed_tickets.items()):
+        if redeemed_until <= now:
+            del _redeemed_tickets[redeemed]
+    if jti in _redeemed_tickets:
+        return None
+    _redeemed_tickets[jti] = expires_at
+    return user_id, claims.get("session_exp")
+
+
+def _sets_new_password(event) -> bool:
+    """
+    Whether an event records a new password. Login-time hash upgrades are
+    saved with password_rehash=True and record no event (see
+    user_events.update_event), so a hashed_password change in the feed is
+    always a real one.
+    """
+    data = event.data or {}
+    return event.type == "user.password_changed" or "hashed_password" in data.get("fields", ())
+
+
+def _message(message_type: str, data: dict, event_id: Optional[int] = None) -> str:
+    event_line = f"id: {event_id}\n" if event_id is not None else ""
+    return f"{event_line}event: {message_type}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+
+class _Subscriber:
+    __slots__ = ("user_id", "expires_at", "pending", "waiter", "closed")
+
+    def __init__(self, user_id: uuid.UUID, expires_at: Optional[float]):
+        self.user_id = user_id
+        self.expires_at = expires_at
+        self.pending: list = []
+        self.waiter: Optional[asyncio.Future] = None
+        self.closed = False
+
+    def push(self, item, last: bool = False) -> None:
+        if self.closed:
+            return
+        if len(self.pending) >= SESSION_PUSH_MAX_PENDING:
+            self.pending.clear()
+            last = True
+            item = _CLOSE
+        self.pending.append(item)
+        if last:
+            self.closed = True
+            if item is not _CLOSE:
+                self.pending.append(_CLOSE)
+        if self.waiter is not None and not self.waiter.done():
+            self.waiter.set_result(None)
+
+
+class SessionPushHub:
+    def __init__(self):
+        self._subscribers: dict[uuid.UUID, set[_Subscriber]] = {}
+        self._count = 0
+        self._task: Optional[asyncio.Task] = None
+        self._cursor = 0
+        self.delivered = 0
+
+    @property
+    def connections(self) -> int:
+        return self._count
+
+    def full(self) -> bool:
+        return self._count >= SESSION_PUSH_MAX_CONNECTIONS
+
+    def subscribe(self, user_id: uuid.UUID, expires_at: Optional[float]) -> _Subscriber:
+        subscriber = _Subscriber(user_id, expires_at)
+        self._subscribers.setdefault(user_id, set()).add(subscriber)
+        self._count += 1
+        return subscriber
+
+    def unsubscribe(self, subscriber: _Subscriber) -> None:
+        subscribers = self._subscribers.get(subscriber.user_id)
+        if subscribers is None or subscriber not in subscribers:
+            return
+        subscribers.discard(subscriber)
+        self._count -= 1
+        if not subscribers:
+            del self._subscribers[subscriber.user_id]
+
+    async def stream(self, subscriber: _Subscriber, user) -> AsyncIterator[str]:
+        """Server-sent events for one connection; unsubscribes when the client goes away."""
+        try:
+            yield "retry: 5000\n\n"
+            yield _message("ready", {**user_snapshot(user), "user_id": str(user.id)})
+            while True:
+                if not subscriber.pending:
+                    subscriber.waiter = asyncio.get_running_loop().create_future()
+                    await subscriber.waiter
+                    subscriber.waiter = None
+                items, subscriber.pending = subscriber.pending, []
+                for item in items:
+                    if item is _CLOSE:
+                        return
+                    yield item
+        finally:
+            self.unsubscribe(subscriber)
+
+    def _dispatch(self, event) -> None:
+        pushed = PUSHED_EVENTS.get(event.type)
+        subscribers = self._subscribers.get(event.user_id)
+        if pushed is None or not subscribers:
+            return
+        message_type, ends_session = pushed
+        if _sets_new_password(event):
+            # Whatever else the write changed (role, email, ...), the old password's sessions end
+            message_type, ends_session = "token_revoked", True
+        message = _message(message_type, event.data or {}, event.id)
+        for subscriber in tuple(subscribers):
+            subscriber.push(message, last=ends_session)
+            self.delivered += 1
+
+    def _tick(self) -> None:
+        """Keepalive for every connection, and end sessions whose token has expired."""
+        now = time.time()
+        for subscribers in tuple(self._subscribers.values()):
+            for subscriber in tuple(subscribers):
+                if subscriber.expires_at is not None and subscriber.expires_at <= now:
+                    subscriber.push(_message("token_expired", {}), last=True)
+                elif not subscriber.pending:
+                    subscriber.push(_KEEPALIVE)
+
+    async def _run(self) -> None:
+        self._cursor = await latest_event_id()
+        next_tick = time.monotonic() + SESSION_PUSH_KEEPALIVE_SECONDS
+        while True:
+            try:
+                timeout = max(0.0, min(USER_EVENTS_POLL_INTERVAL, next_tick - time.monotonic()))
+                await event_hub.wait(timeout)
+                while True:
+                    events = await fetch_events(self._cursor, SESSION_PUSH_BATCH_SIZE)
+                    for event in events:
+                        self._cursor = event.id
+                        self._dispatch(event)
+                    if len(events) < SESSION_PUSH_BATCH_SIZE:
+                        break
+                if time.monotonic() >= next_tick:
+                    self._tick()
+                    next_tick = time.monotonic() + SESSION_PUSH_KEEPALIVE_SECONDS
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"⚠️  Session push dispatcher error: {type(e).__name__} - {str(e)}")
+                await asyncio.sleep(USER_EVENTS_POLL_INTERVAL)
+
+    def start(self) -> None:
+        if not SESSION_PUSH_ENABLED or self._task is not None:
+            return
+        self._task = asyncio.create_task(self._run())
+        print("✅ Session push dispatcher started")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        # Close open streams so the server can shut down; clients reconnect elsewhere
+        for subscribers in tuple(self._subscribers.values()):
+            for subscriber in tuple(subscribers):
+                subscriber.push(_CLOSE, last=True)
+
+    def stats(self) -> dict:
+        return {
+            "enabled": SESSION_PUSH_ENABLED,
+            "connections": self._count,
+            "users": len(self._subscribers),
+            "max_connections": SESSION_PUSH_MAX_CONNECTIONS,
+            "cursor": self._cursor,
+            "delivered": self.delivered,
+        }
+
+
+session_push_hub = SessionPushHub()
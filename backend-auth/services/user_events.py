@@ -0,0 +1,241 @@
+"""
+User Events Service
+Change feed of user records (registered, updated, verified, role changes, deletes).
+
+The user database layer (db.UserDatabase) stages the event with
+record_events(commit=False) in the transaction that writes the user, so a
+change and its event commit or roll back together. On PostgreSQL the insert
+also issues pg_notify('user_events', id), delivered only if it commits.
+(Sharded users live on other databases; their events are committed right
+after the shard write, see sharding.ShardedUserDatabase.)
+
+Event ids are handed out in commit order: on PostgreSQL every event-writing
+transaction takes a transaction-level advisory lock right before inserting
+its events and holds it until it commits, so a transaction with a lower id
+cannot commit after one with a higher id (SQLite serializes writers anyway).
+Consumers can therefore page by id without skipping late commits. Callers
+make the event insert the last statement before their commit, after any row
+locks they take, which keeps the lock short and the lock order consistent.
+
+event_hub keeps one LISTEN connection per worker and wakes every open stream
+when a notification arrives; streams also poll every USER_EVENTS_POLL_INTERVAL
+seconds, which covers other databases and missed notifications.
+
+Consumers read with a cursor (the last event id they processed) from
+GET /events/users or the SSE stream GET /events/users/stream and keep their
+own read model instead of calling /users/me.
+"""
+import asyncio
+import json
+import os
+import time
+import uuid
+from typing import AsyncIterator, Union
+
+from sqlalchemy import func, insert, select, text
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncSession
+
+from db import User, UserEvent, async_session_maker, engine
+
+USER_EVENTS_ENABLED = os.getenv("USER_EVENTS_ENABLED", "true").lower() == "true"
+# Shared secret for service consumers (X-Events-Token); admins can use their JWT instead
+USER_EVENTS_TOKEN = os.getenv("USER_EVENTS_TOKEN", "")
+USER_EVENTS_POLL_INTERVAL = float(os.getenv("USER_EVENTS_POLL_INTERVAL", "5"))
+USER_EVENTS_KEEPALIVE_SECONDS = float(os.getenv("USER_EVENTS_KEEPALIVE_SECONDS", "15"))
+USER_EVENTS_CHANNEL = "user_events"
+# Arbitrary constant shared by every worker; serializes event commits (see module docstring)
+USER_EVENTS_LOCK_KEY = 0x7573726576
+MAX_EVENTS_PAGE_SIZE = 1000
+
+# Fields consumers may see; everything else (hashed_password, ...) is reduced to its name
+PUBLIC_FIELDS = {"email", "role", "is_active", "is_verified", "is_superuser"}
+
+
+def user_snapshot(user: User) -> dict:
+    return {
+        "email": user.email,
+        "role": user.role,
+        "is_active": user.is_active,
+        "is_verified": user.is_verified,
+        "is_superuser": user.is_superuser,
+        "profile_version": user.profile_version,
+    }
+
+
+async def record_event(session: AsyncSession, event_type: str, user_id: uuid.UUID, data: dict) -> None:
+    """Insert an event (committing the caller's session) and notify listeners."""
+    await record_events(session, event_type, [user_id], data)
+
+
+async def record_events(
+    executor: Union[AsyncSession, AsyncConnection],
+    event_type: str,
+    user_ids: list[uuid.UUID],
+    data: dict,
+    commit: bool = True,
+) -> None:
+    """
+    Insert one event per user with the same type and data, on a session or a
+    connection. With commit=False the events join the caller's transaction,
+    which the caller must commit next (then call events_committed()).
+    """
+    if not USER_EVENTS_ENABLED or not user_ids:
+        return
+    if _dialect_name(executor) == "postgresql":
+        # Held until commit: ids are taken, and become visible, in commit order
+        await executor.execute(select(func.pg_advisory_xact_lock(USER_EVENTS_LOCK_KEY)))
+    event_ids = (await executor.execute(
+        insert(UserEvent.__table__)
+        .values([{"type": event_type, "user_id": user_id, "data": data} for user_id in user_ids])
+        .returning(UserEvent.__table__.c.id)
+    )).scalars().all()
+    if _dialect_name(executor) == "postgresql":
+        # Delivered at commit, and only if the transaction commits
+        await executor.execute(text("SELECT pg_notify(:channel, :payload)"), {"channel": USER_EVENTS_CHANNEL, "payload": str(max(event_ids))})
+    if commit:
+        await executor.commit()
+        events_committed()
+
+
+def events_committed() -> None:
+    """Wake this worker's streams after committing staged events (other workers hear pg_notify)."""
+    event_hub.notify_local()
+
+
+def _dialect_name(executor: Union[AsyncSession, AsyncConnection]) -> str:
+    if isinstance(executor, AsyncConnection):
+        return executor.dialect.name
+    return executor.bind.dialect.name
+
+
+def update_event(user: User, update_dict: dict, password_rehash: bool = False) -> tuple[str, dict] | None:
+    """
+    (type, data) of the event for a user write, or None if nothing but
+    profile_version changes. Role, activation, password and verification
+    changes get their own types.
+
+    password_rehash marks the transparent upgrade of a stored hash at login
+    (same password, new parameters): it records no event, so consumers only
+    ever see user.password_changed for an actual new password.
+    """
+    fields = sorted(key for key in update_dict if key != "profile_version")
+    if not fields or (password_rehash and fields == ["hashed_password"]):
+        return None
+    if "role" in update_dict:
+        event_type = "user.role_changed"
+    elif update_dict.get("is_active") is False:
+        event_type = "user.deactivated"
+    elif "hashed_password" in update_dict:
+        event_type = "user.password_changed"
+    elif fields == ["is_verified"] and update_dict["is_verified"]:
+        event_type = "user.verified"
+    else:
+        event_type = "user.updated"
+    changes = {key: update_dict[key] for key in fields if key in PUBLIC_FIELDS}
+    return event_type, {
+        "fields": fields,
+        "changes": changes,
+        "profile_version": user.profile_version,
+    }
+
+
+def event_to_dict(event: UserEvent) -> dict:
+    return {
+        "id": event.id,
+        "type": event.type,
+        "user_id": str(event.user_id),
+        "data": event.data,
+        "created_at": event.created_at.isoformat() if event.created_at else None,
+    }
+
+
+async def fetch_events(after_id: int, limit: int = 100) -> list[UserEvent]:
+    """Committed events with id > after_id, oldest first. Uses a short-lived session."""
+    async with async_session_maker() as session:
+        result = await session.execute(
+            select(UserEvent)
+            .where(UserEvent.id > after_id)
+            .order_by(UserEvent.id)
+            .limit(min(limit, MAX_EVENTS_PAGE_SIZE))
+        )
+        return list(result.scalars())
+
+
+async def latest_event_id() -> int:
+    async with async_session_maker() as session:
+        return await session.scalar(select(func.coalesce(func.max(UserEvent.id), 0)))
+
+
+class UserEventHub:
+    """Wakes waiting streams when events are written (LISTEN on PostgreSQL, in-process otherwise)."""
+
+    def __init__(self):
+        self._changed = asyncio.Event()
+        self._listen_connection = None
+        self._raw_connection = None
+
+    def notify_local(self, *_args) -> None:
+        # Swap the event so every current waiter wakes and later waiters block again
+        changed, self._changed = self._changed, asyncio.Event()
+        changed.set()
+
+    async def wait(self, timeout: float) -> bool:
+        """Wait for new events. False on timeout."""
+        changed = self._changed
+        try:
+            await asyncio.wait_for(changed.wait(), timeout=timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def start(self) -> None:
+        if not USER_EVENTS_ENABLED or engine.dialect.name != "postgresql" or self._listen_connection is not None:
+            return
+        try:
+            self._listen_connection = await engine.connect()
+            self._raw_connection = await self._listen_connection.get_raw_connection()
+            await self._raw_connection.driver_connection.add_listener(USER_EVENTS_CHANNEL, self.notify_local)
+            print(f"✅ Listening for user events on channel '{USER_EVENTS_CHANNEL}'")
+        except Exception as e:
+            # Streams still poll every USER_EVENTS_POLL_INTERVAL seconds
+            print(f"⚠️  Could not LISTEN for user events: {type(e).__name__} - {str(e)}")
+            await self.stop()
+
+    async def stop(self) -> None:
+        if self._listen_connection is None:
+            return
+        try:
+            if self._raw_connection is not None:
+                await self._raw_connection.driver_connection.remove_listener(USER_EVENTS_CHANNEL, self.notify_local)
+        except Exception:
+            pass
+        await self._listen_connection.close()
+        self._listen_connection = None
+        self._raw_connection = None
+
+
+event_hub = UserEventHub()
+
+
+async def stream_events(after_id: int, batch_size: int = 100) -> AsyncIterator[str]:
+    """
+    Server-sent events from after_id on, forever. Each event carries its id, so
+    a reconnecting EventSource resumes with Last-Event-ID. No DB session is held
+    between batches.
+    """
+    cursor = after_id
+    yield "retry: 3000\n\n"
+    last_sent = time.monotonic()
+    while True:
+        events = await fetch_events(cursor, batch_size)
+        for event in events:
+            cursor = event.id
+            yield f"id: {event.id}\nevent: {event.type}\ndata: {json.dumps(event_to_dict(event))}\n\n"
+            last_sent = time.monotonic()
+        if len(events) == batch_size:
+            continue
+        woken = await event_hub.wait(USER_EVENTS_POLL_INTERVAL)
+        if not woken and time.monotonic() - last_sent >= USER_EVENTS_KEEPALIVE_SECONDS:
+            # Keeps proxies from closing an idle stream
+            yield ": keepalive\n\n"
+            last_sent = time.monotonic()
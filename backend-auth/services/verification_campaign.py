@@ -0,0 +1,360 @@
+"""
+Verification Campaign Service
+Re-sends verification emails to every unverified user in resumable batches.
+
+Users are streamed with a server-side cursor ordered by id, tokens are generated
+locally per batch and messages go out over a shared SMTP connection pool. After
+each batch the campaign row is checkpointed, so a cancelled or crashed campaign
+resumes from the last processed user id. With sharded users the shards are
+walked one after another in configuration order; the shard owning
+last_user_id tells where to resume.
+
+One campaign runs at a time, on one worker: starting or resuming claims the
+row (claimed_by, lease_until) under an advisory lock, and every checkpoint
+renews the lease only while the row is still this worker's and running. A
+worker whose claim is gone (cancelled from another worker, or taken over after
+its lease ran out) stops after the batch in flight. total_estimate comes from
+planner statistics and is replaced by the real count when the campaign completes.
+"""
+import asyncio
+import os
+import socket
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+from sqlalchemy import func, or_, select, update
+
+from db import SHARD_DATABASE_URLS, User, VerificationCampaign, async_session_maker
+from email_service import (
+    EMAILS_ENABLED,
+    SMTP_CONFIG_VALID,
+    SMTPConnectionPool,
+    build_message,
+    render_verification_email,
+    smtp_dependency,
+)
+from users import generate_verification_token
+
+DEFAULT_BATCH_SIZE = 500
+DEFAULT_CONCURRENCY = 10
+# A claim not renewed for this long (worker crashed or stuck) can be taken over by a resume
+VERIFICATION_CAMPAIGN_LEASE_SECONDS = int(os.getenv("VERIFICATION_CAMPAIGN_LEASE_SECONDS", "300"))
+# Arbitrary constant shared by every worker; serializes campaign claims
+CAMPAIGN_LOCK_KEY = 0x7663616D70
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+
+# Campaign tasks of this process, keyed by campaign id (the claim itself is in the database)
+_running: Dict[uuid.UUID, asyncio.Task] = {}
+
+
+class ClaimLost(Exception):
+    """The campaign was cancelled elsewhere or claimed by another worker."""
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+def _lease_active(campaign: VerificationCampaign, now: datetime) -> bool:
+    lease_until = campaign.lease_until
+    if lease_until is None:
+        return False
+    if lease_until.tzinfo is None:
+        # SQLite hands back naive datetimes
+        lease_until = lease_until.replace(tzinfo=timezone.utc)
+    return campaign.status == "running" and lease_until > now
+
+
+def campaign_to_dict(campaign: VerificationCampaign) -> dict:
+    """Serialize a campaign row for API responses."""
+    processed = campaign.sent_count + campaign.failed_count + campaign.skipped_count
+    return {
+        "id": str(campaign.id),
+        "status": campaign.status,
+        "active": _lease_active(campaign, _now()),
+        "worker": campaign.claimed_by,
+        "batch_size": campaign.batch_size,
+        "concurrency": campaign.concurrency,
+        "total_estimate": campaign.total_estimate,
+        "sent": campaign.sent_count,
+        "failed": campaign.failed_count,
+        "skipped": campaign.skipped_count,
+        "processed": processed,
+        "progress": round(processed / campaign.total_estimate, 4) if campaign.total_estimate else None,
+        "last_user_id": str(campaign.last_user_id) if campaign.last_user_id else None,
+        "last_error": campaign.last_error,
+        "created_at": campaign.created_at.isoformat() if campaign.created_at else None,
+        "updated_at": campaign.updated_at.isoformat() if campaign.updated_at else None,
+        "finished_at": campaign.finished_at.isoformat() if campaign.finished_at else None,
+    }
+
+
+def _unverified_users_query():
+    return select(User.id, User.email).where(
+        User.is_verified.is_(False),
+        User.is_active.is_(True),
+    )
+
+
+def _user_sources(last_user_id: Optional[uuid.UUID]) -> list[tuple]:
+    """(session maker, id to continue after) for every database still to walk."""
+    if not SHARD_DATABASE_URLS:
+        return [(async_session_maker, last_user_id)]
+    from sharding import shard_set
+
+    shards = list(shard_set.shards.values())
+    if last_user_id is None:
+        return [(shard.session_maker, None) for shard in shards]
+    # Shards before the one holding the checkpoint are done
+    resume_at = shards.index(shard_set.for_user(last_user_id))
+    return [(shards[resume_at].session_maker, last_user_id)] + [
+        (shard.session_maker, None) for shard in shards[resume_at + 1:]
+    ]
+
+
+async def _estimate_unverified_users() -> int:
+    """Planner estimate on PostgreSQL (exact on SQLite); never a full count before the run."""
+    from services.admin_users import estimate_count
+    from sharding import user_session_makers
+
+    total = 0
+    for session_maker in user_session_makers():
+        async with session_maker() as session:
+            total += await estimate_count(session, _unverified_users_query(), filtered=True) or 0
+    return total
+
+
+async def _lock_claims(session) -> None:
+    if session.bind.dialect.name == "postgresql":
+        # Held until commit: claims by concurrent starts/resumes on any worker happen one at a time
+        await session.execute(select(func.pg_advisory_xact_lock(CAMPAIGN_LOCK_KEY)))
+
+
+async def _ensure_none_running(session, now: datetime, campaign_id: Optional[uuid.UUID] = None) -> None:
+    running = await session.scalar(
+        select(VerificationCampaign.id)
+        .where(VerificationCampaign.status == "running", VerificationCampaign.lease_until > now)
+        .limit(1)
+    )
+    if running is not None:
+        raise ValueError(
+            "Campaign is already running" if running == campaign_id
+            else f"Verification campaign {running} is already running"
+        )
+
+
+async def get_campaign(campaign_id: uuid.UUID) -> Optional[VerificationCampaign]:
+    async with async_session_maker() as session:
+        return await session.get(VerificationCampaign, campaign_id)
+
+
+async def start_campaign(
+    batch_size: int = DEFAULT_BATCH_SIZE,
+    concurrency: int = DEFAULT_CONCURRENCY,
+) -> VerificationCampaign:
+    """Create a campaign row and start sending in the background."""
+    if EMAILS_ENABLED and not SMTP_CONFIG_VALID:
+        raise ValueError("SMTP configuration is invalid")
+
+    total = await _estimate_unverified_users()
+    now = _now()
+    async with async_session_maker() as session:
+        await _lock_claims(session)
+        await _ensure_none_running(session, now)
+        campaign = VerificationCampaign(
+            status="running",
+            batch_size=batch_size,
+            concurrency=concurrency,
+            total_estimate=total,
+            claimed_by=WORKER_ID,
+            lease_until=now + timedelta(seconds=VERIFICATION_CAMPAIGN_LEASE_SECONDS),
+        )
+        session.add(campaign)
+        await session.commit()
+
+    _launch(campaign)
+    print(f"📨 Verification campaign {campaign.id} started (~{campaign.total_estimate} unverified users)")
+    return campaign
+
+
+async def resume_campaign(campaign_id: uuid.UUID) -> Optional[VerificationCampaign]:
+    """
+    Restart a campaign from its last checkpoint. Returns None if it does not exist.
+    A running campaign can only be taken over once its lease has run out.
+    """
+    now = _now()
+    async with async_session_maker() as session:
+        await _lock_claims(session)
+        campaign = await session.get(VerificationCampaign, campaign_id)
+        if campaign is None:
+            return None
+        if campaign.status == "completed":
+            raise ValueError("Campaign is already completed")
+        await _ensure_none_running(session, now, campaign_id)
+        claimed = await session.execute(
+            update(VerificationCampaign)
+            .where(
+                VerificationCampaign.id == campaign_id,
+                or_(
+                    VerificationCampaign.status != "running",
+                    VerificationCampaign.lease_until.is_(None),
+                    VerificationCampaign.lease_until <= now,
+                ),
+            )
+            .values(
+                status="running",
+                claimed_by=WORKER_ID,
+                lease_until=now + timedelta(seconds=VERIFICATION_CAMPAIGN_LEASE_SECONDS),
+                last_error=None,
+                finished_at=None,
+            )
+            # Re-read below
+            .execution_options(synchronize_session=False)
+        )
+        if claimed.rowcount == 0:
+            raise ValueError("Campaign is already running")
+        campaign = await session.get(VerificationCampaign, campaign_id, populate_existing=True)
+        await session.commit()
+
+    _launch(campaign)
+    print(f"📨 Verification campaign {campaign.id} resumed after user {campaign.last_user_id}")
+    return campaign
+
+
+async def cancel_campaign(campaign_id: uuid.UUID) -> bool:
+    """
+    Stop a running campaign. Progress up to the last batch is kept. A campaign
+    running on another worker stops there after the batch in flight.
+    """
+    task = _running.get(campaign_id)
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+        return True
+    async with async_session_maker() as session:
+        cancelled = await session.execute(
+            update(VerificationCampaign)
+            .where(VerificationCampaign.id == campaign_id, VerificationCampaign.status == "running")
+            .values(status="cancelled", lease_until=None, finished_at=_now())
+        )
+        await session.commit()
+    return cancelled.rowcount > 0
+
+
+async def shutdown_campaigns() -> None:
+    """Cancel every running campaign (called on application shutdown)."""
+    for campaign_id in list(_running):
+        await cancel_campaign(campaign_id)
+
+
+def _launch(campaign: VerificationCampaign) -> None:
+    task = asyncio.create_task(
+        _run_campaign(campaign.id, campaign.batch_size, campaign.concurrency, campaign.last_user_id)
+    )
+    _running[campaign.id] = task
+    task.add_done_callback(lambda _: _running.pop(campaign.id, None))
+
+
+async def _checkpoint(campaign_id: uuid.UUID, **values):
+    """
+    Update the campaign row and renew the lease, if the claim is still this
+    worker's. Returns the updated counters; raises ClaimLost otherwise.
+    """
+    async with async_session_maker() as session:
+        result = await session.execute(
+            update(VerificationCampaign)
+            .where(
+                VerificationCampaign.id == campaign_id,
+                VerificationCampaign.claimed_by == WORKER_ID,
+                VerificationCampaign.status == "running",
+            )
+            .values({"lease_until": _now() + timedelta(seconds=VERIFICATION_CAMPAIGN_LEASE_SECONDS), **values})
+            .returning(
+                VerificationCampaign.sent_count,
+                VerificationCampaign.failed_count,
+                VerificationCampaign.skipped_count,
+                VerificationCampaign.total_estimate,
+            )
+        )
+        counters = result.one_or_none()
+        await session.commit()
+    if counters is None:
+        raise ClaimLost()
+    return counters
+
+
+async def _send_one(pool: SMTPConnectionPool, user_id: uuid.UUID, email: str) -> str:
+    """"sent", "failed" or "skipped" (emails disabled)."""
+    if not EMAILS_ENABLED:
+        return "skipped"
+    token = generate_verification_token(user_id, email)
+    subject, html_content, text_content = render_verification_email(token)
+    try:
+        await pool.send(build_message(email, subject, html_content, text_content))
+        return "sent"
+    except Exception as e:
+        print(f"❌ Campaign send to {email} failed: {type(e).__name__} - {str(e)}")
+        return "failed"
+
+
+async def _run_campaign(
+    campaign_id: uuid.UUID,
+    batch_size: int,
+    concurrency: int,
+    last_user_id: Optional[uuid.UUID],
+) -> None:
+    pool = SMTPConnectionPool(size=concurrency)
+    status = "completed"
+    last_error = None
+    try:
+        for session_maker, after_id in _user_sources(last_user_id):
+            # One connection holds the read cursor; checkpoints use short-lived sessions
+            async with session_maker() as stream_session:
+                statement = _unverified_users_query()
+                if after_id is not None:
+                    statement = statement.where(User.id > after_id)
+                statement = statement.order_by(User.id).execution_options(yield_per=batch_size)
+
+                result = await stream_session.stream(statement)
+                async for rows in result.partitions(batch_size):
+                    # Pause instead of failing the whole batch while the SMTP circuit is open
+                    while EMAILS_ENABLED and not smtp_dependency.available:
+                        await asyncio.sleep(max(1.0, smtp_dependency.breaker.retry_after()))
+                        await _checkpoint(campaign_id)
+                    outcomes = await asyncio.gather(
+                        *(_send_one(pool, row.id, row.email) for row in rows)
+                    )
+                    sent, failed, skipped, total = await _checkpoint(
+                        campaign_id,
+                        sent_count=VerificationCampaign.sent_count + outcomes.count("sent"),
+                        failed_count=VerificationCampaign.failed_count + outcomes.count("failed"),
+                        skipped_count=VerificationCampaign.skipped_count + outcomes.count("skipped"),
+                        last_user_id=rows[-1].id,
+                    )
+                    print(
+                        f"📨 Campaign {campaign_id}: {sent} sent, {failed} failed, "
+                        f"{skipped} skipped of ~{total}"
+                    )
+    except asyncio.CancelledError:
+        status = "cancelled"
+    except ClaimLost:
+        status = None
+        print(f"⚠️  Verification campaign {campaign_id} was cancelled or claimed by another worker; stopping")
+    except Exception as e:
+        status = "failed"
+        last_error = f"{type(e).__name__}: {str(e)}"
+        print(f"❌ Verification campaign {campaign_id} failed: {last_error}")
+    finally:
+        await pool.close()
+        if status is not None:
+            final = {"status": status, "last_error": last_error, "lease_until": None, "finished_at": _now()}
+            if status == "completed":
+                final["total_estimate"] = (
+                    VerificationCampaign.sent_count + VerificationCampaign.failed_count + VerificationCampaign.skipped_count
+                )
+            try:
+                await _checkpoint(campaign_id, **final)
+                print(f"📨 Verification campaign {campaign_id} {status}")
+            except ClaimLost:
+                pass
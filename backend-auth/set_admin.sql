@@ -1,10 +1,13 @@
--- Set first user as admin (or update email as needed)
-UPDATE "user" 
-SET role = 'admin' 
-WHERE email = (SELECT email FROM "user" LIMIT 1);
+-- Prefer create_admin_user.py (or set_admin_user.sh / set_admin_user.ps1):
+-- it also records the user.role_changed event that downstream services and
+-- open sessions rely on. A raw UPDATE cannot do that, so use this file only
+-- when the service is not available, and always bump profile_version with
+-- the role so clients holding the old ETag refetch /users/me.
 
--- Alternative: Set specific user as admin (uncomment and update email)
--- UPDATE "user" SET role = 'admin' WHERE email = 'your-admin-email@example.com';
+-- Set specific user as admin (update email as needed)
+UPDATE "user"
+SET role = 'admin', profile_version = profile_version + 1
+WHERE email = 'your-admin-email@example.com';
 
 -- Verify admin was set
-SELECT email, role FROM "user";
+SELECT email, role, profile_version FROM "user" WHERE role = 'admin';
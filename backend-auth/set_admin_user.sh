@@ -1,9 +1,12 @@
 #!/bin/bash
 # Helper script to set a user as admin
-# Usage: ./set_admin_user.sh user@example.com
+# Usage: ./set_admin_user.sh user@example.com [password]
+#
+# Goes through create_admin_user.py (not a raw UPDATE), so profile_version is
+# bumped and the role change reaches the user event feed and open sessions.
 
 if [ -z "$1" ]; then
-    echo "Usage: $0 <user-email>"
+    echo "Usage: $0 <user-email> [password]"
     echo "Example: $0 admin@example.com"
     exit 1
 fi
@@ -12,7 +15,4 @@ EMAIL="$1"
 
 echo "Setting user $EMAIL as admin..."
 
-docker-compose exec auth-db psql -U postgres -d finity_auth -c "UPDATE \"user\" SET role = 'admin' WHERE email = '$EMAIL';"
-
-echo "Verifying admin status..."
-docker-compose exec auth-db psql -U postgres -d finity_auth -c "SELECT email, role FROM \"user\" WHERE email = '$EMAIL';"
+docker compose exec -T finity-backend python create_admin_user.py "$EMAIL" ${2:+"$2"}
@@ -0,0 +1,338 @@
+"""
+Horizontal partitioning of users across several databases.
+
+With SHARD_DATABASE_URLS set (comma-separated), the "user" and
+"oauth_account" tables live on the shards instead of DATABASE_URL:
+
+- a user and their OAuth accounts live on the shard that owns the user id on
+  a consistent-hash ring (SHARD_VIRTUAL_NODES points per shard);
+- lookups by email or (oauth_name, account_id) go through directory tables
+  that map the key to a user id; each directory row lives on the shard that
+  owns the key on the same ring, so a lookup costs one directory read plus one
+  user read, each on a single shard.
+
+ShardedUserDatabase implements the SQLAlchemyUserDatabase interface on top of
+that, so fastapi-users (and UserManager) work unchanged. User events go to
+DATABASE_URL right after the shard write commits (a different database, so
+not atomic with it, unlike db.UserDatabase). Everything else
+(email outbox, audit log, campaigns, events) stays on DATABASE_URL, which is
+also where `session` points. Code that reads the user table directly rather
+than by id or email (admin listing, campaigns, hash metrics, maintenance) goes
+through user_session_makers() and visits every shard.
+
+Writes that touch two shards are not atomic. They are ordered so that a crash
+leaves at most a directory row pointing at a missing user, which lookups
+ignore. Such a row is also what a registration still in flight looks like, so
+it is only reclaimed by another registration once it is older than
+SHARD_DIRECTORY_CLAIM_GRACE_SECONDS, and then with a compare-and-swap on its
+owner so that concurrent reclaimers cannot both win.
+
+Shard membership is fixed: adding a shard moves ~1/N of the keys on the ring
+and needs the data moved with it before the new list is deployed.
+"""
+import bisect
+import hashlib
+import uuid
+from datetime import datetime, timedelta, timezone
+from typing import Any, Optional
+
+from fastapi_users.exceptions import UserAlreadyExists
+from sqlalchemy import Column, DateTime, String, delete, func, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.orm import DeclarativeBase
+
+from db import (
+    GUID,
+    SHARD_DATABASE_URLS,
+    SHARD_DIRECTORY_CLAIM_GRACE_SECONDS,
+    SHARD_VIRTUAL_NODES,
+    EmailOutbox,
+    OAuthAccount,
+    User,
+    async_session_maker,
+)
+from services.user_events import record_events, update_event, user_snapshot
+
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class DirectoryBase(DeclarativeBase):
+    pass
+
+
+class UserEmailDirectory(DirectoryBase):
+    """lower(email) -> user id. Lives on the shard owning the email key."""
+
+    __tablename__ = "user_email_directory"
+
+    email = Column(String(length=320), primary_key=True)
+    user_id = Column(GUID, nullable=False)
+    claimed_at = Column(DateTime(timezone=True), default=_utcnow, server_default=func.now(), nullable=False)
+
+
+class OAuthAccountDirectory(DirectoryBase):
+    """(oauth_name, account_id) -> user id. Lives on the shard owning the account key."""
+
+    __tablename__ = "oauth_account_directory"
+
+    oauth_name = Column(String(length=100), primary_key=True)
+    account_id = Column(String(length=320), primary_key=True)
+    user_id = Column(GUID, nullable=False)
+    claimed_at = Column(DateTime(timezone=True), default=_utcnow, server_default=func.now(), nullable=False)
+
+
+def _hash(key: str) -> int:
+    return int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent-hash ring with virtual nodes."""
+
+    def __init__(self, nodes: list[str], virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        points = sorted((_hash(f"{node}#{index}"), node) for node in nodes for index in range(virtual_nodes))
+        self._hashes = [point for point, _ in points]
+        self._nodes = [node for _, node in points]
+
+    def node_for(self, key: str) -> str:
+        index = bisect.bisect(self._hashes, _hash(key)) % len(self._hashes)
+        return self._nodes[index]
+
+
+def email_key(email: str) -> str:
+    return f"email:{email.lower()}"
+
+
+def oauth_key(oauth_name: str, account_id: str) -> str:
+    return f"oauth:{oauth_name}:{account_id}"
+
+
+def user_key(user_id: uuid.UUID) -> str:
+    return f"user:{user_id}"
+
+
+class Shard:
+    def __init__(self, name: str, url: str):
+        self.name = name
+        self.engine: AsyncEngine = create_async_engine(url)
+        self.session_maker = async_sessionmaker(self.engine, expire_on_commit=False)
+
+
+class ShardSet:
+    """The shard engines plus the ring that places keys on them."""
+
+    def __init__(self, urls: list[str], virtual_nodes: int = SHARD_VIRTUAL_NODES):
+        # Names are positional, so the URL list order must stay stable
+        self.shards = {f"shard{index}": Shard(f"shard{index}", url) for index, url in enumerate(urls)}
+        self.ring = HashRing(list(self.shards), virtual_nodes)
+
+    def for_key(self, key: str) -> Shard:
+        return self.shards[self.ring.node_for(key)]
+
+    def for_user(self, user_id: uuid.UUID) -> Shard:
+        return self.for_key(user_key(user_id))
+
+    @property
+    def engines(self) -> list[AsyncEngine]:
+        return [shard.engine for shard in self.shards.values()]
+
+    async def create_tables(self) -> None:
+        for shard in self.shards.values():
+            async with shard.engine.begin() as conn:
+                await conn.run_sync(User.metadata.create_all, tables=[User.__table__, OAuthAccount.__table__])
+                await conn.run_sync(DirectoryBase.metadata.create_all)
+
+    async def dispose(self) -> None:
+        for shard in self.shards.values():
+            await shard.engine.dispose()
+
+
+shard_set: Optional[ShardSet] = ShardSet(SHARD_DATABASE_URLS) if SHARD_DATABASE_URLS else None
+
+
+def user_session_makers() -> list[async_sessionmaker]:
+    """Session makers of every database holding the user table: each shard in configuration order, or DATABASE_URL."""
+    if shard_set is None:
+        return [async_session_maker]
+    return [shard.session_maker for shard in shard_set.shards.values()]
+
+
+class ShardedUserDatabase:
+    """
+    SQLAlchemyUserDatabase interface over ShardSet.
+
+    Each operation uses short-lived sessions on the shards it touches; returned
+    users are detached with their OAuth accounts loaded. `session` is the
+    regular DATABASE_URL session for non-user tables (e.g. the email outbox).
+    """
+
+    def __init__(self, session: AsyncSession, shards: ShardSet):
+        self.session = session
+        self.shards = shards
+        self.user_table = User
+        self.oauth_account_table = OAuthAccount
+
+    async def _directory_user_id(self, model, key: str, **lookup) -> Optional[uuid.UUID]:
+        async with self.shards.for_key(key).session_maker() as session:
+            entry = await session.get(model, lookup)
+            return entry.user_id if entry is not None else None
+
+    async def _claim_directory(self, model, key: str, user_id: uuid.UUID, **lookup) -> bool:
+        """
+        Insert a directory row. False if the key belongs to another user, or
+        to a claim that may still be completing; a row left behind by a user
+        that no longer exists is taken over once the grace period has passed.
+        """
+        async with self.shards.for_key(key).session_maker() as session:
+            session.add(model(user_id=user_id, **lookup))
+            try:
+                await session.commit()
+                return True
+            except IntegrityError:
+                await session.rollback()
+            entry = await session.get(model, lookup)
+            if entry is None:
+                # Released between our insert and this read; try once more
+                session.add(model(user_id=user_id, **lookup))
+                try:
+                    await session.commit()
+                    return True
+                except IntegrityError:
+                    return False
+            if entry.user_id == user_id:
+                return True
+            claimed_at = entry.claimed_at
+            if claimed_at.tzinfo is None:
+                # SQLite hands back naive datetimes
+                claimed_at = claimed_at.replace(tzinfo=timezone.utc)
+            if _utcnow() - claimed_at < timedelta(seconds=SHARD_DIRECTORY_CLAIM_GRACE_SECONDS):
+                # The owner's user row may simply not be written yet
+                return False
+            if await self.get(entry.user_id) is not None:
+                return False
+            statement = update(model).where(model.user_id == entry.user_id)
+            for column, value in lookup.items():
+                statement = statement.where(getattr(model, column) == value)
+            # Compare-and-swap: only one of several concurrent reclaimers moves the row
+            taken = await session.execute(
+                statement.values(user_id=user_id, claimed_at=_utcnow()).execution_options(synchronize_session=False)
+            )
+            await session.commit()
+            return taken.rowcount == 1
+
+    async def _release_directory(self, model, key: str, user_id: uuid.UUID, **lookup) -> None:
+        async with self.shards.for_key(key).session_maker() as session:
+            statement = delete(model).where(model.user_id == user_id)
+            for column, value in lookup.items():
+                statement = statement.where(getattr(model, column) == value)
+            await session.execute(statement)
+            await session.commit()
+
+    async def get(self, id: uuid.UUID) -> Optional[User]:
+        async with self.shards.for_user(id).session_maker() as session:
+            result = await session.execute(select(User).where(User.id == id))
+            return result.unique().scalar_one_or_none()
+
+    async def get_by_email(self, email: str) -> Optional[User]:
+        user_id = await self._directory_user_id(UserEmailDirectory, email_key(email), email=email.lower())
+        if user_id is None:
+            return None
+        user = await self.get(user_id)
+        # Ignore directory rows whose user is gone or has since changed email
+        if user is None or user.email.lower() != email.lower():
+            return None
+        return user
+
+    async def get_by_oauth_account(self, oauth: str, account_id: str) -> Optional[User]:
+        user_id = await self._directory_user_id(
+            OAuthAccountDirectory, oauth_key(oauth, account_id), oauth_name=oauth, account_id=account_id
+        )
+        return await self.get(user_id) if user_id is not None else None
+
+    async def create(self, create_dict: dict[str, Any]) -> User:
+        create_dict = {**create_dict}
+        user_id = create_dict.setdefault("id", uuid.uuid4())
+        email = create_dict["email"]
+        # Directory first: it is the uniqueness check for the email across shards
+        if not await self._claim_directory(UserEmailDirectory, email_key(email), user_id, email=email.lower()):
+            raise UserAlreadyExists()
+        try:
+            async with self.shards.for_user(user_id).session_maker() as session:
+                session.add(User(**create_dict))
+                await session.commit()
+        except Exception:
+            await self._release_directory(UserEmailDirectory, email_key(email), user_id, email=email.lower())
+            raise
+        user = await self.get(user_id)
+        # Not in the user's transaction here (different database); see email_outbox
+        if not user.is_verified:
+            self.session.add(EmailOutbox(template="verify", to_email=user.email, user_id=user.id))
+        await record_events(self.session, "user.registered", [user.id], user_snapshot(user))
+        return user
+
+    async def update(self, user: User, update_dict: dict[str, Any], password_rehash: bool = False) -> User:
+        old_email = user.email
+        new_email = update_dict.get("email")
+        email_changed = new_email is not None and new_email.lower() != old_email.lower()
+        if email_changed:
+            if not await self._claim_directory(UserEmailDirectory, email_key(new_email), user.id, email=new_email.lower()):
+                raise UserAlreadyExists()
+        async with self.shards.for_user(user.id).session_maker() as session:
+            stored = await session.get(User, user.id)
+            for key, value in update_dict.items():
+                setattr(stored, key, value)
+            # SQL expressions (the profile_version bump) are applied by the UPDATE
+            await session.commit()
+        if email_changed:
+            await self._release_directory(UserEmailDirectory, email_key(old_email), user.id, email=old_email.lower())
+        user = await self.get(user.id)
+        event = update_event(user, update_dict, password_rehash)
+        if event is not None:
+            await record_events(self.session, event[0], [user.id], event[1])
+        return user
+
+    async def delete(self, user: User) -> None:
+        accounts = [(account.oauth_name, account.account_id) for account in user.oauth_accounts]
+        async with self.shards.for_user(user.id).session_maker() as session:
+            await session.execute(delete(OAuthAccount).where(OAuthAccount.user_id == user.id))
+            await session.execute(delete(User).where(User.id == user.id))
+            await session.commit()
+        await self._release_directory(UserEmailDirectory, email_key(user.email), user.id, email=user.email.lower())
+        for oauth_name, account_id in accounts:
+            await self._release_directory(
+                OAuthAccountDirectory, oauth_key(oauth_name, account_id), user.id,
+                oauth_name=oauth_name, account_id=account_id,
+            )
+        await record_events(self.session, "user.deleted", [user.id], {"email": user.email})
+
+    async def add_oauth_account(self, user: User, create_dict: dict[str, Any]) -> User:
+        oauth_name, account_id = create_dict["oauth_name"], create_dict["account_id"]
+        claimed = await self._claim_directory(
+            OAuthAccountDirectory, oauth_key(oauth_name, account_id), user.id,
+            oauth_name=oauth_name, account_id=account_id,
+        )
+        if not claimed:
+            raise ValueError(f"{oauth_name} account is already linked to another user")
+        async with self.shards.for_user(user.id).session_maker() as session:
+            session.add(OAuthAccount(user_id=user.id, **create_dict))
+            await session.commit()
+        return await self.get(user.id)
+
+    async def update_oauth_account(self, user: User, oauth_account: OAuthAccount, update_dict: dict[str, Any]) -> User:
+        async with self.shards.for_user(user.id).session_maker() as session:
+            stored = await session.get(OAuthAccount, oauth_account.id)
+            for key, value in update_dict.items():
+                setattr(stored, key, value)
+            await session.commit()
+        return await self.get(user.id)
+
+
+async def count_users_per_shard() -> dict[str, int]:
+    """Row count of the user table on every shard (exact; for operators, not hot paths)."""
+    counts = {}
+    for name, shard in shard_set.shards.items():
+        async with shard.session_maker() as session:
+            counts[name] = await session.scalar(select(func.count()).select_from(User))
+    return counts
@@ -0,0 +1,222 @@
+"""
+Per-request SQL instrumentation.
+
+SQLAlchemy engine events time every statement and attribute the query count,
+time and rows to the request that issued it (through a context variable set by
+QueryStatsMiddleware). On top of that:
+
+- statements slower than SQL_SLOW_QUERY_MS are logged with a fingerprint
+  (the statement with literals and parameters stripped), so repeated slow
+  shapes group together;
+- a request that runs the same fingerprint SQL_N_PLUS_ONE_THRESHOLD times or
+  more is reported as a likely N+1;
+- with SQL_DEBUG_HEADERS=true responses carry X-DB-Query-Count /
+  X-DB-Query-Time-Ms / X-DB-Rows and recent requests are kept for the
+  /admin/sql/requests debug panel;
+- capture_queries() / assert_max_queries() let tests enforce per-endpoint
+  query budgets. Like the request stats they follow the context, so they
+  count the calling task and the tasks and threads it starts, not background
+  work running meanwhile (outbox relay, session push, activity flush, ...).
+"""
+import hashlib
+import os
+import re
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+SQL_SLOW_QUERY_MS = float(os.getenv("SQL_SLOW_QUERY_MS", "200"))
+SQL_N_PLUS_ONE_THRESHOLD = int(os.getenv("SQL_N_PLUS_ONE_THRESHOLD", "5"))
+SQL_DEBUG_HEADERS = os.getenv("SQL_DEBUG_HEADERS", "false").lower() == "true"
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_BIND_PARAM = re.compile(r"\$\d+|%\(\w+\)s|:\w+|\?")
+_IN_LIST = re.compile(r"\(\s*\?(?:\s*,\s*\?)+\s*\)")
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_statement(statement: str) -> str:
+    """Strip literals and parameters so statements that differ only in values compare equal."""
+    normalized = _STRING_LITERAL.sub("?", statement)
+    normalized = _BIND_PARAM.sub("?", normalized)
+    normalized = _NUMBER_LITERAL.sub("?", normalized)
+    normalized = _IN_LIST.sub("(?...)", normalized)
+    return _WHITESPACE.sub(" ", normalized).strip()
+
+
+def fingerprint(statement: str) -> str:
+    return hashlib.sha1(normalize_statement(statement).encode()).hexdigest()[:12]
+
+
+class QueryStats:
+    """Queries attributed to one request (or one capture_queries block)."""
+
+    def __init__(self, label: str = ""):
+        self.label = label
+        self.count = 0
+        self.total_time = 0.0
+        self.rows = 0
+        self.fingerprints: Counter = Counter()
+        self.samples: dict[str, str] = {}
+        self.statements: list[str] = []
+        self.keep_statements = False
+
+    def record(self, statement: str, elapsed: float, rows: int) -> None:
+        self.count += 1
+        self.total_time += elapsed
+        if rows > 0:
+            self.rows += rows
+        key = fingerprint(statement)
+        self.fingerprints[key] += 1
+        self.samples.setdefault(key, normalize_statement(statement))
+        if self.keep_statements:
+            self.statements.append(statement)
+
+    def repeated(self, threshold: int = SQL_N_PLUS_ONE_THRESHOLD) -> list[tuple[str, int]]:
+        """(normalized statement, executions) for fingerprints run at least threshold times."""
+        return [
+            (self.samples[key], executions)
+            for key, executions in self.fingerprints.most_common()
+            if executions >= threshold
+        ]
+
+    def summary(self) -> dict:
+        return {
+            "label": self.label,
+            "queries": self.count,
+            "time_ms": round(self.total_time * 1000, 2),
+            "rows": self.rows,
+            "top": [
+                {"fingerprint": key, "executions": executions, "statement": self.samples[key]}
+                for key, executions in self.fingerprints.most_common(10)
+            ],
+        }
+
+
+_request_stats: ContextVar[Optional[QueryStats]] = ContextVar("sql_request_stats", default=None)
+# capture_queries() blocks enclosing the current task (inherited by tasks it creates)
+_captures: ContextVar[tuple[QueryStats, ...]] = ContextVar("sql_captures", default=())
+recent_requests: deque = deque(maxlen=100)
+
+
+def current_stats() -> Optional[QueryStats]:
+    return _request_stats.get()
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start_time", []).append(time.perf_counter())
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start_time"].pop()
+    rows = getattr(cursor, "rowcount", -1) or 0
+
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.record(statement, elapsed, rows)
+    for capture in _captures.get():
+        capture.record(statement, elapsed, rows)
+
+    if elapsed * 1000 >= SQL_SLOW_QUERY_MS:
+        label = f" [{stats.label}]" if stats is not None else ""
+        print(
+            f"🐢 Slow query{label} {elapsed * 1000:.1f}ms fp={fingerprint(statement)} rows={rows}: "
+            f"{normalize_statement(statement)[:500]}"
+        )
+
+
+def _handle_error(exception_context):
+    # Keep the timing stack balanced when a statement fails
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("query_start_time"):
+        conn.info["query_start_time"].pop()
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Attach the timing hooks to a (sync) engine. Safe to call more than once."""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
+
+
+@contextmanager
+def capture_queries(keep_statements: bool = True):
+    """
+    Collect every statement the current task (and tasks it starts) executes
+    while the block runs.
+
+        with capture_queries() as queries:
+            await client.get("/users/me", headers=auth)
+        assert queries.count <= 2
+    """
+    stats = QueryStats(label="capture")
+    stats.keep_statements = keep_statements
+    token = _captures.set(_captures.get() + (stats,))
+    try:
+        yield stats
+    finally:
+        _captures.reset(token)
+
+
+@contextmanager
+def assert_max_queries(limit: int, max_repeats: Optional[int] = None):
+    """
+    Fail if the block runs more than `limit` statements, or (with max_repeats)
+    runs any single statement shape more than max_repeats times.
+    """
+    with capture_queries() as stats:
+        yield stats
+    if stats.count > limit:
+        listing = "\n".join(f"  {index + 1}. {statement}" for index, statement in enumerate(stats.statements))
+        raise AssertionError(f"Expected at most {limit} queries, got {stats.count}:\n{listing}")
+    if max_repeats is not None:
+        repeated = stats.repeated(max_repeats + 1)
+        if repeated:
+            statement, executions = repeated[0]
+            raise AssertionError(f"Statement ran {executions} times (max {max_repeats}): {statement}")
+
+
+class QueryStatsMiddleware:
+    """Attribute SQL to the current request; report N+1 patterns and optional debug headers."""
+
+    def __init__(self, app, debug_headers: bool = SQL_DEBUG_HEADERS):
+        self.app = app
+        self.debug_headers = debug_headers
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        stats = QueryStats(label=f"{scope['method']} {scope['path']}")
+        token = _request_stats.set(stats)
+
+        async def send_with_headers(message):
+            if message["type"] == "http.response.start" and self.debug_headers:
+                message = {
+                    **message,
+                    "headers": [
+                        *message.get("headers", []),
+                        (b"x-db-query-count", str(stats.count).encode()),
+                        (b"x-db-query-time-ms", f"{stats.total_time * 1000:.2f}".encode()),
+                        (b"x-db-rows", str(stats.rows).encode()),
+                    ],
+                }
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_headers)
+        finally:
+            _request_stats.reset(token)
+            for statement, executions in stats.repeated():
+                print(f"⚠️  Possible N+1 in {stats.label}: {executions}x {statement[:300]}")
+            if self.debug_headers:
+                recent_requests.append(stats.summary())
@@ -0,0 +1 @@
+# Testing package: local stand-ins and harnesses for exercising the auth service (not shipped routes)
@@ -0,0 +1,203 @@
+"""
+Fault-injecting local stand-ins for outbound dependencies.
+
+- FaultyHTTPProvider: a tiny HTTP server answering the Discord OAuth
+  endpoints (token exchange, /users/@me) with canned responses;
+- FaultySMTPServer: a tiny SMTP server that accepts AUTH PLAIN and messages.
+
+Both follow a FaultPlan that can be changed while they run: added latency,
+error responses (always or at a rate), hanging without answering, or dropping
+the connection. Used by testing/resilience_drill.py to check that circuit
+breakers open, fail fast and recover; they speak just enough of each protocol
+for the clients this service uses.
+"""
+import asyncio
+import json
+import random
+from typing import Optional
+from urllib.parse import parse_qs
+
+
+class FaultPlan:
+    """What a stand-in does with the next request. Mutable at runtime."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        error_rate: float = 0.0,
+        error_status: int = 503,
+        hang: bool = False,
+        drop: bool = False,
+        seed: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.error_status = error_status
+        self.hang = hang
+        self.drop = drop
+        self._random = random.Random(seed)
+
+    def healthy(self) -> "FaultPlan":
+        self.latency, self.error_rate, self.hang, self.drop = 0.0, 0.0, False, False
+        return self
+
+    def should_fail(self) -> bool:
+        return self.error_rate > 0 and self._random.random() < self.error_rate
+
+    async def delay(self) -> None:
+        if self.hang:
+            # Until the client gives up and the server task is cancelled
+            await asyncio.Event().wait()
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+
+class _StandInServer:
+    def __init__(self, plan: Optional[FaultPlan] = None):
+        self.plan = plan or FaultPlan()
+        self.requests = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._connections: set[asyncio.Task] = set()
+        self.port = 0
+
+    async def start(self) -> "_StandInServer":
+        self._server = await asyncio.start_server(self._handle, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            # Hanging handlers never finish on their own
+            for task in list(self._connections):
+                task.cancel()
+            await asyncio.gather(*self._connections, return_exceptions=True)
+            await self._server.wait_closed()
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc_info):
+        await self.stop()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            await self.serve(reader, writer)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except asyncio.CancelledError:
+            # Cancelled by stop(); finishing normally keeps asyncio.streams from logging it
+            pass
+        finally:
+            self._connections.discard(task)
+            writer.close()
+
+    async def serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        raise NotImplementedError
+
+
+class FaultyHTTPProvider(_StandInServer):
+    """Stand-in for discord.com's OAuth token and user endpoints."""
+
+    def __init__(self, plan: Optional[FaultPlan] = None, user: Optional[dict] = None):
+        super().__init__(plan)
+        self.user = user or {"id": "100000000000000001", "username": "standin", "email": "standin@example.com"}
+        # (method, path) -> handler(request) returning (status, body) or just the body
+        self.routes = {
+            ("POST", "/api/oauth2/token"): lambda request: {"access_token": "stand-in-token", "token_type": "Bearer", "expires_in": 604800},
+            ("GET", "/api/users/@me"): lambda request: self.user,
+        }
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def point_discord_service(self, service) -> None:
+        """Redirect a DiscordOAuthService instance to this stand-in."""
+        service.DISCORD_TOKEN_URL = f"{self.base_url}/api/oauth2/token"
+        service.DISCORD_USER_URL = f"{self.base_url}/api/users/@me"
+
+    async def serve(self, reader, writer) -> None:
+        request_line = (await reader.readline()).decode().split()
+        if len(request_line) < 2:
+            return
+        method, target = request_line[0], request_line[1]
+        path, _, query = target.partition("?")
+        headers = {}
+        while True:
+            line = (await reader.readline()).decode().strip()
+            if not line:
+                break
+            name, _, value = line.partition(":")
+            headers[name.strip().lower()] = value.strip()
+        length = int(headers.get("content-length", "0"))
+        body = await reader.readexactly(length) if length else b""
+        request = {"method": method, "path": path, "query": parse_qs(query), "headers": headers, "body": body}
+        self.requests += 1
+
+        if self.plan.drop:
+            return
+        await self.plan.delay()
+        route = self.routes.get((method, path))
+        if route is None:
+            status, body = 404, {"message": "404: Not Found"}
+        elif self.plan.should_fail():
+            status, body = self.plan.error_status, {"message": "injected fault"}
+        else:
+            response = route(request)
+            status, body = response if isinstance(response, tuple) else (200, response)
+        payload = json.dumps(body).encode()
+        writer.write(
+            f"HTTP/1.1 {status} STAND-IN\r\nContent-Type: application/json\r\n"
+            f"Content-Length: {len(payload)}\r\nConnection: close\r\n\r\n".encode() + payload
+        )
+        await writer.drain()
+
+
+class FaultySMTPServer(_StandInServer):
+    """Plain-text SMTP stand-in. Faults apply at connect (greeting) and per message (end of DATA)."""
+
+    def __init__(self, plan: Optional[FaultPlan] = None):
+        super().__init__(plan)
+        self.messages: list[bytes] = []
+
+    async def serve(self, reader, writer) -> None:
+        if self.plan.drop:
+            return
+        await self.plan.delay()
+
+        async def reply(line: str) -> None:
+            writer.write(f"{line}\r\n".encode())
+            await writer.drain()
+
+        await reply("220 standin ESMTP")
+        while True:
+            line = (await reader.readline()).decode().strip()
+            if not line:
+                return
+            verb = line.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"):
+                await reply("250-standin\r\n250-AUTH PLAIN\r\n250 8BITMIME")
+            elif verb == "AUTH":
+                await reply("235 2.7.0 Authentication successful")
+            elif verb in ("MAIL", "RCPT", "RSET", "NOOP"):
+                await reply("250 OK")
+            elif verb == "DATA":
+                await reply("354 End data with <CR><LF>.<CR><LF>")
+                data = await reader.readuntil(b"\r\n.\r\n")
+                self.requests += 1
+                if self.plan.drop:
+                    return
+                await self.plan.delay()
+                if self.plan.should_fail():
+                    await reply("451 4.3.0 Injected fault")
+                else:
+                    self.messages.append(data)
+                    await reply("250 OK queued")
+            elif verb == "QUIT":
+                await reply("221 Bye")
+                return
+            else:
+                await reply("502 Command not implemented")
@@ -0,0 +1,71 @@
+"""
+pytest fixtures for the offline harness (testing/harness.py).
+
+Enable with `-p testing.pytest_plugin` (or `pytest_plugins = ["testing.pytest_plugin"]`
+in a conftest.py) from backend-auth/, with requirements-dev.txt installed.
+The harness is session-scoped - the service reads its configuration once per
+process - so async tests using it run on the session event loop:
+
+    @pytest.mark.asyncio(loop_scope="session")
+    async def test_profile_latency(auth_harness, seeded_users):
+        token = await auth_harness.login(**seeded_users.credentials(0))
+        stats = await measure(lambda i: auth_harness.client.get("/users/me", headers=bearer(token)), 500, 20)
+        assert stats["errors"] == 0
+
+Options: --harness-database-url (default: temporary SQLite, or a throwaway
+database on HARNESS_POSTGRES_URL), --seed-users, --seed, --oauth-latency-ms,
+--smtp-latency-ms.
+"""
+import pytest
+import pytest_asyncio
+
+from testing.harness import AuthServiceHarness
+
+
+def pytest_addoption(parser):
+    group = parser.getgroup("auth-harness")
+    group.addoption("--harness-database-url", default=None, help="Database for the harness (default: temporary SQLite or HARNESS_POSTGRES_URL)")
+    group.addoption("--seed-users", type=int, default=1000, help="Users created by the seeded_users fixture")
+    group.addoption("--seed", type=int, default=0, help="Random seed for seeded_users")
+    group.addoption("--oauth-latency-ms", type=float, default=0.0, help="Added latency of the mock OAuth providers")
+    group.addoption("--smtp-latency-ms", type=float, default=0.0, help="Added latency per message of the SMTP stand-in")
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def auth_harness(pytestconfig):
+    harness = AuthServiceHarness(
+        database_url=pytestconfig.getoption("--harness-database-url"),
+        oauth_latency=pytestconfig.getoption("--oauth-latency-ms") / 1000,
+        smtp_latency=pytestconfig.getoption("--smtp-latency-ms") / 1000,
+    )
+    await harness.start()
+    yield harness
+    await harness.stop()
+
+
+@pytest_asyncio.fixture(scope="session", loop_scope="session")
+async def seeded_users(auth_harness, pytestconfig):
+    """A deterministic population (see testing.seeding.seed_users), created once per session."""
+    return await auth_harness.seed_users(
+        pytestconfig.getoption("--seed-users"), seed=pytestconfig.getoption("--seed"), admin_count=1, oauth_ratio=0.1
+    )
+
+
+@pytest.fixture
+def client(auth_harness):
+    return auth_harness.client
+
+
+@pytest.fixture
+def smtp_server(auth_harness):
+    """The SMTP stand-in, emptied before each test."""
+    auth_harness.smtp.messages.clear()
+    return auth_harness.smtp
+
+
+@pytest.fixture
+def oauth_providers(auth_harness):
+    """Mock providers by name; their FaultPlans are reset to healthy after each test."""
+    yield auth_harness.oauth
+    for provider in auth_harness.oauth.values():
+        provider.plan.healthy()
@@ -0,0 +1,316 @@
+"""
+Replay a traffic capture (traffic_capture.py) against a local instance.
+
+Usage (from backend-auth/):
+    python -m testing.replay capture-*.jsonl.gz [--speed 2] [--limit 50000]
+        [--url http://localhost:8000] [--output report.json] [--baseline previous.json]
+
+Requests are sent at their captured offsets divided by --speed, so the mix,
+the burstiness and the concurrency of production traffic are reproduced
+(several worker files are merged on their start times). Each captured actor
+is mapped to its own seeded, verified user:
+- logins use that user's credentials, bearer requests that user's token,
+- bodies get values for the captured field names (email, password, ...),
+- registrations use fresh emails,
+- OAuth callbacks use codes from a pool of --oauth-users mock users, so the
+  first callback per code signs up and later ones log in.
+Server-sent event streams are not replayed.
+
+By default the replay runs in-process against testing.harness (SQLite or
+HARNESS_POSTGRES_URL, local SMTP and mock OAuth). With --url it targets a
+running instance, seeding users through DATABASE_URL, which must be that
+instance's database; its OAuth callbacks go to the real providers and fail.
+
+The report compares per-route latency with the capture, or with a previous
+report given as --baseline, which is the meaningful comparison: same
+capture, same machine, before and after a change.
+"""
+import argparse
+import asyncio
+import gzip
+import heapq
+import json
+import statistics
+import time
+from typing import Iterator, Optional
+
+import httpx
+
+REPLAY_EMAIL_DOMAIN = "replay.example.com"
+
+
+def _read_lines(path: str) -> Iterator[str]:
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt") as capture:
+        try:
+            yield from capture
+        except EOFError:
+            # A capture still being written has no gzip trailer yet
+            return
+
+
+def _read_capture(path: str) -> Iterator[tuple[float, dict]]:
+    """(absolute time, record) for every record of one capture file."""
+    start = 0.0
+    for line in _read_lines(path):
+        line = line.strip()
+        if not line:
+            continue
+        entry = json.loads(line)
+        if "capture" in entry:
+            # Header; appending to an existing file starts a new section with its own start time
+            start = entry["start"]
+            continue
+        yield start + entry["t"] / 1000, entry
+
+
+def load_capture(paths: list[str], limit: Optional[int] = None) -> list[tuple[float, dict]]:
+    """Records of all files merged in arrival order, with times relative to the first one."""
+    merged = heapq.merge(*(_read_capture(path) for path in paths), key=lambda item: item[0])
+    records = []
+    for at, entry in merged:
+        records.append((at, entry))
+        if limit and len(records) >= limit:
+            break
+    if records:
+        first = records[0][0]
+        records = [(at - first, entry) for at, entry in records]
+    return records
+
+
+def _percentile(values: list[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p))], 2)
+
+
+def _summary(latencies: list[float]) -> dict:
+    return {
+        "count": len(latencies),
+        "p50_ms": _percentile(latencies, 0.50),
+        "p95_ms": _percentile(latencies, 0.95),
+        "p99_ms": _percentile(latencies, 0.99),
+        "mean_ms": round(statistics.fmean(latencies), 2) if latencies else None,
+    }
+
+
+class Replayer:
+    def __init__(self, client: httpx.AsyncClient, records: list[tuple[float, dict]], speed: float,
+                 oauth_users: int, max_in_flight: int):
+        self.client = client
+        self.records = records
+        self.speed = speed
+        self.oauth_users = oauth_users
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.actors: dict[str, int] = {}
+        self.population = None
+        self.tokens: dict[int, str] = {}
+        # Last ETag seen per (user, path), for requests captured with If-None-Match
+        self.etags: dict[tuple[int, str], str] = {}
+        self.results: dict[str, dict] = {}
+        self.skipped: dict[str, int] = {}
+        self.late = 0
+        self._registrations = 0
+
+    def _actors(self) -> None:
+        for _, entry in self.records:
+            actor = entry.get("a")
+            if actor and actor not in self.actors:
+                self.actors[actor] = len(self.actors)
+
+    async def prepare(self, seed_users) -> None:
+        """Seed a user per actor and sign every actor in that sends bearer tokens."""
+        self._actors()
+        self.population = await seed_users(max(1, len(self.actors)), verified_ratio=1.0, inactive_ratio=0.0,
+                                           email_domain=REPLAY_EMAIL_DOMAIN)
+        bearer_actors = {self.actors[entry["a"]] for _, entry in self.records if "a" in entry and "auth" in entry.get("h", ())}
+        for index in bearer_actors:
+            response = await self.client.post("/auth/jwt/login", data=self.population.credentials(index))
+            response.raise_for_status()
+            self.tokens[index] = response.json()["access_token"]
+
+    def _body_value(self, field: str, user: int) -> object:
+        if field in ("email", "username"):
+            return self.population.email(user)
+        if field in ("password", "current_password", "new_password"):
+            return self.population.password
+        return "replay"
+
+    def build(self, number: int, entry: dict) -> Optional[dict]:
+        """httpx request arguments for a captured record, or None if it cannot be replayed."""
+        route = entry["r"]
+        if route == "<unmatched>" or entry.get("sse"):
+            return None
+        user = self.actors.get(entry.get("a"), number % max(1, self.population.count))
+        path = route
+        for name, value in entry.get("p", {}).items():
+            path = path.replace(f"{{{name}}}", value)
+        if "{id}" in path:
+            path = path.replace("{id}", str(self.population.user_ids[user]))
+        if "{" in path:
+            return None
+
+        params = {name: value if value is not None else "replay" for name, value in entry.get("q", {}).items()}
+        if path.endswith("/callback"):
+            params["code"] = f"replay-{number % self.oauth_users}"
+        headers = {}
+        if "auth" in entry.get("h", ()) and user in self.tokens:
+            headers["Authorization"] = f"Bearer {self.tokens[user]}"
+        request = {"method": entry["m"], "url": path, "params": params, "headers": headers}
+
+        fields = entry.get("f", [])
+        if fields:
+            body = {field: self._body_value(field, user) for field in fields}
+            if route == "/auth/register":
+                self._registrations += 1
+                body["email"] = f"replay-new-{self._registrations}@{REPLAY_EMAIL_DOMAIN}"
+            request["json" if entry.get("b") == "json" else "data"] = body
+        return request
+
+    async def _send(self, route: str, request: dict, recorded: dict, user: Optional[int],
+                    previous: Optional[asyncio.Task]) -> None:
+        if previous is not None:
+            # A client waits for its previous response (and its ETag) before the next request
+            await asyncio.wait([previous])
+        if "inm" in recorded.get("h", ()):
+            request["headers"]["If-None-Match"] = self.etags.get((user, request["url"]), '"replay"')
+        async with self.semaphore:
+            started = time.perf_counter()
+            try:
+                response = await self.client.request(**request)
+                status = response.status_code
+            except httpx.HTTPError:
+                response, status = None, 0
+            elapsed = (time.perf_counter() - started) * 1000
+        if response is not None and user is not None and "etag" in response.headers:
+            self.etags[(user, request["url"])] = response.headers["etag"]
+        result = self.results.setdefault(route, {"recorded": [], "replayed": [], "status_mismatches": 0, "statuses": {}})
+        result["recorded"].append(recorded["d"])
+        result["replayed"].append(elapsed)
+        result["statuses"][status] = result["statuses"].get(status, 0) + 1
+        if status // 100 != recorded["s"] // 100:
+            result["status_mismatches"] += 1
+
+    async def run(self) -> float:
+        tasks = []
+        last_by_user: dict[int, asyncio.Task] = {}
+        started = time.monotonic()
+        for number, (at, entry) in enumerate(self.records):
+            request = self.build(number, entry)
+            route = f"{entry['m']} {entry['r']}"
+            if request is None:
+                self.skipped[route] = self.skipped.get(route, 0) + 1
+                continue
+            user = self.actors.get(entry.get("a"))
+            delay = at / self.speed - (time.monotonic() - started)
+            if delay > 0:
+                await asyncio.sleep(delay)
+            elif delay < -0.05:
+                # The replay could not keep up with the captured rate at this speed
+                self.late += 1
+            task = asyncio.create_task(self._send(route, request, entry, user, last_by_user.get(user)))
+            if user is not None:
+                last_by_user[user] = task
+            tasks.append(task)
+        await asyncio.gather(*tasks)
+        return time.monotonic() - started
+
+    def report(self, elapsed: float, baseline: Optional[dict] = None) -> dict:
+        routes = {}
+        for route, result in sorted(self.results.items(), key=lambda item: -len(item[1]["replayed"])):
+            replayed = _summary(result["replayed"])
+            if baseline is not None:
+                reference = baseline["routes"].get(route, {}).get("replayed")
+            else:
+                reference = _summary(result["recorded"])
+            delta = None
+            if reference and reference.get("p95_ms"):
+                delta = round((replayed["p95_ms"] - reference["p95_ms"]) / reference["p95_ms"] * 100, 1)
+            routes[route] = {
+                "recorded": _summary(result["recorded"]),
+                "replayed": replayed,
+                "p95_delta_pct": delta,
+                "status_mismatches": result["status_mismatches"],
+                "statuses": result["statuses"],
+            }
+        replayed_count = sum(len(result["replayed"]) for result in self.results.values())
+        return {
+            "speed": self.speed,
+            "requests": replayed_count,
+            "seconds": round(elapsed, 3),
+            "rps": round(replayed_count / elapsed, 1) if elapsed else None,
+            "actors": len(self.actors),
+            "late": self.late,
+            "compared_with": "baseline" if baseline else "capture",
+            "skipped": self.skipped,
+            "routes": routes,
+        }
+
+
+def print_report(report: dict) -> None:
+    print(f"Replayed {report['requests']} requests in {report['seconds']}s at {report['speed']}x "
+          f"({report['rps']} rps, {report['actors']} actors, {report['late']} sent late)")
+    print(f"p95 delta against the {report['compared_with']}")
+    print(f"{'route':<44} {'count':>7} {'p50':>9} {'p95':>9} {'p99':>9} {'Δp95':>8} {'status≠':>8}")
+    for route, result in report["routes"].items():
+        replayed = result["replayed"]
+        delta = f"{result['p95_delta_pct']:+.1f}%" if result["p95_delta_pct"] is not None else "-"
+        print(f"{route[:44]:<44} {replayed['count']:>7} {replayed['p50_ms']:>9} {replayed['p95_ms']:>9} "
+              f"{replayed['p99_ms']:>9} {delta:>8} {result['status_mismatches']:>8}")
+    for route, result in report["routes"].items():
+        if result["status_mismatches"]:
+            print(f"Statuses differing from the capture for {route}: replayed {result['statuses']}")
+    if report["skipped"]:
+        print(f"Skipped: {report['skipped']}")
+
+
+async def main(args) -> dict:
+    records = load_capture(args.captures, args.limit)
+    if not records:
+        raise SystemExit("No requests in the capture")
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    if args.url:
+        from testing.seeding import seed_users
+
+        client = httpx.AsyncClient(base_url=args.url, timeout=30)
+        harness = None
+    else:
+        from testing.harness import AuthServiceHarness
+
+        harness = await AuthServiceHarness().start()
+        client = harness.client
+        seed_users = harness.seed_users
+    try:
+        replayer = Replayer(client, records, args.speed, args.oauth_users, args.max_in_flight)
+        await replayer.prepare(seed_users)
+        elapsed = await replayer.run()
+        report = replayer.report(elapsed, baseline)
+    finally:
+        if harness is not None:
+            await harness.stop()
+        else:
+            await client.aclose()
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a traffic capture against a local auth service")
+    parser.add_argument("captures", nargs="+", help="Capture files (TRAFFIC_CAPTURE_PATH output)")
+    parser.add_argument("--speed", type=float, default=1.0, help="Replay speed multiplier (2 = twice the captured rate)")
+    parser.add_argument("--limit", type=int, default=None, help="Replay only the first N requests")
+    parser.add_argument("--url", default=None, help="Target a running instance instead of the in-process harness")
+    parser.add_argument("--oauth-users", type=int, default=100, help="Distinct mock OAuth users behind callbacks")
+    parser.add_argument("--max-in-flight", type=int, default=1000, help="Cap on concurrently outstanding requests")
+    parser.add_argument("--output", default=None, help="Write the report as JSON (usable as a later --baseline)")
+    parser.add_argument("--baseline", default=None, help="Compare against a previous report instead of the capture")
+    args = parser.parse_args()
+    report = asyncio.run(main(args))
+    print_report(report)
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2)
@@ -0,0 +1,98 @@
+"""
+Resilience drill: run the real SMTP and Discord client code against the
+fault-injecting stand-ins and report how calls behave as faults come and go.
+
+Usage (from backend-auth/):
+    python -m testing.resilience_drill
+
+Uses its own short breaker settings and does not touch the database.
+"""
+import asyncio
+import os
+import time
+
+# Stand-in endpoints and short breaker settings; must be set before the service modules load
+os.environ.update({
+    "EMAILS_ENABLED": "true",
+    "SMTP_HOST": "127.0.0.1",
+    "SMTP_USERNAME": "drill",
+    "SMTP_PASSWORD": "drill",
+    "EMAILS_FROM_EMAIL": "drill@example.com",
+    "SMTP_USE_TLS": "false",
+    "SMTP_TIMEOUT_SECONDS": "2",
+    "CIRCUIT_FAILURE_THRESHOLD": "3",
+    "CIRCUIT_RESET_SECONDS": "2",
+})
+
+from testing.fault_injection import FaultPlan, FaultyHTTPProvider, FaultySMTPServer  # noqa: E402
+
+
+async def _timed(label: str, operation) -> None:
+    started = time.perf_counter()
+    try:
+        outcome = await operation()
+    except Exception as e:
+        outcome = f"{type(e).__name__}: {str(e)[:80]}"
+    print(f"   {label:<38} {(time.perf_counter() - started) * 1000:8.1f}ms  {outcome}")
+
+
+async def smtp_drill() -> None:
+    import email_service
+
+    plan = FaultPlan()
+    async with FaultySMTPServer(plan) as server:
+        email_service.SMTP_PORT = server.port
+
+        async def send():
+            return await email_service.send_email("user@example.com", "Drill", "<p>drill</p>", "drill")
+
+        print("📧 SMTP: healthy")
+        await _timed("send_email", send)
+        print("📧 SMTP: every message rejected with 451")
+        plan.error_rate = 1.0
+        for attempt in range(5):
+            await _timed(f"send_email #{attempt + 1}", send)
+        print(f"   circuit: {email_service.smtp_dependency.stats()['state']}")
+        print("📧 SMTP: recovered, waiting for the reset timeout")
+        plan.healthy()
+        await asyncio.sleep(email_service.smtp_dependency.breaker.retry_after() + 0.1)
+        await _timed("send_email (probe)", send)
+        print(f"   circuit: {email_service.smtp_dependency.stats()['state']}, messages delivered: {len(server.messages)}")
+
+
+async def discord_drill() -> None:
+    from resilience import deadline_scope
+    from services.oauth.discord_oauth import DiscordOAuthService
+
+    plan = FaultPlan()
+    async with FaultyHTTPProvider(plan) as provider:
+        service = DiscordOAuthService("drill", "drill", "http://localhost/callback")
+        provider.point_discord_service(service)
+
+        print("🎮 Discord: healthy")
+        await _timed("exchange_code_for_token", lambda: service.exchange_code_for_token("code"))
+        print("🎮 Discord: hanging, request has a 1s deadline")
+        plan.hang = True
+        with deadline_scope(1.0):
+            await _timed("exchange_code_for_token", lambda: service.exchange_code_for_token("code"))
+        print("🎮 Discord: 400 responses (client errors do not trip the breaker)")
+        plan.healthy()
+        plan.error_rate, plan.error_status = 1.0, 400
+        for attempt in range(3):
+            await _timed(f"exchange_code_for_token #{attempt + 1}", lambda: service.exchange_code_for_token("code"))
+        print(f"   circuit: {service.dependency.stats()['state']}")
+        print("🎮 Discord: 503 responses")
+        plan.error_status = 503
+        for attempt in range(4):
+            await _timed(f"exchange_code_for_token #{attempt + 1}", lambda: service.exchange_code_for_token("code"))
+        print(f"   circuit: {service.dependency.stats()['state']}, requests that reached the provider: {provider.requests}")
+
+
+async def main() -> None:
+    await smtp_drill()
+    print()
+    await discord_drill()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,167 @@
+"""
+Deterministic seeding of large user populations.
+
+seed_users() bulk-inserts users (and optionally OAuth accounts) with Core
+executemany batches instead of going through UserManager, so a million users
+take seconds of database time rather than a million Argon2 hashes: every
+seeded user shares one password hash, computed once with the service's
+current parameters, so password login works for any of them.
+
+The same seed always produces the same ids, emails and flags, so measurements
+can be repeated against identical data. Sharded setups (SHARD_DATABASE_URLS)
+are seeded on the shards with their directory rows.
+"""
+import random
+import uuid
+from collections import defaultdict
+from typing import Optional
+
+from sqlalchemy import insert
+from sqlalchemy.ext.asyncio import AsyncEngine
+
+from db import SHARD_DATABASE_URLS, OAuthAccount, User, engine as default_engine
+from password_hashing import password_helper
+
+SEED_PASSWORD = "Seeded-Password-1"
+
+
+class SeededPopulation:
+    """What seed_users() created: enough to address any seeded user again."""
+
+    def __init__(self, count: int, email_domain: str, password: str, start: int):
+        self.count = count
+        self.email_domain = email_domain
+        self.password = password
+        self.start = start
+        self.user_ids: list[uuid.UUID] = []
+        self.verified = 0
+        self.admins = 0
+        self.oauth_accounts = 0
+
+    def email(self, index: int) -> str:
+        """Email of the index-th seeded user (0-based)."""
+        return seed_email(self.start + index, self.email_domain)
+
+    def credentials(self, index: int) -> dict:
+        """Form body for POST /auth/jwt/login."""
+        return {"username": self.email(index), "password": self.password}
+
+
+def seed_email(number: int, email_domain: str = "seed.example.com") -> str:
+    return f"user{number:08d}@{email_domain}"
+
+
+def _user_rows(population: SeededPopulation, rng: random.Random, hashed_password: str,
+               verified_ratio: float, inactive_ratio: float, admin_count: int, oauth_ratio: float):
+    for index in range(population.count):
+        user_id = uuid.UUID(int=rng.getrandbits(128), version=4)
+        is_verified = rng.random() < verified_ratio
+        is_admin = index < admin_count
+        user = {
+            "id": user_id,
+            "email": population.email(index),
+            "hashed_password": hashed_password,
+            "is_active": rng.random() >= inactive_ratio or is_admin,
+            "is_verified": is_verified or is_admin,
+            "is_superuser": False,
+            "role": "admin" if is_admin else "user",
+            "profile_version": 1,
+        }
+        account = None
+        if rng.random() < oauth_ratio:
+            oauth_name = rng.choice(("google", "discord"))
+            account = {
+                "id": uuid.UUID(int=rng.getrandbits(128), version=4),
+                "user_id": user_id,
+                "oauth_name": oauth_name,
+                "access_token": "seeded",
+                "account_id": str(rng.getrandbits(60)),
+                "account_email": user["email"],
+            }
+        yield user, account
+
+
+async def _insert_batches(target: AsyncEngine, users: list[dict], accounts: list[dict]) -> None:
+    async with target.begin() as conn:
+        if users:
+            await conn.execute(insert(User.__table__), users)
+        if accounts:
+            await conn.execute(insert(OAuthAccount.__table__), accounts)
+
+
+async def _insert_sharded(users: list[dict], accounts: list[dict]) -> None:
+    from sharding import (
+        OAuthAccountDirectory, UserEmailDirectory, email_key, oauth_key, shard_set,
+    )
+
+    per_shard = defaultdict(lambda: {"users": [], "accounts": [], "emails": [], "oauth": []})
+    for user in users:
+        per_shard[shard_set.for_user(user["id"]).name]["users"].append(user)
+        per_shard[shard_set.for_key(email_key(user["email"])).name]["emails"].append(
+            {"email": user["email"].lower(), "user_id": user["id"]}
+        )
+    for account in accounts:
+        per_shard[shard_set.for_user(account["user_id"]).name]["accounts"].append(account)
+        per_shard[shard_set.for_key(oauth_key(account["oauth_name"], account["account_id"])).name]["oauth"].append(
+            {"oauth_name": account["oauth_name"], "account_id": account["account_id"], "user_id": account["user_id"]}
+        )
+    for name, rows in per_shard.items():
+        shard_engine = shard_set.shards[name].engine
+        await _insert_batches(shard_engine, rows["users"], rows["accounts"])
+        async with shard_engine.begin() as conn:
+            if rows["emails"]:
+                await conn.execute(insert(UserEmailDirectory.__table__), rows["emails"])
+            if rows["oauth"]:
+                await conn.execute(insert(OAuthAccountDirectory.__table__), rows["oauth"])
+
+
+async def seed_users(
+    count: int,
+    *,
+    seed: int = 0,
+    start: int = 0,
+    email_domain: str = "seed.example.com",
+    password: str = SEED_PASSWORD,
+    verified_ratio: float = 0.8,
+    inactive_ratio: float = 0.02,
+    admin_count: int = 0,
+    oauth_ratio: float = 0.0,
+    batch_size: int = 5000,
+    target: Optional[AsyncEngine] = None,
+) -> SeededPopulation:
+    """
+    Insert `count` users numbered from `start` (emails user00000000@seed.example.com, ...).
+    The first `admin_count` users are verified admins. Uses DATABASE_URL's
+    engine (or the shards) unless `target` is given.
+    """
+    population = SeededPopulation(count, email_domain, password, start)
+    rng = random.Random(seed)
+    hashed_password = password_helper.hash(password)
+    sharded = target is None and bool(SHARD_DATABASE_URLS)
+    target = target or default_engine
+
+    users, accounts = [], []
+
+    async def flush():
+        if sharded:
+            await _insert_sharded(users, accounts)
+        else:
+            await _insert_batches(target, users, accounts)
+        users.clear()
+        accounts.clear()
+
+    rows = _user_rows(population, rng, hashed_password, verified_ratio, inactive_ratio, admin_count, oauth_ratio)
+    for user, account in rows:
+        users.append(user)
+        population.user_ids.append(user["id"])
+        population.verified += user["is_verified"]
+        population.admins += user["role"] == "admin"
+        if account is not None:
+            accounts.append(account)
+            population.oauth_accounts += 1
+        if len(users) >= batch_size:
+            await flush()
+    await flush()
+    print(f"🌱 Seeded {count} users ({population.verified} verified, {population.admins} admins, {population.oauth_accounts} OAuth accounts)")
+    return population
+
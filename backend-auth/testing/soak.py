@@ -0,0 +1,376 @@
+"""
+Soak test: drive the app for hours through testing.harness and fail on leaks.
+
+Usage (from backend-auth/):
+    python -m testing.soak [--duration 7200] [--concurrency 20] [--warmup 300]
+        [--sample-interval 60] [--output soak.json]
+
+Workers send a fixed mix of requests for --duration seconds against the
+harness's local stand-ins (SQLite or HARNESS_POSTGRES_URL, SMTP, mock OAuth):
+token reads, password logins, Discord and Google OAuth callbacks (sign-up
+first, login afterwards), registrations, forgot-password and resend-verification.
+Users, tokens and OAuth codes come from fixed pools, so per-user caches stop
+growing during the warmup. Use HARNESS_POSTGRES_URL for runs that matter:
+SQLite serialises writers, so concurrent registrations and outbox writes
+fail with "database is locked" and count as errors.
+
+Every --sample-interval seconds the process is measured:
+- resident memory and, with tracemalloc, traced Python memory plus the source
+  lines whose allocations grew most since the baseline,
+- open file descriptors and sockets, asyncio tasks,
+- the primary database pool (connections checked out),
+- live AsyncSession, httpx.AsyncClient and UserManager objects.
+The first sample after --warmup is the baseline. A metric fails when it stays
+more than its --max-*-growth above the baseline for three samples in a row;
+the run stops at the first failure. When the load stops, every pooled
+connection must be returned and the task count must settle back.
+
+Exits 1 on failure; --output writes the samples and the verdict as JSON.
+"""
+import argparse
+import asyncio
+import gc
+import json
+import os
+import random
+import resource
+import sys
+import time
+import tracemalloc
+from typing import Optional
+
+from testing.harness import AuthServiceHarness, bearer
+
+SOAK_EMAIL_DOMAIN = "soak.example.com"
+# Objects whose live count should not trend upwards (leaked sessions, clients, managers)
+TRACKED_TYPES = ("AsyncSession", "AsyncClient", "UserManager")
+# Consecutive samples a metric must stay past its threshold before it fails
+SUSTAINED_SAMPLES = 3
+# Request mix: operation -> weight
+OPERATIONS = {
+    "users_me": 10,
+    "authenticated_route": 3,
+    "password_login": 2,
+    "discord_callback": 2,
+    "google_callback": 2,
+    "forgot_password": 1,
+    "resend_verification": 1,
+    "register": 1,
+}
+
+
+def _rss_mb() -> float:
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / (1024 * 1024)
+    except OSError:
+        # No procfs: peak instead of current resident memory (kilobytes on Linux, bytes on macOS)
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak / (1024 * 1024) if sys.platform == "darwin" else peak / 1024
+
+
+def _descriptors() -> tuple[Optional[int], Optional[int]]:
+    """(open file descriptors, of which sockets); sockets are only known with procfs."""
+    for directory in ("/proc/self/fd", "/dev/fd"):
+        try:
+            names = os.listdir(directory)
+        except OSError:
+            continue
+        if directory != "/proc/self/fd":
+            return len(names), None
+        sockets = 0
+        for name in names:
+            try:
+                sockets += os.readlink(os.path.join(directory, name)).startswith("socket:")
+            except OSError:
+                pass
+        return len(names), sockets
+    return None, None
+
+
+def _pool_stats() -> dict:
+    from db import engine
+
+    pool = engine.sync_engine.pool
+    stats = {"class": type(pool).__name__}
+    for name in ("size", "checkedout", "overflow"):
+        method = getattr(pool, name, None)
+        if callable(method):
+            stats[name] = method()
+    return stats
+
+
+def _live_objects() -> dict[str, int]:
+    gc.collect()
+    counts = dict.fromkeys(TRACKED_TYPES, 0)
+    for obj in gc.get_objects():
+        name = type(obj).__name__
+        if name in counts:
+            counts[name] += 1
+    return counts
+
+
+def _percentile(values: list[float], p: float) -> Optional[float]:
+    if not values:
+        return None
+    values = sorted(values)
+    return round(values[min(len(values) - 1, int(len(values) * p))], 2)
+
+
+class SoakRun:
+    def __init__(self, harness: AuthServiceHarness, args):
+        self.harness = harness
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.population = None
+        self.tokens: list[str] = []
+        self.operations = list(OPERATIONS)
+        self.weights = list(OPERATIONS.values())
+        self.counts = {operation: {} for operation in OPERATIONS}
+        # Latencies since the last sample only, so the soak itself does not accumulate memory
+        self.window: dict[str, list[float]] = {operation: [] for operation in OPERATIONS}
+        self.requests = 0
+        self.errors = 0
+        self.emails = 0
+        self.registrations = 0
+        self.samples: list[dict] = []
+        self.baseline: Optional[dict] = None
+        self.baseline_snapshot: Optional[tracemalloc.Snapshot] = None
+        self.failures: list[str] = []
+        self._over: dict[str, int] = {}
+        self._stopping = False
+
+    @property
+    def thresholds(self) -> dict[str, float]:
+        thresholds = {
+            "rss_mb": self.args.max_rss_growth_mb,
+            "fds": self.args.max_fd_growth,
+            "sockets": self.args.max_fd_growth,
+            "tasks": self.args.max_task_growth,
+        }
+        if tracemalloc.is_tracing():
+            thresholds["traced_mb"] = self.args.max_traced_growth_mb
+        for name in TRACKED_TYPES:
+            thresholds[f"objects.{name}"] = self.args.max_object_growth
+        return thresholds
+
+    async def prepare(self) -> None:
+        self.population = await self.harness.seed_users(self.args.users, verified_ratio=0.5, inactive_ratio=0.0,
+                                                         email_domain=SOAK_EMAIL_DOMAIN)
+        for index in range(self.args.users):
+            self.tokens.append(await self.harness.login(**self.population.credentials(index)))
+
+    def _request(self, operation: str) -> dict:
+        user = self.rng.randrange(self.args.users)
+        if operation == "users_me":
+            return {"method": "GET", "url": "/users/me", "headers": bearer(self.tokens[user])}
+        if operation == "authenticated_route":
+            return {"method": "GET", "url": "/authenticated-route", "headers": bearer(self.tokens[user])}
+        if operation == "password_login":
+            return {"method": "POST", "url": "/auth/jwt/login", "data": self.population.credentials(user)}
+        if operation in ("discord_callback", "google_callback"):
+            provider = operation.split("_")[0]
+            code = f"soak-{self.rng.randrange(self.args.oauth_users)}"
+            return {"method": "GET", "url": f"/auth/{provider}/callback", "params": {"code": code}}
+        if operation == "forgot_password":
+            return {"method": "POST", "url": "/auth/forgot-password", "json": {"email": self.population.email(user)}}
+        if operation == "resend_verification":
+            return {"method": "POST", "url": "/auth/resend-verification", "params": {"email": self.population.email(user)}}
+        self.registrations += 1
+        email = f"soak-new-{self.registrations}@{SOAK_EMAIL_DOMAIN}"
+        return {"method": "POST", "url": "/auth/register", "json": {"email": email, "password": "Soak-Password-1"}}
+
+    async def _worker(self, deadline: float) -> None:
+        client = self.harness.client
+        while not self._stopping and time.monotonic() < deadline:
+            operation = self.rng.choices(self.operations, self.weights)[0]
+            started = time.perf_counter()
+            try:
+                status = (await client.request(**self._request(operation))).status_code
+            except Exception as e:
+                status = type(e).__name__
+            self.window[operation].append((time.perf_counter() - started) * 1000)
+            self.counts[operation][status] = self.counts[operation].get(status, 0) + 1
+            self.requests += 1
+            if not isinstance(status, int) or status >= 500:
+                self.errors += 1
+
+    def _latency_window(self) -> dict:
+        window = {}
+        for operation, latencies in self.window.items():
+            if latencies:
+                window[operation] = {"count": len(latencies), "p50_ms": _percentile(latencies, 0.50),
+                                     "p95_ms": _percentile(latencies, 0.95)}
+            latencies.clear()
+        return window
+
+    def _top_growth(self, snapshot: tracemalloc.Snapshot) -> list[dict]:
+        snapshot = snapshot.filter_traces((
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap>"),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap_external>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ))
+        top = []
+        for stat in snapshot.compare_to(self.baseline_snapshot, "lineno")[:self.args.top]:
+            if stat.size_diff <= 0:
+                break
+            frame = stat.traceback[0]
+            top.append({"line": f"{frame.filename}:{frame.lineno}", "size_diff_kb": round(stat.size_diff / 1024, 1),
+                        "count_diff": stat.count_diff})
+        return top
+
+    def sample(self, elapsed: float, phase: str) -> dict:
+        # Harness-side memory that is not the service's: delivered emails are counted and dropped
+        self.emails += len(self.harness.smtp.messages)
+        self.harness.smtp.messages.clear()
+        fds, sockets = _descriptors()
+        sample = {
+            "phase": phase,
+            "elapsed_s": round(elapsed, 1),
+            "requests": self.requests,
+            "errors": self.errors,
+            "emails": self.emails,
+            "rss_mb": round(_rss_mb(), 1),
+            "fds": fds,
+            "sockets": sockets,
+            "tasks": len(asyncio.all_tasks()),
+            "pool": _pool_stats(),
+            "objects": _live_objects(),
+            "latency": self._latency_window(),
+        }
+        snapshot = None
+        if tracemalloc.is_tracing():
+            sample["traced_mb"] = round(tracemalloc.get_traced_memory()[0] / (1024 * 1024), 1)
+            snapshot = tracemalloc.take_snapshot()
+        if phase == "load" and self.baseline is None and elapsed >= self.args.warmup:
+            self.baseline, self.baseline_snapshot = sample, snapshot
+            sample["phase"] = "baseline"
+        elif self.baseline is not None:
+            sample["growth"] = self._growth(sample)
+            if snapshot is not None:
+                sample["top_growth"] = self._top_growth(snapshot)
+        self.samples.append(sample)
+        self._print(sample)
+        return sample
+
+    @staticmethod
+    def _metric(sample: dict, name: str) -> Optional[float]:
+        if name.startswith("objects."):
+            return sample["objects"][name.split(".", 1)[1]]
+        return sample.get(name)
+
+    def _growth(self, sample: dict) -> dict:
+        growth = {}
+        for name, limit in self.thresholds.items():
+            current, baseline = self._metric(sample, name), self._metric(self.baseline, name)
+            if current is None or baseline is None:
+                continue
+            growth[name] = round(current - baseline, 1)
+            self._over[name] = self._over.get(name, 0) + 1 if growth[name] > limit else 0
+            if self._over[name] == SUSTAINED_SAMPLES:
+                self.failures.append(
+                    f"{name} grew by {growth[name]} (limit {limit}) for {SUSTAINED_SAMPLES} samples in a row"
+                )
+        return growth
+
+    def _print(self, sample: dict) -> None:
+        traced = f" traced {sample['traced_mb']}MB" if "traced_mb" in sample else ""
+        pool = sample["pool"]
+        print(
+            f"♨️  {sample['phase']:<8} {sample['elapsed_s']:>8.0f}s  {sample['requests']:>9} requests "
+            f"({sample['errors']} errors)  rss {sample['rss_mb']}MB{traced}  fds {sample['fds']} "
+            f"sockets {sample['sockets']}  tasks {sample['tasks']}  pool out {pool.get('checkedout')}  "
+            f"objects {sample['objects']}"
+        )
+        for entry in sample.get("top_growth", [])[:3]:
+            print(f"      +{entry['size_diff_kb']}KB ({entry['count_diff']:+} blocks) {entry['line']}")
+
+    async def run(self) -> None:
+        started = time.monotonic()
+        deadline = started + self.args.duration
+        workers = [asyncio.create_task(self._worker(deadline)) for _ in range(self.args.concurrency)]
+        self.sample(0.0, "load")
+        while time.monotonic() < deadline and not self.failures:
+            await asyncio.sleep(min(self.args.sample_interval, max(0.0, deadline - time.monotonic())))
+            self.sample(time.monotonic() - started, "load")
+        self._stopping = True
+        await asyncio.gather(*workers)
+        # Background work started by the last requests (outbox relay, audit flushes) gets time to finish
+        await asyncio.sleep(self.args.settle)
+        drained = self.sample(time.monotonic() - started, "drained")
+        self._check_drained(drained)
+
+    def _check_drained(self, drained: dict) -> None:
+        checked_out = drained["pool"].get("checkedout")
+        if checked_out:
+            self.failures.append(f"{checked_out} database connections still checked out after the load stopped")
+        if self.baseline is None:
+            self.failures.append(f"The run ended before the {self.args.warmup}s warmup: no baseline to compare with")
+            return
+        # The baseline was taken under load, so idle should not have more tasks than that
+        if drained["tasks"] > self.baseline["tasks"] + self.args.max_task_growth:
+            self.failures.append(f"{drained['tasks']} asyncio tasks after the load stopped (baseline {self.baseline['tasks']})")
+
+    def report(self) -> dict:
+        error_rate = self.errors / self.requests if self.requests else 0.0
+        if error_rate > self.args.max_error_rate:
+            self.failures.append(f"Error rate {error_rate:.2%} (limit {self.args.max_error_rate:.2%})")
+        return {
+            "duration_s": self.args.duration,
+            "concurrency": self.args.concurrency,
+            "requests": self.requests,
+            "errors": self.errors,
+            "error_rate": round(error_rate, 5),
+            "statuses": self.counts,
+            "thresholds": self.thresholds,
+            "baseline": self.baseline,
+            "samples": self.samples,
+            "passed": not self.failures,
+            "failures": self.failures,
+        }
+
+
+async def main(args) -> dict:
+    if args.tracemalloc_frames:
+        # Started before the service is imported so its module-level allocations are attributed too
+        tracemalloc.start(args.tracemalloc_frames)
+    async with AuthServiceHarness() as harness:
+        soak = SoakRun(harness, args)
+        await soak.prepare()
+        print(f"♨️  Soaking for {args.duration}s with {args.concurrency} workers, {args.users} users "
+              f"(warmup {args.warmup}s, sample every {args.sample_interval}s)")
+        await soak.run()
+        return soak.report()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Long-running soak test with leak detection")
+    parser.add_argument("--duration", type=float, default=7200, help="Seconds of load")
+    parser.add_argument("--concurrency", type=int, default=20, help="Concurrent request loops")
+    parser.add_argument("--warmup", type=float, default=300, help="Seconds before the baseline sample")
+    parser.add_argument("--sample-interval", type=float, default=60, help="Seconds between samples")
+    parser.add_argument("--settle", type=float, default=5, help="Seconds to wait after the load before the final sample")
+    parser.add_argument("--users", type=int, default=200, help="Seeded users (each signed in once)")
+    parser.add_argument("--oauth-users", type=int, default=200, help="Distinct mock OAuth users behind callbacks")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the request mix")
+    parser.add_argument("--tracemalloc-frames", type=int, default=1, help="Frames per traced allocation (0 disables tracemalloc)")
+    parser.add_argument("--top", type=int, default=10, help="Growing allocation sites kept per sample")
+    parser.add_argument("--max-rss-growth-mb", type=float, default=64)
+    parser.add_argument("--max-traced-growth-mb", type=float, default=32)
+    parser.add_argument("--max-fd-growth", type=int, default=16, help="Limit for file descriptors and sockets")
+    parser.add_argument("--max-task-growth", type=int, default=16)
+    parser.add_argument("--max-object-growth", type=int, default=50, help="Limit per tracked object type")
+    parser.add_argument("--max-error-rate", type=float, default=0.001, help="Share of 5xx responses and exceptions")
+    parser.add_argument("--output", default=None, help="Write the report as JSON")
+    args = parser.parse_args()
+    report = asyncio.run(main(args))
+    if args.output:
+        with open(args.output, "w") as output:
+            json.dump(report, output, indent=2, default=str)
+    if report["passed"]:
+        print(f"✅ Soak passed: {report['requests']} requests, {report['errors']} errors")
+    else:
+        for failure in report["failures"]:
+            print(f"❌ {failure}")
+        raise SystemExit(1)
@@ -0,0 +1,150 @@
+"""
+Local stand-ins for the service's external dependencies, for offline runs.
+
+- MockOAuthProvider: answers the Discord or Google OAuth token and profile
+  endpoints. Every authorization code maps to its own deterministic user
+  (code "user-42" -> user-42@<provider>.example.com), so load runs can log in many
+  distinct OAuth users; latency and faults come from a FaultPlan.
+- LocalSMTPServer: an in-process aiosmtpd server that accepts AUTH PLAIN/LOGIN
+  without TLS and keeps every message, with optional per-message latency.
+
+Neither needs network access; both listen on 127.0.0.1 on a free port.
+"""
+import asyncio
+import hashlib
+import socket
+from email import message_from_bytes
+from email.message import Message
+from typing import Optional
+from urllib.parse import parse_qs
+
+from testing.fault_injection import FaultPlan, FaultyHTTPProvider
+
+
+def oauth_user_for_code(provider: str, code: str) -> dict:
+    """The user a mock provider returns for an authorization code."""
+    numeric_id = int(hashlib.sha256(f"{provider}:{code}".encode()).hexdigest()[:15], 16)
+    return {"id": str(numeric_id), "username": code, "email": f"{code}@{provider}.example.com"}
+
+
+class MockOAuthProvider(FaultyHTTPProvider):
+    """Discord or Google OAuth endpoints with a user per authorization code."""
+
+    TOKEN_PATHS = {"discord": "/api/oauth2/token", "google": "/token"}
+    PROFILE_PATHS = {"discord": "/api/users/@me", "google": "/v1/people/me"}
+
+    def __init__(self, provider: str, plan: Optional[FaultPlan] = None, users: Optional[dict[str, dict]] = None):
+        if provider not in self.TOKEN_PATHS:
+            raise ValueError(f"Unsupported provider: {provider}")
+        super().__init__(plan)
+        self.provider = provider
+        # Explicit code -> user entries (id, username, email; email may be None)
+        self.users = users or {}
+        self.routes = {
+            ("POST", self.TOKEN_PATHS[provider]): self._token,
+            ("GET", self.PROFILE_PATHS[provider]): self._profile,
+        }
+
+    @property
+    def token_url(self) -> str:
+        return f"{self.base_url}{self.TOKEN_PATHS[self.provider]}"
+
+    @property
+    def profile_url(self) -> str:
+        return f"{self.base_url}{self.PROFILE_PATHS[self.provider]}"
+
+    def user_for_code(self, code: str) -> dict:
+        return self.users.get(code) or oauth_user_for_code(self.provider, code)
+
+    def _token(self, request: dict):
+        code = parse_qs(request["body"].decode()).get("code", [""])[0]
+        if not code or code.startswith("invalid"):
+            return 400, {"error": "invalid_grant"}
+        return {"access_token": f"mock-{code}", "token_type": "Bearer", "expires_in": 3600}
+
+    def _profile(self, request: dict):
+        scheme, _, token = request["headers"].get("authorization", "").partition(" ")
+        if scheme.lower() != "bearer" or not token.startswith("mock-"):
+            return 401, {"message": "401: Unauthorized"}
+        user = self.user_for_code(token.removeprefix("mock-"))
+        if self.provider == "discord":
+            return {**user, "avatar": None, "discriminator": "0"}
+        return {
+            "resourceName": f"people/{user['id']}",
+            "emailAddresses": [{"value": user["email"], "metadata": {"primary": True}}] if user.get("email") else [],
+        }
+
+    def point_client(self, client) -> None:
+        """Redirect a configured OAuth client (DiscordOAuthService or GoogleOAuth2) to this stand-in."""
+        if self.provider == "discord":
+            client.DISCORD_TOKEN_URL = self.token_url
+            client.DISCORD_USER_URL = self.profile_url
+        else:
+            import httpx_oauth.clients.google as google
+
+            client.access_token_endpoint = self.token_url
+            client.refresh_token_endpoint = self.token_url
+            # Read at call time by GoogleOAuth2.get_profile
+            google.PROFILE_ENDPOINT = self.profile_url
+
+
+class _CollectingHandler:
+    def __init__(self, server: "LocalSMTPServer"):
+        self.server = server
+
+    async def handle_DATA(self, smtp_server, session, envelope):
+        if self.server.latency:
+            await asyncio.sleep(self.server.latency)
+        self.server.messages.append(message_from_bytes(envelope.original_content or envelope.content))
+        return "250 OK queued"
+
+
+class LocalSMTPServer:
+    """In-process aiosmtpd server (runs on its own thread and event loop)."""
+
+    def __init__(self, latency: float = 0.0, username: str = "harness", password: str = "harness"):
+        self.latency = latency
+        self.username = username
+        self.password = password
+        self.messages: list[Message] = []
+        self.port = 0
+        self._controller = None
+
+    def _authenticate(self, server, session, envelope, mechanism, auth_data):
+        from aiosmtpd.smtp import AuthResult
+
+        login, password = auth_data.login.decode(), auth_data.password.decode()
+        return AuthResult(success=login == self.username and password == self.password)
+
+    def start(self) -> "LocalSMTPServer":
+        try:
+            from aiosmtpd.controller import Controller
+        except ImportError:
+            raise RuntimeError("aiosmtpd is not installed; pip install -r requirements-dev.txt")
+
+        with socket.socket() as probe:
+            probe.bind(("127.0.0.1", 0))
+            self.port = probe.getsockname()[1]
+        self._controller = Controller(
+            _CollectingHandler(self),
+            hostname="127.0.0.1",
+            port=self.port,
+            authenticator=self._authenticate,
+            auth_require_tls=False,
+        )
+        self._controller.start()
+        return self
+
+    def stop(self) -> None:
+        if self._controller is not None:
+            self._controller.stop()
+            self._controller = None
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+    def messages_to(self, address: str) -> list[Message]:
+        return [message for message in self.messages if address in message.get("To", "")]
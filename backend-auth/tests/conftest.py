@@ -0,0 +1,50 @@
+"""
+Shared helpers for the tests. The harness fixtures (auth_harness, client,
+smtp_server, oauth_providers, ...) come from testing/pytest_plugin.py.
+
+The service reads its configuration at import time and the harness has to be
+started first, so tests import app modules (db, users, token_socket, ...)
+inside the test functions, never at module level.
+"""
+import asyncio
+import inspect
+import socket
+import uuid
+
+import pytest_asyncio
+
+PASSWORD = "Harness-Passw0rd!"
+
+
+def unique_email(prefix: str = "user") -> str:
+    # One database is shared by the whole session
+    return f"{prefix}-{uuid.uuid4().hex[:12]}@example.com"
+
+
+def free_port() -> int:
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        return probe.getsockname()[1]
+
+
+async def eventually(predicate, timeout: float = 10.0):
+    """Poll until predicate() (sync or async) returns something truthy; returns it."""
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        result = predicate()
+        if inspect.isawaitable(result):
+            result = await result
+        if result:
+            return result
+        if asyncio.get_running_loop().time() > deadline:
+            raise AssertionError("Condition not met in time")
+        await asyncio.sleep(0.05)
+
+
+@pytest_asyncio.fixture(loop_scope="session")
+async def signed_in_user(auth_harness):
+    """A newly registered user and an access token for them."""
+    email = unique_email()
+    user = await auth_harness.register(email, PASSWORD)
+    token = await auth_harness.login(email, PASSWORD)
+    return {**user, "token": token}
@@ -0,0 +1,17 @@
+import pytest
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+async def test_count_estimate_binds_the_filter_values(auth_harness):
+    from sqlalchemy.dialects.postgresql import asyncpg
+
+    from services.admin_users import _explain, filtered_users_query
+
+    role = "admin' OR '1'='1"
+    compiled = _explain(filtered_users_query(role=role, oauth_provider="google")).compile(dialect=asyncpg.dialect())
+
+    assert str(compiled).startswith("EXPLAIN (FORMAT JSON) SELECT")
+    assert role not in str(compiled)
+    assert "google" not in str(compiled)
+    assert sorted(compiled.params.values()) == sorted([role, "google"])
@@ -0,0 +1,135 @@
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import update
+
+from tests.conftest import PASSWORD, eventually, unique_email
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+def _aware(value: datetime) -> datetime:
+    # SQLite hands back naive datetimes
+    return value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+
+
+async def _outbox_rows(email: str) -> list:
+    from sqlalchemy import select
+
+    from db import EmailOutbox, async_session_maker
+
+    async with async_session_maker() as session:
+        result = await session.execute(select(EmailOutbox).where(EmailOutbox.to_email == email))
+        return list(result.scalars())
+
+
+async def _delivered_rows(email: str) -> list:
+    rows = await _outbox_rows(email)
+    return rows if rows and all(row.status == "sent" for row in rows) else []
+
+
+async def _make_due(row_id: uuid.UUID) -> None:
+    from db import EmailOutbox, async_session_maker
+
+    async with async_session_maker() as session:
+        await session.execute(
+            update(EmailOutbox).where(EmailOutbox.id == row_id).values(available_at=datetime.now(timezone.utc))
+        )
+        await session.commit()
+
+
+@pytest_asyncio.fixture(loop_scope="session")
+async def paused_relay(auth_harness):
+    """Stop the app's relay so the test drives delivery itself; restarted afterwards."""
+    from services import email_outbox
+
+    await email_outbox.relay.stop()
+    yield email_outbox
+    email_outbox.relay.start()
+
+
+async def test_registration_email_is_delivered_from_the_outbox(auth_harness, smtp_server):
+    email = unique_email()
+    user = await auth_harness.register(email, PASSWORD)
+
+    messages = await eventually(lambda: smtp_server.messages_to(email))
+    assert len(messages) == 1
+
+    # The relay marks the row once the SMTP session has finished
+    rows = await eventually(lambda: _delivered_rows(email))
+    assert [row.template for row in rows] == ["verify"]
+    assert str(rows[0].user_id) == user["id"]
+    assert rows[0].attempts == 1
+
+
+async def test_failed_delivery_is_retried_with_backoff(auth_harness, smtp_server, paused_relay):
+    from db import async_session_maker
+    from email_service import SMTPConnectionPool
+
+    email = unique_email()
+    async with async_session_maker() as session:
+        await paused_relay.enqueue_email(session, "reset_password", email, token="reset-token")
+
+    relay = paused_relay.EmailOutboxRelay(max_attempts=3)
+    relay._pool = SMTPConnectionPool()
+    deliver = relay._deliver
+
+    async def smtp_down(row):
+        raise ConnectionError("smtp down")
+
+    try:
+        relay._deliver = smtp_down
+        started = datetime.now(timezone.utc)
+        assert await relay.process_batch() >= 1
+
+        [row] = await _outbox_rows(email)
+        assert row.status == "pending"
+        assert row.attempts == 1
+        assert row.last_error == "ConnectionError: smtp down"
+        assert row.token == "reset-token"
+        assert _aware(row.available_at) >= started + timedelta(seconds=9)
+
+        # Backing off: the next batch leaves the row alone
+        await relay.process_batch()
+        [row] = await _outbox_rows(email)
+        assert row.attempts == 1
+
+        relay._deliver = deliver
+        await _make_due(row.id)
+        assert await relay.process_batch() >= 1
+
+        [row] = await _outbox_rows(email)
+        assert row.status == "sent"
+        assert row.attempts == 2
+        assert row.token is None
+        assert row.last_error is None
+        assert len(smtp_server.messages_to(email)) == 1
+    finally:
+        await relay._pool.close()
+
+
+async def test_delivery_gives_up_after_max_attempts(auth_harness, smtp_server, paused_relay):
+    from db import async_session_maker
+
+    email = unique_email()
+    async with async_session_maker() as session:
+        await paused_relay.enqueue_email(session, "reset_password", email, token="reset-token")
+
+    relay = paused_relay.EmailOutboxRelay(max_attempts=2)
+
+    async def smtp_down(row):
+        raise ConnectionError("smtp down")
+
+    relay._deliver = smtp_down
+    await relay.process_batch()
+    [row] = await _outbox_rows(email)
+    await _make_due(row.id)
+    await relay.process_batch()
+
+    [row] = await _outbox_rows(email)
+    assert row.status == "failed"
+    assert row.attempts == 2
+    assert row.token is None
+    assert smtp_server.messages_to(email) == []
@@ -0,0 +1,78 @@
+import asyncio
+import uuid
+from urllib.parse import parse_qs, urlparse
+
+import pytest
+
+from tests.conftest import PASSWORD, unique_email
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+def _key() -> dict:
+    return {"Idempotency-Key": str(uuid.uuid4())}
+
+
+async def test_retried_registration_is_replayed(client):
+    headers = _key()
+    body = {"email": unique_email(), "password": PASSWORD}
+
+    first = await client.post("/auth/register", json=body, headers=headers)
+    retry = await client.post("/auth/register", json=body, headers=headers)
+
+    assert first.status_code == 201
+    assert "idempotent-replayed" not in first.headers
+    assert retry.status_code == 201
+    assert retry.headers["idempotent-replayed"] == "true"
+    assert retry.json() == first.json()
+
+
+async def test_concurrent_duplicates_run_once(client):
+    headers = _key()
+    body = {"email": unique_email(), "password": PASSWORD}
+
+    responses = await asyncio.gather(*(client.post("/auth/register", json=body, headers=headers) for _ in range(4)))
+
+    assert [response.status_code for response in responses] == [201] * 4
+    assert sum(1 for response in responses if "idempotent-replayed" not in response.headers) == 1
+    assert len({response.json()["id"] for response in responses}) == 1
+
+
+async def test_reusing_a_key_with_another_body_is_rejected(client):
+    headers = _key()
+    first = await client.post("/auth/register", json={"email": unique_email(), "password": PASSWORD}, headers=headers)
+    conflict = await client.post("/auth/register", json={"email": unique_email(), "password": PASSWORD}, headers=headers)
+
+    assert first.status_code == 201
+    assert conflict.status_code == 422
+
+
+async def test_requests_without_a_key_are_not_deduplicated(client):
+    body = {"email": unique_email(), "password": PASSWORD}
+    first = await client.post("/auth/register", json=body)
+    second = await client.post("/auth/register", json=body)
+
+    assert first.status_code == 201
+    assert second.status_code == 400
+    assert second.json()["detail"] == "REGISTER_USER_ALREADY_EXISTS"
+
+
+async def test_oauth_callbacks_are_merged_only_while_in_flight(client, oauth_providers):
+    provider = oauth_providers["discord"]
+    provider.plan.latency = 0.2
+    params = {"code": f"code-{uuid.uuid4().hex[:12]}", "state": "state"}
+    requests_before = provider.requests
+
+    responses = await asyncio.gather(*(client.get("/auth/discord/callback", params=params) for _ in range(3)))
+
+    # One token exchange and one profile request for all three
+    assert provider.requests - requests_before == 2
+    assert sum(1 for response in responses if response.headers.get("idempotent-replayed") == "true") == 2
+    tokens = {parse_qs(urlparse(response.headers["location"]).query)["token"][0] for response in responses}
+    assert len(tokens) == 1
+
+    # The callback URL seen again later does not replay the token redirect
+    provider.plan.latency = 0
+    later = await client.get("/auth/discord/callback", params=params)
+    assert "idempotent-replayed" not in later.headers
+    assert provider.requests - requests_before == 4
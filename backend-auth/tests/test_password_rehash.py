@@ -0,0 +1,33 @@
+import uuid
+
+import pytest
+from sqlalchemy import select, update
+
+from tests.conftest import PASSWORD, unique_email
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+async def test_login_upgrades_an_old_hash_without_a_password_change(auth_harness):
+    from pwdlib.hashers.bcrypt import BcryptHasher
+
+    from db import User, UserEvent, async_session_maker
+    from password_hashing import hash_version, password_helper
+
+    email = unique_email("rehash")
+    user_id = uuid.UUID((await auth_harness.register(email, PASSWORD))["id"])
+    async with async_session_maker() as session:
+        await session.execute(update(User).where(User.id == user_id).values(hashed_password=BcryptHasher().hash(PASSWORD)))
+        await session.commit()
+
+    await auth_harness.login(email, PASSWORD)
+
+    async with async_session_maker() as session:
+        user = await session.get(User, user_id)
+        event_types = list((await session.execute(
+            select(UserEvent.type).where(UserEvent.user_id == user_id).order_by(UserEvent.id)
+        )).scalars())
+    assert hash_version(user.hashed_password) == password_helper.current_version
+    assert event_types == ["user.registered"]
+    # The upgraded hash still verifies
+    await auth_harness.login(email, PASSWORD)
@@ -0,0 +1,61 @@
+import asyncio
+import uuid
+
+import pytest
+
+from testing.harness import bearer
+from tests.conftest import PASSWORD, unique_email
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+async def test_profile_etag_changes_after_an_update(client, signed_in_user):
+    headers = bearer(signed_in_user["token"])
+
+    first = await client.get("/users/me", headers=headers)
+    assert first.status_code == 200
+    etag = first.headers["etag"]
+
+    cached = await client.get("/users/me", headers={**headers, "If-None-Match": etag})
+    assert cached.status_code == 304
+    assert cached.content == b""
+    assert cached.headers["etag"] == etag
+
+    new_email = unique_email("renamed")
+    updated = await client.patch("/users/me", json={"email": new_email}, headers=headers)
+    assert updated.status_code == 200
+
+    after = await client.get("/users/me", headers={**headers, "If-None-Match": etag})
+    assert after.status_code == 200
+    assert after.json()["email"] == new_email
+    assert after.headers["etag"] != etag
+
+    again = await client.get("/users/me", headers={**headers, "If-None-Match": after.headers["etag"]})
+    assert again.status_code == 304
+
+
+async def test_profile_etag_is_per_user(client, auth_harness):
+    etags = []
+    for _ in range(2):
+        email = unique_email()
+        await auth_harness.register(email, PASSWORD)
+        token = await auth_harness.login(email, PASSWORD)
+        etags.append((await client.get("/users/me", headers=bearer(token))).headers["etag"])
+
+    assert etags[0] != etags[1]
+
+
+async def test_concurrent_updates_each_bump_the_profile_version(client, signed_in_user):
+    from db import User, async_session_maker
+
+    headers = bearer(signed_in_user["token"])
+    responses = await asyncio.gather(*(
+        client.patch("/users/me", json={"email": unique_email("concurrent")}, headers=headers)
+        for _ in range(4)
+    ))
+    assert [response.status_code for response in responses] == [200] * 4
+
+    async with async_session_maker() as session:
+        user = await session.get(User, uuid.UUID(signed_in_user["id"]))
+    # Registration wrote version 1; no write is lost, so no ETag is reused for a different body
+    assert user.profile_version == 5
@@ -0,0 +1,98 @@
+import uuid
+
+import pytest
+from starlette.requests import Request
+
+from testing.harness import bearer
+from tests.conftest import PASSWORD, eventually, unique_email
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+async def _ticket(client, token: str) -> str:
+    response = await client.post("/users/me/events/ticket", headers=bearer(token))
+    assert response.status_code == 200
+    return response.json()["ticket"]
+
+
+async def _open_stream(ticket: str) -> list[str]:
+    """First messages of a stream opened with a ticket (the ASGI test client buffers whole responses)."""
+    from routers.profile import stream_current_user_events
+
+    response = await stream_current_user_events(Request({"type": "http", "headers": []}), ticket)
+    try:
+        return [await anext(response.body_iterator), await anext(response.body_iterator)]
+    finally:
+        await response.body_iterator.aclose()
+
+
+async def test_stream_ticket_opens_one_stream(client, signed_in_user):
+    ticket = await _ticket(client, signed_in_user["token"])
+
+    retry, ready = await _open_stream(ticket)
+    assert ready.startswith("event: ready\n")
+    assert signed_in_user["id"] in ready
+
+    # Single use
+    assert (await client.get("/users/me/events", params={"ticket": ticket})).status_code == 401
+
+
+async def test_access_token_is_not_accepted_in_the_url(client, signed_in_user):
+    response = await client.get("/users/me/events", params={"access_token": signed_in_user["token"]})
+    assert response.status_code == 401
+    # Nor as a ticket, and a ticket is no access token
+    assert (await client.get("/users/me/events", params={"ticket": signed_in_user["token"]})).status_code == 401
+    ticket = await _ticket(client, signed_in_user["token"])
+    assert (await client.get("/users/me", headers=bearer(ticket))).status_code == 401
+
+
+async def test_ticket_carries_the_session_expiry(client, signed_in_user):
+    from services.session_push import redeem_stream_ticket
+    from users import jwt_strategy
+
+    ticket = await _ticket(client, signed_in_user["token"])
+    user_id, session_expires_at = redeem_stream_ticket(ticket)
+    assert user_id == uuid.UUID(signed_in_user["id"])
+    assert session_expires_at == jwt_strategy.verified_claims(signed_in_user["token"])[1]
+
+
+@pytest.mark.parametrize("event_type", ["user.password_changed", "user.role_changed", "user.updated"])
+async def test_any_password_change_revokes_the_session(auth_harness, event_type):
+    from db import UserEvent
+    from services.session_push import session_push_hub
+
+    user_id = uuid.uuid4()
+    subscriber = session_push_hub.subscribe(user_id, None)
+    try:
+        event = UserEvent(id=1, type=event_type, user_id=user_id, data={"fields": ["hashed_password", "role"]})
+        session_push_hub._dispatch(event)
+        assert subscriber.pending[0].startswith("id: 1\nevent: token_revoked\n")
+        assert subscriber.closed
+    finally:
+        session_push_hub.unsubscribe(subscriber)
+
+
+async def test_login_hash_upgrade_does_not_end_the_session(auth_harness, client):
+    from pwdlib.hashers.bcrypt import BcryptHasher
+    from sqlalchemy import update
+
+    from db import User, async_session_maker
+    from services.session_push import session_push_hub
+
+    email = unique_email("push-rehash")
+    user_id = uuid.UUID((await auth_harness.register(email, PASSWORD))["id"])
+    async with async_session_maker() as session:
+        await session.execute(update(User).where(User.id == user_id).values(hashed_password=BcryptHasher().hash(PASSWORD)))
+        await session.commit()
+
+    subscriber = session_push_hub.subscribe(user_id, None)
+    try:
+        token = await auth_harness.login(email, PASSWORD)
+        # A profile update after the login marks the point the dispatcher has caught up to
+        response = await client.patch("/users/me", json={"email": unique_email("push-rehashed")}, headers=bearer(token))
+        assert response.status_code == 200
+        await eventually(lambda: subscriber.pending)
+        assert [message.split("\n")[1] for message in subscriber.pending] == ["event: profile_updated"]
+        assert not subscriber.closed
+    finally:
+        session_push_hub.unsubscribe(subscriber)
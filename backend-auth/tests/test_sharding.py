@@ -0,0 +1,193 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+import pytest_asyncio
+from sqlalchemy import func, select
+
+from tests.conftest import unique_email
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+@pytest_asyncio.fixture(loop_scope="session")
+async def shards(auth_harness, tmp_path):
+    from sharding import ShardSet
+
+    shard_set = ShardSet([f"sqlite+aiosqlite:///{tmp_path}/shard{index}.db" for index in range(3)])
+    await shard_set.create_tables()
+    yield shard_set
+    await shard_set.dispose()
+
+
+@pytest_asyncio.fixture(loop_scope="session")
+async def user_db(shards):
+    from db import async_session_maker
+    from sharding import ShardedUserDatabase
+
+    async with async_session_maker() as session:
+        yield ShardedUserDatabase(session, shards)
+
+
+async def _user_counts(shards) -> dict[str, int]:
+    from db import User
+
+    counts = {}
+    for name, shard in shards.shards.items():
+        async with shard.session_maker() as session:
+            counts[name] = await session.scalar(select(func.count()).select_from(User))
+    return counts
+
+
+async def _directory_entry(shards, email: str):
+    from sharding import UserEmailDirectory, email_key
+
+    async with shards.for_key(email_key(email)).session_maker() as session:
+        return await session.get(UserEmailDirectory, {"email": email.lower()})
+
+
+async def test_hash_ring_is_stable_and_spreads_keys(auth_harness):
+    from sharding import HashRing
+
+    ring = HashRing(["shard0", "shard1", "shard2"])
+    keys = [f"user:{uuid.uuid4()}" for _ in range(3000)]
+    placement = {key: ring.node_for(key) for key in keys}
+    assert placement == {key: HashRing(["shard0", "shard1", "shard2"]).node_for(key) for key in keys}
+    assert all(list(placement.values()).count(node) > 600 for node in ("shard0", "shard1", "shard2"))
+
+    # A new shard only takes keys over; nothing moves between the old ones
+    grown = HashRing(["shard0", "shard1", "shard2", "shard3"])
+    moved = [key for key in keys if grown.node_for(key) != placement[key]]
+    assert all(grown.node_for(key) == "shard3" for key in moved)
+    assert len(moved) < len(keys) / 2
+
+
+async def test_users_are_stored_on_their_shard(shards, user_db):
+    users = [await user_db.create({"email": unique_email(), "hashed_password": "x"}) for _ in range(12)]
+
+    expected = {name: 0 for name in shards.shards}
+    for user in users:
+        expected[shards.for_user(user.id).name] += 1
+        entry = await _directory_entry(shards, user.email)
+        assert entry.user_id == user.id
+    assert await _user_counts(shards) == expected
+
+    found = await user_db.get_by_email(users[0].email.upper())
+    assert found.id == users[0].id
+    assert (await user_db.get(users[1].id)).email == users[1].email
+
+
+async def test_duplicate_email_is_rejected_across_shards(user_db):
+    from fastapi_users.exceptions import UserAlreadyExists
+
+    email = unique_email()
+    await user_db.create({"email": email, "hashed_password": "x"})
+    with pytest.raises(UserAlreadyExists):
+        await user_db.create({"email": email.upper(), "hashed_password": "x"})
+
+
+async def test_email_change_moves_the_directory_entry(shards, user_db):
+    from fastapi_users.exceptions import UserAlreadyExists
+
+    user = await user_db.create({"email": unique_email(), "hashed_password": "x"})
+    taken = await user_db.create({"email": unique_email(), "hashed_password": "x"})
+    old_email, new_email = user.email, unique_email("moved")
+
+    updated = await user_db.update(user, {"email": new_email})
+    assert updated.email == new_email
+    assert await user_db.get_by_email(old_email) is None
+    assert await _directory_entry(shards, old_email) is None
+    assert (await user_db.get_by_email(new_email)).id == user.id
+
+    with pytest.raises(UserAlreadyExists):
+        await user_db.update(updated, {"email": taken.email})
+    assert (await user_db.get(user.id)).email == new_email
+
+
+async def test_oauth_accounts_are_found_through_the_directory(user_db):
+    user = await user_db.create({"email": unique_email(), "hashed_password": "x"})
+    account = {"oauth_name": "discord", "account_id": uuid.uuid4().hex, "account_email": user.email, "access_token": "t"}
+    await user_db.add_oauth_account(user, account)
+
+    found = await user_db.get_by_oauth_account("discord", account["account_id"])
+    assert found.id == user.id
+    assert [linked.account_id for linked in found.oauth_accounts] == [account["account_id"]]
+
+    other = await user_db.create({"email": unique_email(), "hashed_password": "x"})
+    with pytest.raises(ValueError):
+        await user_db.add_oauth_account(other, account)
+
+
+async def test_delete_releases_the_directory_entries(shards, user_db):
+    user = await user_db.create({"email": unique_email(), "hashed_password": "x"})
+    account_id = uuid.uuid4().hex
+    user = await user_db.add_oauth_account(user, {
+        "oauth_name": "google", "account_id": account_id, "account_email": user.email, "access_token": "t",
+    })
+
+    await user_db.delete(user)
+
+    assert await user_db.get(user.id) is None
+    assert await _directory_entry(shards, user.email) is None
+    assert await user_db.get_by_oauth_account("google", account_id) is None
+    # The email is free again
+    assert (await user_db.create({"email": user.email, "hashed_password": "x"})).id != user.id
+
+
+async def test_concurrent_registrations_for_one_email_create_one_user(shards, user_db, monkeypatch):
+    from fastapi_users.exceptions import UserAlreadyExists
+
+    claim = user_db._claim_directory
+
+    async def slow_claim(*args, **kwargs):
+        claimed = await claim(*args, **kwargs)
+        # Hold the gap between the directory claim and the user insert open
+        await asyncio.sleep(0.2)
+        return claimed
+
+    monkeypatch.setattr(user_db, "_claim_directory", slow_claim)
+    email = unique_email("dup")
+    outcomes = await asyncio.gather(
+        *(user_db.create({"email": email, "hashed_password": "x"}) for _ in range(2)), return_exceptions=True
+    )
+
+    created = [outcome for outcome in outcomes if not isinstance(outcome, Exception)]
+    assert len(created) == 1
+    assert [type(outcome) for outcome in outcomes if isinstance(outcome, Exception)] == [UserAlreadyExists]
+    assert (await user_db.get_by_email(email)).id == created[0].id
+    assert sum((await _user_counts(shards)).values()) == 1
+
+
+async def _abandoned_directory_row(shards, email: str, age: timedelta) -> uuid.UUID:
+    from sharding import UserEmailDirectory, email_key
+
+    missing_user_id = uuid.uuid4()
+    async with shards.for_key(email_key(email)).session_maker() as session:
+        session.add(UserEmailDirectory(
+            email=email.lower(), user_id=missing_user_id, claimed_at=datetime.now(timezone.utc) - age,
+        ))
+        await session.commit()
+    return missing_user_id
+
+
+async def test_recent_claims_without_a_user_are_not_taken_over(shards, user_db):
+    from fastapi_users.exceptions import UserAlreadyExists
+
+    email = unique_email()
+    owner = await _abandoned_directory_row(shards, email, timedelta(seconds=1))
+
+    with pytest.raises(UserAlreadyExists):
+        await user_db.create({"email": email, "hashed_password": "x"})
+    assert (await _directory_entry(shards, email)).user_id == owner
+
+
+async def test_abandoned_claims_are_reclaimed_after_the_grace_period(shards, user_db):
+    from db import SHARD_DIRECTORY_CLAIM_GRACE_SECONDS
+
+    email = unique_email()
+    await _abandoned_directory_row(shards, email, timedelta(seconds=SHARD_DIRECTORY_CLAIM_GRACE_SECONDS + 1))
+
+    user = await user_db.create({"email": email, "hashed_password": "x"})
+    assert (await _directory_entry(shards, email)).user_id == user.id
+    assert (await user_db.get_by_email(email)).id == user.id
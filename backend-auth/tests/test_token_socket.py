@@ -0,0 +1,154 @@
+import asyncio
+import struct
+import uuid
+
+import pytest
+import pytest_asyncio
+
+from tests.conftest import PASSWORD, free_port, unique_email
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+def _frame(op: int, request_id: int, token: str = "") -> bytes:
+    payload = token.encode()
+    return struct.pack(">IBI", 5 + len(payload), op, request_id) + payload
+
+
+async def _read_response(reader: asyncio.StreamReader) -> tuple[int, int, bytes]:
+    (length,) = struct.unpack(">I", await reader.readexactly(4))
+    frame = await reader.readexactly(length)
+    status, request_id = struct.unpack_from(">BI", frame)
+    return status, request_id, frame[5:]
+
+
+async def _new_user(harness) -> dict:
+    email = unique_email("socket")
+    user = await harness.register(email, PASSWORD)
+    return {**user, "token": await harness.login(email, PASSWORD)}
+
+
+@pytest_asyncio.fixture(loop_scope="session")
+async def token_socket(auth_harness):
+    from token_socket import TokenSocketServer
+
+    server = TokenSocketServer(path="", host="127.0.0.1", port=free_port())
+    await server.start()
+    yield server
+    await server.stop()
+
+
+@pytest_asyncio.fixture(loop_scope="session")
+async def socket_client(token_socket):
+    from token_socket import TokenSocketClient
+
+    client = await TokenSocketClient.connect(host=token_socket.host, port=token_socket.port)
+    yield client
+    await client.close()
+
+
+async def test_pipelined_requests_are_matched_by_request_id(auth_harness, socket_client):
+    from token_socket import OP_CLAIMS, OP_PING, OP_VALIDATE, STATUS_INVALID_TOKEN, STATUS_OK, decode_claims
+
+    users = [await _new_user(auth_harness) for _ in range(5)]
+
+    # Everything is written before any answer is read
+    claims = [socket_client.send(OP_CLAIMS, user["token"]) for user in users]
+    validated = [socket_client.send(OP_VALIDATE, user["token"]) for user in users]
+    ping = socket_client.send(OP_PING)
+    invalid = socket_client.send(OP_CLAIMS, "not-a-jwt")
+
+    for user, answer in zip(users, await asyncio.gather(*claims)):
+        status, body = answer
+        assert status == STATUS_OK
+        decoded = decode_claims(body)
+        assert decoded["id"] == uuid.UUID(user["id"])
+        assert decoded["email"] == user["email"]
+        assert decoded["is_active"] is True
+        assert decoded["exp"] is not None
+    for user, (status, body) in zip(users, await asyncio.gather(*validated)):
+        assert status == STATUS_OK
+        assert body[:16] == uuid.UUID(user["id"]).bytes
+    assert await ping == (STATUS_OK, b"")
+    assert (await invalid)[0] == STATUS_INVALID_TOKEN
+
+
+async def test_claims_lookups_are_batched(auth_harness, token_socket, socket_client):
+    from token_socket import OP_CLAIMS, STATUS_OK
+
+    users = [await _new_user(auth_harness) for _ in range(20)]
+    queries_before = token_socket.resolver.queries
+
+    answers = await asyncio.gather(*(socket_client.send(OP_CLAIMS, user["token"]) for user in users))
+
+    assert [status for status, _ in answers] == [STATUS_OK] * len(users)
+    assert token_socket.resolver.queries - queries_before < len(users)
+
+
+async def test_deactivated_user_is_inactive_for_claims_only(auth_harness, socket_client):
+    from sqlalchemy import update
+
+    from db import User, async_session_maker
+    from token_socket import OP_CLAIMS, STATUS_INACTIVE
+
+    user = await _new_user(auth_harness)
+    async with async_session_maker() as session:
+        await session.execute(update(User).where(User.id == uuid.UUID(user["id"])).values(is_active=False))
+        await session.commit()
+
+    # VALIDATE only checks the token itself
+    assert await socket_client.validate(user["token"]) is not None
+    assert await socket_client.claims(user["token"]) is None
+    assert (await socket_client.request(OP_CLAIMS, user["token"]))[0] == STATUS_INACTIVE
+
+
+async def test_frames_split_and_coalesced_across_writes(auth_harness, token_socket):
+    from token_socket import OP_PING, OP_VALIDATE, STATUS_OK
+
+    user = await _new_user(auth_harness)
+    reader, writer = await asyncio.open_connection(token_socket.host, token_socket.port)
+    try:
+        first = _frame(OP_VALIDATE, 7, user["token"])
+        # Half a frame, then its rest together with a second whole frame
+        writer.write(first[:3])
+        await writer.drain()
+        await asyncio.sleep(0.05)
+        writer.write(first[3:] + _frame(OP_PING, 8))
+        await writer.drain()
+
+        assert (await _read_response(reader))[:2] == (STATUS_OK, 7)
+        assert await _read_response(reader) == (STATUS_OK, 8, b"")
+    finally:
+        writer.close()
+
+
+@pytest.mark.parametrize("frame", [
+    struct.pack(">I", 9000) + b"\x01",
+    struct.pack(">I", 4) + b"\x01\x00\x00\x00",
+])
+async def test_bad_frame_length_closes_the_connection(token_socket, frame):
+    from token_socket import STATUS_BAD_REQUEST
+
+    reader, writer = await asyncio.open_connection(token_socket.host, token_socket.port)
+    try:
+        writer.write(frame)
+        await writer.drain()
+        assert await _read_response(reader) == (STATUS_BAD_REQUEST, 0, b"")
+        assert await reader.read() == b""
+    finally:
+        writer.close()
+
+
+async def test_unknown_op_closes_the_connection(token_socket):
+    from token_socket import OP_PING, STATUS_BAD_REQUEST, STATUS_OK
+
+    reader, writer = await asyncio.open_connection(token_socket.host, token_socket.port)
+    try:
+        writer.write(_frame(OP_PING, 1) + _frame(99, 2) + _frame(OP_PING, 3))
+        await writer.drain()
+        assert await _read_response(reader) == (STATUS_OK, 1, b"")
+        assert await _read_response(reader) == (STATUS_BAD_REQUEST, 2, b"")
+        # Nothing after the bad request is answered
+        assert await reader.read() == b""
+    finally:
+        writer.close()
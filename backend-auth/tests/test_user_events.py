@@ -0,0 +1,27 @@
+import pytest
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+async def test_update_event_types(auth_harness):
+    from db import User
+    from services.user_events import update_event
+
+    user = User(email="events@example.com", hashed_password="x", profile_version=3)
+
+    assert update_event(user, {"hashed_password": "new"})[0] == "user.password_changed"
+    assert update_event(user, {"role": "admin", "hashed_password": "new"})[0] == "user.role_changed"
+    assert update_event(user, {"is_verified": True})[0] == "user.verified"
+    assert update_event(user, {"profile_version": 4}) is None
+
+
+async def test_password_rehash_records_no_event(auth_harness):
+    from db import User
+    from services.user_events import update_event
+
+    user = User(email="events@example.com", hashed_password="x", profile_version=3)
+
+    assert update_event(user, {"hashed_password": "upgraded"}, password_rehash=True) is None
+    # Only a pure hash upgrade counts as a rehash
+    assert update_event(user, {"hashed_password": "new", "email": "other@example.com"}, password_rehash=True)[0] \
+        == "user.password_changed"
@@ -0,0 +1,134 @@
+import asyncio
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import pytest
+from sqlalchemy import update
+
+from tests.conftest import PASSWORD, eventually, unique_email
+
+pytestmark = pytest.mark.asyncio(loop_scope="session")
+
+
+async def _campaign(campaign_id: uuid.UUID):
+    from services.verification_campaign import get_campaign
+
+    return await get_campaign(campaign_id)
+
+
+async def _finished(campaign_id: uuid.UUID):
+    campaign = await _campaign(campaign_id)
+    return campaign if campaign.status != "running" else None
+
+
+async def _set(campaign_id: uuid.UUID, **values) -> None:
+    from db import VerificationCampaign, async_session_maker
+
+    async with async_session_maker() as session:
+        await session.execute(update(VerificationCampaign).where(VerificationCampaign.id == campaign_id).values(**values))
+        await session.commit()
+
+
+async def test_campaign_sends_and_records_the_real_total(auth_harness, smtp_server):
+    from services import verification_campaign
+
+    emails = [unique_email("campaign") for _ in range(3)]
+    for email in emails:
+        await auth_harness.register(email, PASSWORD)
+
+    campaign = await verification_campaign.start_campaign(batch_size=2, concurrency=2)
+    finished = await eventually(lambda: _finished(campaign.id))
+
+    assert finished.status == "completed"
+    assert finished.sent_count >= len(emails)
+    assert finished.failed_count == 0 and finished.skipped_count == 0
+    assert finished.total_estimate == finished.sent_count
+    assert finished.lease_until is None
+    for email in emails:
+        assert smtp_server.messages_to(email)
+
+
+async def test_users_are_skipped_when_emails_are_disabled(auth_harness, monkeypatch):
+    from services import verification_campaign
+
+    await auth_harness.register(unique_email("campaign"), PASSWORD)
+    monkeypatch.setattr(verification_campaign, "EMAILS_ENABLED", False)
+
+    campaign = await verification_campaign.start_campaign()
+    finished = await eventually(lambda: _finished(campaign.id))
+
+    assert finished.status == "completed"
+    assert finished.sent_count == 0
+    assert finished.skipped_count >= 1
+    assert verification_campaign.campaign_to_dict(finished)["skipped"] == finished.skipped_count
+
+
+async def test_only_one_campaign_runs_at_a_time(auth_harness, monkeypatch):
+    from services import verification_campaign
+
+    await auth_harness.register(unique_email("campaign"), PASSWORD)
+    release = asyncio.Event()
+
+    async def held(pool, user_id, email):
+        await release.wait()
+        return "sent"
+
+    monkeypatch.setattr(verification_campaign, "_send_one", held)
+    campaign = await verification_campaign.start_campaign()
+    try:
+        with pytest.raises(ValueError, match="already running"):
+            await verification_campaign.start_campaign()
+        with pytest.raises(ValueError, match="already running"):
+            await verification_campaign.resume_campaign(campaign.id)
+        assert verification_campaign.campaign_to_dict(await _campaign(campaign.id))["active"] is True
+    finally:
+        release.set()
+    await eventually(lambda: _finished(campaign.id))
+
+
+async def test_campaign_claimed_elsewhere_stops_and_expired_claims_resume(auth_harness, monkeypatch):
+    from services import verification_campaign
+
+    await auth_harness.register(unique_email("campaign"), PASSWORD)
+    release = asyncio.Event()
+
+    async def held(pool, user_id, email):
+        await release.wait()
+        return "sent"
+
+    monkeypatch.setattr(verification_campaign, "_send_one", held)
+    campaign = await verification_campaign.start_campaign(batch_size=1)
+
+    # Another worker took the campaign over after this worker's lease ran out
+    await _set(campaign.id, claimed_by="other-worker", lease_until=datetime.now(timezone.utc) - timedelta(seconds=1))
+    release.set()
+    await eventually(lambda: campaign.id not in verification_campaign._running)
+    stopped = await _campaign(campaign.id)
+    assert stopped.status == "running"
+    assert stopped.claimed_by == "other-worker"
+    assert stopped.sent_count == 0
+
+    # Its lease is expired too, so the campaign can be resumed here
+    resumed = await verification_campaign.resume_campaign(campaign.id)
+    assert resumed.claimed_by == verification_campaign.WORKER_ID
+    finished = await eventually(lambda: _finished(campaign.id))
+    assert finished.status == "completed"
+
+
+async def test_cancel_reaches_a_campaign_on_another_worker(auth_harness):
+    from services import verification_campaign
+    from db import VerificationCampaign, async_session_maker
+
+    async with async_session_maker() as session:
+        campaign = VerificationCampaign(
+            status="running", batch_size=10, concurrency=1, claimed_by="other-worker",
+            lease_until=datetime.now(timezone.utc) + timedelta(minutes=5),
+        )
+        session.add(campaign)
+        await session.commit()
+
+    assert await verification_campaign.cancel_campaign(campaign.id) is True
+    cancelled = await _campaign(campaign.id)
+    assert cancelled.status == "cancelled"
+    assert verification_campaign.campaign_to_dict(cancelled)["active"] is False
+    assert await verification_campaign.cancel_campaign(campaign.id) is False
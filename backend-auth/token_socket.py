@@ -0,0 +1,400 @@
+"""
+Internal token validation listener for co-located services.
+
+Serves two questions the Node backend asks on every authenticated request,
+without going through HTTP, JSON and the FastAPI middleware stack:
+
+- VALIDATE: is this JWT valid, and whose is it? Answered from the auth
+  backend's JWT strategy (users.jwt_strategy, with its verified-token cache);
+  no database access, so it does NOT detect deleted or deactivated users: a
+  token keeps validating until it expires. Use CLAIMS to authorize requests.
+- CLAIMS: the user's current id, flags, role, email and profile_version, for
+  active users only. Lookups that arrive together (from one pipelined batch or
+  several connections in the same event loop turn) are resolved with a single
+  SELECT ... WHERE id IN (...).
+
+Binary framing, all integers big-endian. Clients may pipeline any number of
+requests per connection; CLAIMS answers can come back out of order, so
+responses carry the request id.
+
+    request:  u32 length | u8 op | u32 request id | token (UTF-8)
+    response: u32 length | u8 status | u32 request id | body
+    (length counts the bytes after itself)
+
+    ops:      0 PING, 1 VALIDATE, 2 CLAIMS
+    status:   0 OK, 1 INVALID_TOKEN, 2 INACTIVE (unknown or deactivated user),
+              3 BAD_REQUEST (connection is closed after it), 4 ERROR
+    VALIDATE: 16 bytes user id | u64 exp (0 = none)
+    CLAIMS:   16 bytes user id | u64 exp | u8 flags (1 active, 2 verified,
+              4 superuser) | u32 profile_version | u8 role length | role |
+              u16 email length | email
+
+Listens on TOKEN_SOCKET_PATH (Unix socket, for services sharing a volume; with
+several workers the first one to start serves it) and/or TOKEN_SOCKET_PORT
+(TCP on TOKEN_SOCKET_HOST with SO_REUSEPORT, so every worker accepts).
+Nothing listens unless one of them is set. There is no authentication beyond
+the token itself: bind it to a socket only co-located services can reach.
+"""
+import asyncio
+import os
+import socket
+import struct
+import uuid
+from typing import Optional
+
+from sqlalchemy import select
+
+from db import SHARD_DATABASE_URLS, User, async_session_maker
+from services.activity_tracker import activity_tracker
+from users import active_user_from_token, jwt_strategy
+
+TOKEN_SOCKET_PATH = os.getenv("TOKEN_SOCKET_PATH", "")
+TOKEN_SOCKET_HOST = os.getenv("TOKEN_SOCKET_HOST", "127.0.0.1")
+TOKEN_SOCKET_PORT = int(os.getenv("TOKEN_SOCKET_PORT", "0"))
+# Requests of one connection being answered at once; reading pauses beyond that
+TOKEN_SOCKET_MAX_IN_FLIGHT = int(os.getenv("TOKEN_SOCKET_MAX_IN_FLIGHT", "1024"))
+TOKEN_SOCKET_MAX_CONNECTIONS = int(os.getenv("TOKEN_SOCKET_MAX_CONNECTIONS", "256"))
+
+OP_PING, OP_VALIDATE, OP_CLAIMS = 0, 1, 2
+STATUS_OK, STATUS_INVALID_TOKEN, STATUS_INACTIVE, STATUS_BAD_REQUEST, STATUS_ERROR = range(5)
+FLAG_ACTIVE, FLAG_VERIFIED, FLAG_SUPERUSER = 1, 2, 4
+
+_LENGTH = struct.Struct(">I")
+_REQUEST_HEADER = struct.Struct(">BI")
+_RESPONSE_HEADER = struct.Struct(">IBI")
+_VALIDATED = struct.Struct(">16sQ")
+_CLAIMS = struct.Struct(">16sQBI")
+# Tokens are a few hundred bytes; anything much larger is not a request of ours
+_MAX_FRAME = 8192
+_CLAIM_COLUMNS = (User.id, User.email, User.is_active, User.is_verified, User.is_superuser, User.role, User.profile_version)
+_READ_SIZE = 65536
+
+
+def _response(status: int, request_id: int, body: bytes = b"") -> bytes:
+    return _RESPONSE_HEADER.pack(_REQUEST_HEADER.size + len(body), status, request_id) + body
+
+
+def _claims_body(user, expires_at: Optional[float]) -> bytes:
+    flags = (FLAG_ACTIVE if user.is_active else 0) | (FLAG_VERIFIED if user.is_verified else 0) \
+        | (FLAG_SUPERUSER if user.is_superuser else 0)
+    role = (user.role or "").encode()[:255]
+    email = user.email.encode()
+    return (
+        _CLAIMS.pack(user.id.bytes, int(expires_at or 0), flags, user.profile_version or 0)
+        + bytes((len(role),)) + role
+        + struct.pack(">H", len(email)) + email
+    )
+
+
+class UserClaimsResolver:
+    """Loads users' claim columns by id, one query per event loop turn for all lookups made in it."""
+
+    def __init__(self):
+        self._pending: dict[uuid.UUID, asyncio.Future] = {}
+        self._scheduled = False
+        self._loads: set[asyncio.Task] = set()
+        self.queries = 0
+        self.lookups = 0
+
+    def lookup(self, user_id: uuid.UUID) -> asyncio.Future:
+        self.lookups += 1
+        future = self._pending.get(user_id)
+        if future is None:
+            future = self._pending[user_id] = asyncio.get_running_loop().create_future()
+            if not self._scheduled:
+                self._scheduled = True
+                # Runs after the callbacks already queued, i.e. after the rest of this batch was parsed
+                asyncio.get_running_loop().call_soon(self._flush)
+        return future
+
+    def _flush(self) -> None:
+        self._scheduled = False
+        batch, self._pending = self._pending, {}
+        load = asyncio.ensure_future(self._load(batch))
+        self._loads.add(load)
+        load.add_done_callback(self._loads.discard)
+
+    async def _load(self, batch: dict[uuid.UUID, asyncio.Future]) -> None:
+        self.queries += 1
+        try:
+            async with async_session_maker() as session:
+                # Only the claim columns: no ORM objects, no eager-loaded OAuth accounts
+                users = (await session.execute(select(*_CLAIM_COLUMNS).where(User.id.in_(list(batch))))).all()
+        except Exception as e:
+            for future in batch.values():
+                if not future.done():
+                    future.set_exception(e)
+            return
+        found = {user.id: user for user in users}
+        for user_id, future in batch.items():
+            if not future.done():
+                future.set_result(found.get(user_id))
+
+
+class TokenSocketServer:
+    def __init__(self, path: str = TOKEN_SOCKET_PATH, host: str = TOKEN_SOCKET_HOST, port: int = TOKEN_SOCKET_PORT,
+                 max_in_flight: int = TOKEN_SOCKET_MAX_IN_FLIGHT, max_connections: int = TOKEN_SOCKET_MAX_CONNECTIONS):
+        self.path = path
+        self.host = host
+        self.port = port
+        self.max_in_flight = max_in_flight
+        self.max_connections = max_connections
+        self.resolver = UserClaimsResolver()
+        self._servers: list[asyncio.AbstractServer] = []
+        self._owns_path = False
+        self._connections: set[asyncio.Task] = set()
+        self.requests = 0
+        self.rejected_connections = 0
+        self.errors = 0
+
+    async def _claims(self, token: str, request_id: int) -> bytes:
+        claims = jwt_strategy.verified_claims(token)
+        if claims is None:
+            return _response(STATUS_INVALID_TOKEN, request_id)
+        subject, expires_at = claims
+        if SHARD_DATABASE_URLS:
+            # The user lives on a shard: resolve it the way the auth backend does
+            user = await active_user_from_token(token)
+        else:
+            try:
+                # Shielded: the lookup is shared with other requests for the same user
+                user = await asyncio.shield(self.resolver.lookup(uuid.UUID(subject)))
+            except ValueError:
+                return _response(STATUS_INVALID_TOKEN, request_id)
+        if user is None or not user.is_active:
+            return _response(STATUS_INACTIVE, request_id)
+        activity_tracker.touch(user.id)
+        return _response(STATUS_OK, request_id, _claims_body(user, expires_at))
+
+    async def _answer_claims(self, token: str, request_id: int, writer: asyncio.StreamWriter,
+                             slots: asyncio.Semaphore) -> None:
+        try:
+            frame = await self._claims(token, request_id)
+        except Exception as e:
+            self.errors += 1
+            print(f"❌ Token socket claims lookup failed: {type(e).__name__} - {str(e)}")
+            frame = _response(STATUS_ERROR, request_id)
+        finally:
+            slots.release()
+        if not writer.is_closing():
+            writer.write(frame)
+
+    def _validate(self, token: str, request_id: int) -> bytes:
+        # Signature and expiry only; the user's is_active is not checked (see CLAIMS)
+        claims = jwt_strategy.verified_claims(token)
+        if claims is None:
+            return _response(STATUS_INVALID_TOKEN, request_id)
+        subject, expires_at = claims
+        try:
+            user_id = uuid.UUID(subject)
+        except ValueError:
+            return _response(STATUS_INVALID_TOKEN, request_id)
+        return _response(STATUS_OK, request_id, _VALIDATED.pack(user_id.bytes, int(expires_at or 0)))
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        slots = asyncio.Semaphore(self.max_in_flight)
+        pending: set[asyncio.Task] = set()
+        buffer = bytearray()
+        try:
+            while True:
+                data = await reader.read(_READ_SIZE)
+                if not data:
+                    break
+                buffer.extend(data)
+                offset = 0
+                # Every complete frame in the buffer is answered before the next read
+                while len(buffer) - offset >= _LENGTH.size:
+                    (length,) = _LENGTH.unpack_from(buffer, offset)
+                    if length < _REQUEST_HEADER.size or length > _MAX_FRAME:
+                        writer.write(_response(STATUS_BAD_REQUEST, 0))
+                        await writer.drain()
+                        return
+                    end = offset + _LENGTH.size + length
+                    if len(buffer) < end:
+                        break
+                    op, request_id = _REQUEST_HEADER.unpack_from(buffer, offset + _LENGTH.size)
+                    token = buffer[offset + _LENGTH.size + _REQUEST_HEADER.size:end].decode("utf-8", "replace")
+                    offset = end
+                    self.requests += 1
+                    if op == OP_VALIDATE:
+                        writer.write(self._validate(token, request_id))
+                    elif op == OP_CLAIMS:
+                        await slots.acquire()
+                        task = asyncio.create_task(self._answer_claims(token, request_id, writer, slots))
+                        pending.add(task)
+                        task.add_done_callback(pending.discard)
+                    elif op == OP_PING:
+                        writer.write(_response(STATUS_OK, request_id))
+                    else:
+                        writer.write(_response(STATUS_BAD_REQUEST, request_id))
+                        await writer.drain()
+                        return
+                del buffer[:offset]
+                await writer.drain()
+            if pending:
+                # The client half-closed: answer what it already asked
+                await asyncio.gather(*pending, return_exceptions=True)
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            for task in pending:
+                task.cancel()
+            writer.close()
+
+    async def _accept(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        if len(self._connections) >= self.max_connections:
+            self.rejected_connections += 1
+            writer.close()
+            return
+        task = asyncio.current_task()
+        self._connections.add(task)
+        try:
+            await self._serve(reader, writer)
+        finally:
+            self._connections.discard(task)
+
+    async def _unix_socket_in_use(self) -> bool:
+        try:
+            _, writer = await asyncio.open_unix_connection(self.path)
+        except OSError:
+            return False
+        writer.close()
+        return True
+
+    async def start(self) -> None:
+        if self._servers:
+            return
+        if self.path:
+            if await self._unix_socket_in_use():
+                print(f"🔌 Token socket {self.path} is served by another worker")
+            else:
+                if os.path.exists(self.path):
+                    # Left over from a worker that did not shut down cleanly
+                    os.unlink(self.path)
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._servers.append(await asyncio.start_unix_server(self._accept, path=self.path))
+                self._owns_path = True
+                os.chmod(self.path, 0o660)
+                print(f"🔌 Token validation listening on unix:{self.path}")
+        if self.port:
+            self._servers.append(await asyncio.start_server(
+                self._accept, host=self.host, port=self.port, reuse_port=hasattr(socket, "SO_REUSEPORT"),
+            ))
+            print(f"🔌 Token validation listening on {self.host}:{self.port}")
+
+    async def stop(self) -> None:
+        for server in self._servers:
+            server.close()
+        for task in list(self._connections):
+            task.cancel()
+        await asyncio.gather(*self._connections, return_exceptions=True)
+        for server in self._servers:
+            await server.wait_closed()
+        if self._owns_path:
+            try:
+                os.unlink(self.path)
+            except OSError:
+                pass
+            self._owns_path = False
+        self._servers = []
+
+    def stats(self) -> dict:
+        return {
+            "listening": [str(sock.getsockname()) for server in self._servers for sock in server.sockets],
+            "connections": len(self._connections),
+            "rejected_connections": self.rejected_connections,
+            "requests": self.requests,
+            "claims_lookups": self.resolver.lookups,
+            "claims_queries": self.resolver.queries,
+            "errors": self.errors,
+        }
+
+
+token_socket_server = TokenSocketServer()
+
+
+class TokenSocketClient:
+    """
+    Pipelining client for the listener (used by benchmarks/token_socket.py;
+    backend/src/services/authSocket.service.js is the Node equivalent).
+    """
+
+    def __init__(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._reader = reader
+        self._writer = writer
+        self._next_id = 0
+        self._waiting: dict[int, asyncio.Future] = {}
+        self._receiver = asyncio.create_task(self._receive())
+
+    @classmethod
+    async def connect(cls, path: str = "", host: str = "127.0.0.1", port: int = 0) -> "TokenSocketClient":
+        if path:
+            reader, writer = await asyncio.open_unix_connection(path)
+        else:
+            reader, writer = await asyncio.open_connection(host, port)
+        return cls(reader, writer)
+
+    async def _receive(self) -> None:
+        try:
+            while True:
+                (length,) = _LENGTH.unpack(await self._reader.readexactly(_LENGTH.size))
+                frame = await self._reader.readexactly(length)
+                status, request_id = _REQUEST_HEADER.unpack_from(frame)
+                waiting = self._waiting.pop(request_id, None)
+                if waiting is not None and not waiting.done():
+                    waiting.set_result((status, frame[_REQUEST_HEADER.size:]))
+        except (asyncio.IncompleteReadError, ConnectionError) as e:
+            for waiting in self._waiting.values():
+                if not waiting.done():
+                    waiting.set_exception(ConnectionError(f"Token socket closed: {e}"))
+            self._waiting.clear()
+
+    def send(self, op: int, token: str = "") -> asyncio.Future:
+        """Queue a request without waiting for earlier answers; the future resolves to (status, body)."""
+        self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+        future = asyncio.get_running_loop().create_future()
+        self._waiting[self._next_id] = future
+        payload = token.encode()
+        self._writer.write(_LENGTH.pack(_REQUEST_HEADER.size + len(payload)) + _REQUEST_HEADER.pack(op, self._next_id) + payload)
+        return future
+
+    async def request(self, op: int, token: str = "") -> tuple[int, bytes]:
+        future = self.send(op, token)
+        await self._writer.drain()
+        return await future
+
+    async def validate(self, token: str) -> Optional[tuple[uuid.UUID, int]]:
+        status, body = await self.request(OP_VALIDATE, token)
+        if status != STATUS_OK:
+            return None
+        user_id, expires_at = _VALIDATED.unpack(body)
+        return uuid.UUID(bytes=user_id), expires_at
+
+    async def claims(self, token: str) -> Optional[dict]:
+        status, body = await self.request(OP_CLAIMS, token)
+        return decode_claims(body) if status == STATUS_OK else None
+
+    async def close(self) -> None:
+        self._writer.close()
+        self._receiver.cancel()
+        await asyncio.gather(self._receiver, return_exceptions=True)
+
+
+def decode_claims(body: bytes) -> dict:
+    user_id, expires_at, flags, profile_version = _CLAIMS.unpack_from(body)
+    offset = _CLAIMS.size
+    role = body[offset + 1:offset + 1 + body[offset]].decode()
+    offset += 1 + body[offset]
+    (email_length,) = struct.unpack_from(">H", body, offset)
+    email = body[offset + 2:offset + 2 + email_length].decode()
+    return {
+        "id": uuid.UUID(bytes=user_id),
+        "exp": expires_at or None,
+        "is_active": bool(flags & FLAG_ACTIVE),
+        "is_verified": bool(flags & FLAG_VERIFIED),
+        "is_superuser": bool(flags & FLAG_SUPERUSER),
+        "profile_version": profile_version,
+        "role": role,
+        "email": email,
+    }
@@ -0,0 +1,490 @@
+"""
+Request tracing with W3C trace context.
+
+TracingMiddleware opens a server span per HTTP request, continuing the trace of
+an incoming `traceparent` header (from the Node backend, a proxy or the
+browser) or starting a new one, and answers with a `traceresponse` header
+carrying the trace id. Inside a sampled request:
+
+- every SQL statement on the instrumented engines is a span (instrument_engine),
+- every outbound httpx call made through traced_transport() is a span and
+  carries `traceparent`/`tracestate` to the provider,
+- password hashing/verification, SMTP sends and anything wrapped in span()
+  are spans.
+
+Sampling is decided once per trace, at its root: a sampled or unsampled
+parent is followed, otherwise TRACING_SAMPLE_RATE of new traces (by trace id,
+so every service taking the same decision keeps the same traces) are recorded.
+Unsampled requests only carry the ids for propagation: span() costs one
+context variable lookup. Background work (the email outbox relay) has no
+request; its SMTP sends start traces of their own under the same sampling.
+
+Finished spans are buffered in memory and exported every
+TRACING_EXPORT_INTERVAL seconds from a thread, either as JSON lines to
+TRACING_FILE_PATH or as OTLP/HTTP JSON to TRACING_OTLP_ENDPOINT (an
+OpenTelemetry collector, Jaeger or Tempo). When the buffer is full spans are
+dropped and counted. Only installed when TRACING_ENABLED=true.
+"""
+import asyncio
+import functools
+import json
+import os
+import random
+import re
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Optional, Union
+
+import httpx
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from sql_instrumentation import normalize_statement
+from traffic_capture import route_template
+
+TRACING_ENABLED = os.getenv("TRACING_ENABLED", "false").lower() == "true"
+# Share of new traces recorded; traces continued from a parent follow the parent's decision
+TRACING_SAMPLE_RATE = float(os.getenv("TRACING_SAMPLE_RATE", "0.01"))
+# "file" (JSON lines) or "otlp" (OTLP/HTTP JSON)
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "file")
+TRACING_FILE_PATH = os.getenv("TRACING_FILE_PATH", "/tmp/finity-auth-traces-{pid}.jsonl")
+TRACING_OTLP_ENDPOINT = os.getenv("TRACING_OTLP_ENDPOINT", "http://localhost:4318/v1/traces")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "finity-auth")
+TRACING_EXPORT_INTERVAL = float(os.getenv("TRACING_EXPORT_INTERVAL", "5"))
+TRACING_BUFFER_SIZE = int(os.getenv("TRACING_BUFFER_SIZE", "20000"))
+
+_TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?$")
+_INVALID_TRACE_ID = "0" * 32
+_INVALID_SPAN_ID = "0" * 16
+_MAX_STATEMENT_LENGTH = 2000
+# OTLP span kinds
+_KINDS = {"internal": 1, "server": 2, "client": 3}
+
+
+def _new_trace_id() -> str:
+    return f"{random.getrandbits(128):032x}"
+
+
+def _new_span_id() -> str:
+    return f"{random.getrandbits(64):016x}"
+
+
+def _sampled(trace_id: str, rate: float) -> bool:
+    # Decided from the low 56 bits of the trace id, like OpenTelemetry's TraceIdRatioBased
+    return rate >= 1.0 or int(trace_id[-14:], 16) < rate * (1 << 56)
+
+
+class TraceContext:
+    """Ids of a trace position that is propagated but not recorded (unsampled)."""
+
+    __slots__ = ("trace_id", "span_id", "sampled", "tracestate")
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool, tracestate: Optional[str] = None):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+        self.tracestate = tracestate
+
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(header: Optional[str], tracestate: Optional[str] = None) -> Optional[TraceContext]:
+    """The parent in a W3C traceparent header, or None if it is missing or malformed."""
+    match = _TRACEPARENT.match((header or "").strip().lower())
+    if match is None:
+        return None
+    version, trace_id, span_id, flags, rest = match.groups()
+    if version == "ff" or (version == "00" and rest) or trace_id == _INVALID_TRACE_ID or span_id == _INVALID_SPAN_ID:
+        return None
+    return TraceContext(trace_id, span_id, bool(int(flags, 16) & 1), tracestate)
+
+
+class Span(TraceContext):
+    """A recorded operation; finished spans are handed to the tracer for export."""
+
+    __slots__ = ("name", "kind", "parent_id", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, name: str, kind: str, trace_id: str, parent_id: Optional[str],
+                 attributes: Optional[dict] = None, tracestate: Optional[str] = None):
+        super().__init__(trace_id, _new_span_id(), True, tracestate)
+        self.name = name
+        self.kind = kind
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+        self.attributes = attributes or {}
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def record_exception(self, exception: BaseException) -> None:
+        self.error = f"{type(exception).__name__}: {str(exception)[:200]}"
+        self.attributes["exception.type"] = type(exception).__name__
+
+    def end(self) -> None:
+        if not self.end_ns:
+            self.end_ns = time.time_ns()
+            tracer.finished(self)
+
+    def to_record(self) -> dict:
+        record = {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "kind": self.kind,
+            "start": self.start_ns / 1e9,
+            "duration_ms": round((self.end_ns - self.start_ns) / 1e6, 3),
+            "attributes": self.attributes,
+        }
+        if self.error:
+            record["error"] = self.error
+        return record
+
+    def to_otlp(self) -> dict:
+        otlp = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": _KINDS[self.kind],
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 0},
+        }
+        if self.parent_id:
+            otlp["parentSpanId"] = self.parent_id
+        return otlp
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+_current: ContextVar[Optional[Union[Span, TraceContext]]] = ContextVar("trace_current", default=None)
+
+
+def current_span() -> Optional[Span]:
+    """The span being recorded in this context, or None when the context is not sampled."""
+    current = _current.get()
+    return current if isinstance(current, Span) else None
+
+
+def start_span(name: str, kind: str = "internal", attributes: Optional[dict] = None, root: bool = False) -> Optional[Span]:
+    """A child of the current span, or None if the current trace is not sampled. The caller ends it."""
+    parent = _current.get()
+    if parent is None:
+        if not root or not TRACING_ENABLED:
+            return None
+        trace_id = _new_trace_id()
+        return Span(name, kind, trace_id, None, attributes) if _sampled(trace_id, TRACING_SAMPLE_RATE) else None
+    if not parent.sampled:
+        return None
+    return Span(name, kind, parent.trace_id, parent.span_id, attributes, parent.tracestate)
+
+
+@contextmanager
+def span(name: str, kind: str = "internal", root: bool = False, **attributes):
+    """
+    Record the enclosed block as a span of the current trace; yields the Span, or None when not sampled.
+    With root=True, work outside any request starts its own (sampled) trace.
+    """
+    recording = start_span(name, kind, attributes, root)
+    if recording is None:
+        yield None
+        return
+    token = _current.set(recording)
+    try:
+        yield recording
+    except BaseException as e:
+        recording.record_exception(e)
+        raise
+    finally:
+        _current.reset(token)
+        recording.end()
+
+
+def traced(name: str, kind: str = "internal", root: bool = False):
+    """Decorator form of span() for sync and async functions."""
+    def decorate(function):
+        if asyncio.iscoroutinefunction(function):
+            @functools.wraps(function)
+            async def async_wrapper(*args, **kwargs):
+                with span(name, kind, root):
+                    return await function(*args, **kwargs)
+            return async_wrapper
+
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            with span(name, kind, root):
+                return function(*args, **kwargs)
+        return wrapper
+    return decorate
+
+
+def propagation_headers() -> dict:
+    """traceparent/tracestate for an outbound request, continuing the current trace (empty outside one)."""
+    current = _current.get()
+    if current is None:
+        return {}
+    headers = {"traceparent": current.traceparent()}
+    if current.tracestate:
+        headers["tracestate"] = current.tracestate
+    return headers
+
+
+class FileSpanExporter:
+    """Appends one JSON line per span."""
+
+    def __init__(self, path: str = TRACING_FILE_PATH):
+        self.path = path.replace("{pid}", str(os.getpid()))
+
+    def export(self, spans: list[Span]) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(self.path, "a") as output:
+            output.write("".join(json.dumps(s.to_record(), separators=(",", ":"), default=str) + "\n" for s in spans))
+
+    def close(self) -> None:
+        pass
+
+
+class OTLPSpanExporter:
+    """Posts spans to an OTLP/HTTP collector in the JSON encoding."""
+
+    def __init__(self, endpoint: str = TRACING_OTLP_ENDPOINT, service_name: str = TRACING_SERVICE_NAME):
+        self.endpoint = endpoint
+        self.resource = {"attributes": [
+            _otlp_attribute("service.name", service_name),
+            _otlp_attribute("process.pid", os.getpid()),
+        ]}
+        self._client = httpx.Client(timeout=10)
+
+    def export(self, spans: list[Span]) -> None:
+        payload = {"resourceSpans": [{
+            "resource": self.resource,
+            "scopeSpans": [{"scope": {"name": "finity-auth.tracing"}, "spans": [s.to_otlp() for s in spans]}],
+        }]}
+        self._client.post(self.endpoint, json=payload).raise_for_status()
+
+    def close(self) -> None:
+        self._client.close()
+
+
+class Tracer:
+    """Buffers finished spans and exports them in batches from a worker thread."""
+
+    def __init__(self, buffer_size: int = TRACING_BUFFER_SIZE, export_interval: float = TRACING_EXPORT_INTERVAL):
+        self.export_interval = export_interval
+        self.exporter = None
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._task: Optional[asyncio.Task] = None
+        self.exported = 0
+        self.dropped = 0
+        self.export_failures = 0
+
+    def finished(self, finished_span: Span) -> None:
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+            return
+        self._buffer.append(finished_span)
+
+    async def _flush(self) -> None:
+        spans = []
+        while self._buffer:
+            spans.append(self._buffer.popleft())
+        if not spans or self.exporter is None:
+            return
+        try:
+            await asyncio.to_thread(self.exporter.export, spans)
+            self.exported += len(spans)
+        except (OSError, httpx.HTTPError) as e:
+            self.export_failures += 1
+            self.dropped += len(spans)
+            print(f"⚠️  Trace export failed, {len(spans)} spans dropped: {type(e).__name__} - {str(e)}")
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.export_interval)
+            await self._flush()
+
+    def start(self) -> None:
+        if not TRACING_ENABLED or self._task is not None:
+            return
+        self.exporter = OTLPSpanExporter() if TRACING_EXPORTER == "otlp" else FileSpanExporter()
+        self._task = asyncio.create_task(self._run())
+        target = self.exporter.endpoint if TRACING_EXPORTER == "otlp" else self.exporter.path
+        print(f"🧭 Tracing {TRACING_SAMPLE_RATE:.1%} of new traces to {target}")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self._flush()
+        self.exporter.close()
+
+    def stats(self) -> dict:
+        return {
+            "enabled": TRACING_ENABLED,
+            "sample_rate": TRACING_SAMPLE_RATE,
+            "exporter": TRACING_EXPORTER if TRACING_ENABLED else None,
+            "buffered": len(self._buffer),
+            "exported": self.exported,
+            "dropped": self.dropped,
+            "export_failures": self.export_failures,
+        }
+
+
+tracer = Tracer()
+
+
+class TracingMiddleware:
+    """Opens the server span of each HTTP request and continues/returns W3C trace context."""
+
+    def __init__(self, app, sample_rate: float = TRACING_SAMPLE_RATE):
+        self.app = app
+        self.sample_rate = sample_rate
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        tracestate = headers.get(b"tracestate", b"").decode("latin-1") or None
+        parent = parse_traceparent(headers.get(b"traceparent", b"").decode("latin-1"), tracestate)
+        if parent is not None:
+            trace_id, parent_id, sampled = parent.trace_id, parent.span_id, parent.sampled
+        else:
+            trace_id, parent_id = _new_trace_id(), None
+            sampled = _sampled(trace_id, self.sample_rate)
+
+        if not sampled:
+            context = TraceContext(trace_id, _new_span_id(), False, tracestate)
+            token = _current.set(context)
+            try:
+                await self.app(scope, receive, self._responding(send, context))
+            finally:
+                _current.reset(token)
+            return
+
+        server_span = Span(f"{scope['method']} {scope['path']}", "server", trace_id, parent_id, {
+            "http.request.method": scope["method"],
+            "url.path": scope["path"],
+        }, tracestate)
+        token = _current.set(server_span)
+        status = {"code": 0}
+        try:
+            await self.app(scope, receive, self._responding(send, server_span, status))
+        except BaseException as e:
+            server_span.record_exception(e)
+            raise
+        finally:
+            _current.reset(token)
+            route = route_template(scope)
+            if route != "<unmatched>":
+                server_span.name = f"{scope['method']} {route}"
+                server_span.attributes["http.route"] = route
+            server_span.attributes["http.response.status_code"] = status["code"]
+            if status["code"] >= 500 and server_span.error is None:
+                server_span.error = f"HTTP {status['code']}"
+            server_span.end()
+
+    @staticmethod
+    def _responding(send, context: TraceContext, status: Optional[dict] = None):
+        async def send_with_trace(message):
+            if message["type"] == "http.response.start":
+                if status is not None:
+                    status["code"] = message["status"]
+                # W3C Trace Context level 2: lets the caller find this request's trace
+                message["headers"] = [*message.get("headers", []), (b"traceresponse", context.traceparent().encode())]
+            await send(message)
+        return send_with_trace
+
+
+class TracingTransport(httpx.AsyncBaseTransport):
+    """httpx transport that records each request as a client span and propagates the trace to the server."""
+
+    def __init__(self, transport: Optional[httpx.AsyncBaseTransport] = None):
+        self.transport = transport or httpx.AsyncHTTPTransport()
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        with span(f"{request.method} {request.url.host}", "client", **{
+            "http.request.method": request.method,
+            "server.address": request.url.host,
+            "url.path": request.url.path,
+        }) as client_span:
+            # Inside the span, so the provider sees the client span as its parent
+            request.headers.update(propagation_headers())
+            response = await self.transport.handle_async_request(request)
+            if client_span is not None:
+                client_span.set_attribute("http.response.status_code", response.status_code)
+                if response.status_code >= 500:
+                    client_span.error = f"HTTP {response.status_code}"
+            return response
+
+    async def aclose(self) -> None:
+        await self.transport.aclose()
+
+
+def traced_transport() -> Optional[httpx.AsyncBaseTransport]:
+    """Transport for httpx.AsyncClient(transport=...): traced when tracing is on, httpx's default otherwise."""
+    return TracingTransport() if TRACING_ENABLED else None
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statement_span = start_span("db.query", "client")
+    if statement_span is not None:
+        normalized = normalize_statement(statement)
+        statement_span.name = f"db {normalized.split(' ', 1)[0].upper()}"
+        statement_span.attributes.update({
+            "db.system": conn.dialect.name,
+            # Literals and parameters are stripped, so no user data ends up in the trace
+            "db.statement": normalized[:_MAX_STATEMENT_LENGTH],
+        })
+        if executemany:
+            statement_span.attributes["db.executemany"] = True
+    conn.info.setdefault("trace_spans", []).append(statement_span)
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    statement_span = conn.info["trace_spans"].pop()
+    if statement_span is not None:
+        statement_span.attributes["db.rows"] = getattr(cursor, "rowcount", -1)
+        statement_span.end()
+
+
+def _handle_error(exception_context):
+    conn = exception_context.connection
+    if conn is not None and conn.info.get("trace_spans"):
+        statement_span = conn.info["trace_spans"].pop()
+        if statement_span is not None:
+            statement_span.record_exception(exception_context.original_exception)
+            statement_span.end()
+
+
+def instrument_engine(engine: Engine) -> None:
+    """Record each statement on a (sync) engine as a span. Safe to call more than once."""
+    if event.contains(engine, "before_cursor_execute", _before_cursor_execute):
+        return
+    event.listen(engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(engine, "handle_error", _handle_error)
@@ -0,0 +1,303 @@
+"""
+Opt-in capture of production request shapes for replay (testing/replay.py).
+
+TrafficCaptureMiddleware records one compact JSON line per request: arrival
+time, method, route template, status, duration and response size, plus just
+enough shape to replay the request against a local instance:
+
+- query parameter names (values only for a few harmless ones, e.g. limit),
+  and path parameter values only for the OAuth provider,
+- the field names of JSON/form bodies, never their values,
+- which of a few headers were present (Authorization, If-None-Match, ...),
+- an actor: a salted hash of the token's subject or the email in the body,
+  so the replay can give each client its own user without knowing who it was.
+
+Tokens, passwords, emails, OAuth codes and all other values are never written.
+The salt is random per worker and kept in memory only, so actors cannot be
+correlated across captures.
+
+Records go to an in-memory buffer; a background task appends them to
+TRAFFIC_CAPTURE_PATH ("{pid}" is replaced by the worker's pid, ".gz" gzips)
+from a thread, so requests never wait on disk. When the buffer is full
+records are dropped and counted. Only installed when TRAFFIC_CAPTURE_PATH is set.
+"""
+import asyncio
+import gzip
+import hashlib
+import json
+import os
+import random
+import secrets
+import time
+from collections import deque
+from typing import Optional
+from urllib.parse import parse_qs
+
+import jwt
+
+# Where to write the capture; unset disables capturing
+TRAFFIC_CAPTURE_PATH = os.getenv("TRAFFIC_CAPTURE_PATH", "")
+# Fraction of actors (clients) captured; a sampled client's requests are all captured
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", "1.0"))
+TRAFFIC_CAPTURE_MAX_MB = float(os.getenv("TRAFFIC_CAPTURE_MAX_MB", "200"))
+TRAFFIC_CAPTURE_BUFFER_SIZE = int(os.getenv("TRAFFIC_CAPTURE_BUFFER_SIZE", "20000"))
+TRAFFIC_CAPTURE_FLUSH_INTERVAL = float(os.getenv("TRAFFIC_CAPTURE_FLUSH_INTERVAL", "2"))
+CAPTURE_FORMAT_VERSION = 1
+
+# Bodies larger than this are not inspected (their shape is recorded as unknown)
+_MAX_BODY_BYTES = 64 * 1024
+# Query parameters whose values are kept; all others are recorded by name only
+SAFE_QUERY_PARAMS = {"limit", "cursor", "sort", "order", "role", "is_active", "is_verified", "page", "page_size"}
+# Path parameters whose values are kept (the rest stay as {name} in the route template)
+SAFE_PATH_PARAMS = {"provider"}
+# Request headers whose presence (never value) is recorded
+NOTED_HEADERS = {
+    b"authorization": "auth",
+    b"if-none-match": "inm",
+    b"x-events-token": "evt",
+    b"last-event-id": "lei",
+    b"idempotency-key": "idem",
+}
+_EMAIL_FIELDS = ("username", "email")
+
+
+def route_template(scope) -> str:
+    """The request path with path parameters put back as {name} (route.path lacks router prefixes)."""
+    if "endpoint" not in scope:
+        # Unmatched (404) paths are collapsed so random probes do not blow up the route count
+        return "<unmatched>"
+    segments = scope["path"].split("/")
+    names = {str(value): name for name, value in scope.get("path_params", {}).items()}
+    return "/".join(f"{{{names[segment]}}}" if segment in names else segment for segment in segments)
+
+
+def _body_fields(content_type: str, body: bytes) -> tuple[Optional[str], list[str], Optional[str]]:
+    """(kind, field names, email) of a JSON or form body. The email is only used to derive the actor."""
+    if not body:
+        return None, [], None
+    if len(body) > _MAX_BODY_BYTES:
+        return "large", [], None
+    try:
+        if content_type.startswith("application/json"):
+            data = json.loads(body)
+            kind = "json"
+        elif content_type.startswith("application/x-www-form-urlencoded"):
+            data = {key: values[0] for key, values in parse_qs(body.decode(), keep_blank_values=True).items()}
+            kind = "form"
+        else:
+            return "other", [], None
+    except (ValueError, UnicodeDecodeError):
+        return "invalid", [], None
+    if not isinstance(data, dict):
+        return kind, [], None
+    email = next((data[field] for field in _EMAIL_FIELDS if isinstance(data.get(field), str)), None)
+    return kind, sorted(data), email
+
+
+def _token_subject(authorization: bytes) -> Optional[str]:
+    scheme, _, token = authorization.decode("latin-1").partition(" ")
+    if scheme.lower() != "bearer" or not token:
+        return None
+    try:
+        # Only used to group requests by client: the signature is checked by the auth backend, not here
+        return jwt.decode(token, options={"verify_signature": False}).get("sub")
+    except jwt.PyJWTError:
+        return None
+
+
+class TrafficRecorder:
+    """Buffers capture records and appends them to disk from a worker thread."""
+
+    def __init__(
+        self,
+        path: str = TRAFFIC_CAPTURE_PATH,
+        sample_rate: float = TRAFFIC_CAPTURE_SAMPLE_RATE,
+        max_bytes: int = int(TRAFFIC_CAPTURE_MAX_MB * 1024 * 1024),
+        buffer_size: int = TRAFFIC_CAPTURE_BUFFER_SIZE,
+        flush_interval: float = TRAFFIC_CAPTURE_FLUSH_INTERVAL,
+    ):
+        self.path = path.replace("{pid}", str(os.getpid()))
+        self.sample_rate = sample_rate
+        self.max_bytes = max_bytes
+        self.flush_interval = flush_interval
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._salt = secrets.token_bytes(16)
+        self._file = None
+        self._task: Optional[asyncio.Task] = None
+        self.started_at = 0.0
+        self.bytes_written = 0
+        self.recorded = 0
+        self.dropped = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def actor(self, identity: str) -> Optional[str]:
+        """Salted short hash of a client identity, or None if the client is not sampled."""
+        digest = hashlib.blake2b(identity.encode(), key=self._salt, digest_size=8).digest()
+        if int.from_bytes(digest[:4], "big") / 0xFFFFFFFF >= self.sample_rate:
+            return None
+        return digest.hex()
+
+    def sampled_anonymous(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def record(self, entry: dict) -> None:
+        if not self.running or self.bytes_written >= self.max_bytes:
+            return
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+            return
+        entry["t"] = round((time.time() - self.started_at) * 1000)
+        self._buffer.append(entry)
+
+    def _open(self) -> None:
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = gzip.open(self.path, "at") if self.path.endswith(".gz") else open(self.path, "a")
+        header = {"capture": CAPTURE_FORMAT_VERSION, "start": self.started_at, "pid": os.getpid()}
+        self._write([header])
+
+    def _write(self, entries: list[dict]) -> None:
+        data = "".join(json.dumps(entry, separators=(",", ":")) + "\n" for entry in entries)
+        self._file.write(data)
+        self._file.flush()
+        self.bytes_written += len(data)
+
+    async def _flush(self) -> None:
+        entries = []
+        while self._buffer:
+            entries.append(self._buffer.popleft())
+        if entries:
+            await asyncio.to_thread(self._write, entries)
+            self.recorded += len(entries)
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self._flush()
+            except OSError as e:
+                print(f"⚠️  Traffic capture write failed: {type(e).__name__} - {str(e)}")
+
+    async def start(self) -> None:
+        if not self.path or self._task is not None:
+            return
+        self.started_at = time.time()
+        await asyncio.to_thread(self._open)
+        self._task = asyncio.create_task(self._run())
+        print(f"🎥 Capturing traffic to {self.path} (sample rate {self.sample_rate})")
+
+    async def stop(self) -> None:
+        if self._task is None:
+            return
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        await self._flush()
+        await asyncio.to_thread(self._file.close)
+        self._file = None
+        print(f"🎥 Traffic capture stopped: {self.recorded} requests recorded, {self.dropped} dropped")
+
+    def stats(self) -> dict:
+        return {
+            "path": self.path,
+            "running": self.running,
+            "recorded": self.recorded,
+            "buffered": len(self._buffer),
+            "dropped": self.dropped,
+            "bytes_written": self.bytes_written,
+            "max_bytes": self.max_bytes,
+        }
+
+
+traffic_recorder = TrafficRecorder()
+
+
+class TrafficCaptureMiddleware:
+    """Records the shape and timing of every (sampled) HTTP request."""
+
+    def __init__(self, app, recorder: TrafficRecorder = traffic_recorder):
+        self.app = app
+        self.recorder = recorder
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not self.recorder.running:
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope["headers"])
+        content_type = headers.get(b"content-type", b"").decode("latin-1").lower()
+        inspect_body = content_type.startswith(("application/json", "application/x-www-form-urlencoded"))
+        body = bytearray()
+        response = {"status": 0, "bytes": 0, "stream": False}
+
+        async def receive_and_keep():
+            message = await receive()
+            if inspect_body and message["type"] == "http.request" and len(body) <= _MAX_BODY_BYTES:
+                body.extend(message.get("body", b""))
+            return message
+
+        async def send_and_measure(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                for name, value in message.get("headers", []):
+                    if name == b"content-type" and value.startswith(b"text/event-stream"):
+                        response["stream"] = True
+            elif message["type"] == "http.response.body":
+                response["bytes"] += len(message.get("body", b""))
+            await send(message)
+
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive_and_keep, send_and_measure)
+        finally:
+            duration_ms = (time.perf_counter() - started) * 1000
+            try:
+                self._record(scope, headers, content_type, bytes(body), response, duration_ms)
+            except Exception as e:
+                print(f"⚠️  Traffic capture skipped a request: {type(e).__name__} - {str(e)}")
+
+    def _record(self, scope, headers: dict, content_type: str, body: bytes, response: dict, duration_ms: float) -> None:
+        kind, fields, email = _body_fields(content_type, body)
+        subject = _token_subject(headers[b"authorization"]) if b"authorization" in headers else None
+        identity = f"u:{subject}" if subject else f"e:{email.strip().lower()}" if email else None
+        if identity is not None:
+            actor = self.recorder.actor(identity)
+            if actor is None:
+                return
+        elif not self.recorder.sampled_anonymous():
+            return
+        else:
+            actor = None
+
+        entry = {
+            "m": scope["method"],
+            "r": route_template(scope),
+            "s": response["status"],
+            "d": round(duration_ms, 2),
+            "n": response["bytes"],
+        }
+        if actor:
+            entry["a"] = actor
+        query = parse_qs(scope.get("query_string", b"").decode("latin-1"), keep_blank_values=True)
+        if query:
+            entry["q"] = {name: values[0] if name in SAFE_QUERY_PARAMS else None for name, values in query.items()}
+        path_params = {name: str(value) for name, value in scope.get("path_params", {}).items() if name in SAFE_PATH_PARAMS}
+        if path_params:
+            entry["p"] = path_params
+        if kind:
+            entry["b"] = kind
+            if fields:
+                entry["f"] = fields
+        noted = [flag for header, flag in NOTED_HEADERS.items() if header in headers]
+        if noted:
+            entry["h"] = noted
+        if response["stream"]:
+            entry["sse"] = 1
+        self.recorder.record(entry)
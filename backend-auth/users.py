@@ -1,6 +1,10 @@
+import hashlib
 import os
+import time
 import uuid
+from collections import OrderedDict
 
+import jwt
 from fastapi import Depends, Request
 from fastapi_users import BaseUserManager, FastAPIUsers, UUIDIDMixin, models
 from fastapi_users.authentication import (
@@ -9,15 +13,24 @@ from fastapi_users.authentication import (
     JWTStrategy,
 )
 from fastapi_users.db import SQLAlchemyUserDatabase
-from fastapi_users.exceptions import InvalidPasswordException, UserNotExists
+from fastapi_users.exceptions import InvalidID, InvalidPasswordException, UserNotExists
+from fastapi_users.jwt import _get_secret_value, generate_jwt
 
-from db import User, get_user_db
-from email_service import send_verification_email, send_password_reset_email, SMTP_CONFIG_VALID, EMAILS_ENABLED
+from db import LazyAsyncSession, User, async_session_maker, get_user_db
+from email_service import SMTP_CONFIG_VALID, EMAILS_ENABLED
+from password_hashing import password_helper
+from services import email_outbox
+from services.activity_tracker import activity_tracker
+from services.login_audit import audit_writer
+from services.profile_cache import profile_cache
+from tracing import span
 
 SECRET = os.getenv("SECRET", "your-super-secret-jwt-key-change-this-in-production")
 USERS_VERIFICATION_TOKEN_SECRET = os.getenv("USERS_VERIFICATION_TOKEN_SECRET", SECRET)
 USERS_RESET_PASSWORD_TOKEN_SECRET = os.getenv("USERS_RESET_PASSWORD_TOKEN_SECRET", SECRET)
 JWT_LIFETIME_SECONDS = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", "30")) * 60
+# Verified tokens remembered per worker (see CachedJWTStrategy); 0 disables the cache
+JWT_CLAIMS_CACHE_SIZE = int(os.getenv("JWT_CLAIMS_CACHE_SIZE", "10000"))
 
 
 class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
@@ -28,10 +41,15 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
         """Override authenticate to add detailed logging"""
         try:
             print(f"🔐 Authentication attempt for: {credentials.username if hasattr(credentials, 'username') else 'N/A'}")
-            user = await super().authenticate(credentials)
+            user = await self._verify_credentials(credentials)
             if user:
                 print(f"✅ Authentication successful for: {user.email}")
                 print(f"   User active: {user.is_active}, verified: {user.is_verified}, superuser: {user.is_superuser}")
+                # Successful logins are audited in on_after_login, which has the request
+                if not user.is_active:
+                    await audit_writer.record("password", "inactive", email=user.email, user_id=user.id)
+            else:
+                await audit_writer.record("password", "invalid_credentials", email=credentials.username)
             return user
         except UserNotExists:
             print(f"❌ Authentication failed: User does not exist - {credentials.username if hasattr(credentials, 'username') else 'N/A'}")
@@ -43,56 +61,226 @@ class UserManager(UUIDIDMixin, BaseUserManager[User, uuid.UUID]):
             print(f"❌ Authentication error: {type(e).__name__} - {str(e)}")
             raise
 
+    async def _verify_credentials(self, credentials) -> User | None:
+        """
+        BaseUserManager.authenticate, except that the hash upgrade is saved as a
+        rehash: the password is the same, so no password_changed event (which
+        would end the user's other sessions) and no profile_version bump.
+        """
+        try:
+            user = await self.get_by_email(credentials.username)
+        except UserNotExists:
+            # Run the hasher to mitigate timing attacks
+            self.password_helper.hash(credentials.password)
+            return None
+
+        verified, updated_password_hash = self.password_helper.verify_and_update(
+            credentials.password, user.hashed_password
+        )
+        if not verified:
+            return None
+        if updated_password_hash is not None:
+            user = await self.user_db.update(user, {"hashed_password": updated_password_hash}, password_rehash=True)
+        return user
+
+    async def on_after_login(self, user: User, request: Request | None = None, response=None):
+        await audit_writer.record("password", "success", email=user.email, user_id=user.id, request=request)
+        activity_tracker.touch(user.id, login=True)
+
+    async def _update(self, user: User, update_dict: dict) -> User:
+        """
+        Every write through the manager (update, verify, reset password) bumps
+        profile_version. The increment is done by the UPDATE itself, so
+        concurrent writes each get their own version whatever row they read.
+        """
+        update_dict = {**update_dict, "profile_version": User.profile_version + 1}
+        user = await super()._update(user, update_dict)
+        # After the commit: drops whatever a /users/me read racing the write cached from the old row
+        profile_cache.invalidate(user.id)
+        return user
+
+    async def set_avatar(self, user: User, avatar_source: str | None) -> User:
+        """Record the provider picture from an OAuth login (a no-op when unchanged or absent)."""
+        if not avatar_source or avatar_source == user.avatar_source:
+            return user
+        update_dict = {"avatar_source": avatar_source}
+        user = await self._update(user, update_dict)
+        await self.on_after_update(user, update_dict)
+        return user
+
+    # User events (registered, updated, verified, password_changed, deleted, ...)
+    # are recorded by the user database in the transaction of the write itself
+
+    async def on_after_delete(self, user: User, request: Request | None = None):
+        profile_cache.invalidate(user.id)
+
     async def on_after_register(self, user: User, request: Request | None = None):
         print(f"User {user.id} has registered.")
-        # Automatically request verification email for new users
+        # The verification email was queued in the same transaction as the user
+        # (see db.UserDatabase.create); the outbox relay delivers it
         if not user.is_verified:
-            # Check SMTP configuration before attempting to send email
+            # Check SMTP configuration so the misconfiguration is visible at registration time
             if EMAILS_ENABLED and not SMTP_CONFIG_VALID:
                 print(f"⚠️  WARNING: Cannot send verification email to {user.email}")
-                print(f"   SMTP configuration is invalid. User registration succeeded but email verification cannot be sent.")
+                print(f"   SMTP configuration is invalid. User registration succeeded and the email is queued, but it cannot be delivered.")
                 print(f"   Please configure SMTP settings in .env file.")
                 return
             
-            try:
-                await self.request_verify(user, request)
-            except Exception as e:
-                # User might already be verified or other error
-                print(f"❌ Could not send verification email on registration: {e}")
-                import traceback
-                print(f"   Full traceback:")
-                print(f"   {traceback.format_exc()}")
+            email_outbox.relay.wake()
 
     async def on_after_forgot_password(
         self, user: User, token: str, request: Request | None = None
     ):
         print(f"User {user.id} has forgot their password. Reset token: {token}")
-        await send_password_reset_email(user.email, token)
+        await email_outbox.enqueue_email(
+            self.user_db.session, "reset_password", user.email, user_id=user.id, token=token
+        )
+        email_outbox.relay.wake()
 
     async def on_after_request_verify(
         self, user: User, token: str, request: Request | None = None
     ):
         print(f"Verification requested for user {user.id}. Verification token: {token}")
         try:
-            result = await send_verification_email(user.email, token)
-            if not result:
-                print(f"❌ Failed to send verification email to {user.email}")
+            await email_outbox.enqueue_email(
+                self.user_db.session, "verify", user.email, user_id=user.id, token=token
+            )
+            email_outbox.relay.wake()
         except Exception as e:
-            print(f"❌ Exception while sending verification email to {user.email}: {str(e)}")
+            print(f"❌ Exception while queueing verification email to {user.email}: {str(e)}")
             import traceback
             print(f"   Full traceback:")
             print(f"   {traceback.format_exc()}")
 
 
+def generate_verification_token(user_id: uuid.UUID, email: str) -> str:
+    """
+    Generate an email verification token without going through request_verify.
+    Produces the same token UserManager.request_verify would, for bulk sends.
+    """
+    token_data = {
+        "sub": str(user_id),
+        "email": email,
+        "aud": UserManager.verification_token_audience,
+    }
+    return generate_jwt(
+        token_data,
+        UserManager.verification_token_secret,
+        UserManager.verification_token_lifetime_seconds,
+    )
+
+
 async def get_user_manager(user_db: SQLAlchemyUserDatabase = Depends(get_user_db)):
-    yield UserManager(user_db)
+    yield UserManager(user_db, password_helper)
 
 
 bearer_transport = BearerTransport(tokenUrl="auth/jwt/login")
 
 
+class CachedJWTStrategy(JWTStrategy[models.UP, models.ID]):
+    """
+    JWTStrategy that remembers the subject of tokens it has already verified.
+
+    Clients send the same bearer token on every request until it expires, so
+    an LRU of token digest -> (user id, exp) lets repeated requests skip the
+    base64/JSON parsing, HMAC check and claim validation. Entries are dropped
+    once exp passes; only valid tokens are cached. The user itself is still
+    loaded on every request, so deactivated or deleted users are refused as before.
+    """
+
+    def __init__(self, *args, cache_size: int = JWT_CLAIMS_CACHE_SIZE, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Resolved once instead of unwrapping SecretStr on every decode
+        self._decode_secret = _get_secret_value(self.decode_key)
+        self._decoder = jwt.PyJWT()
+        self._cache: OrderedDict[bytes, tuple[str, float]] = OrderedDict()
+        self.cache_size = cache_size
+        self.hits = 0
+        self.misses = 0
+
+    def _subject(self, token: str) -> str | None:
+        """The token's verified "sub" claim, or None if the token is invalid or expired."""
+        claims = self.verified_claims(token)
+        return claims[0] if claims is not None else None
+
+    def verified_claims(self, token: str) -> tuple[str, float | None] | None:
+        """(sub, exp) of a valid token, or None if the token is invalid or expired."""
+        digest = hashlib.blake2b(token.encode(), digest_size=16).digest()
+        now = time.time()
+        entry = self._cache.get(digest)
+        if entry is not None:
+            subject, expires_at = entry
+            if expires_at > now:
+                self._cache.move_to_end(digest)
+                self.hits += 1
+                return entry
+            del self._cache[digest]
+        self.misses += 1
+        try:
+            claims = self._decoder.decode(
+                token, self._decode_secret, audience=self.token_audience, algorithms=[self.algorithm]
+            )
+        except jwt.PyJWTError:
+            return None
+        subject, expires_at = claims.get("sub"), claims.get("exp")
+        if subject is None:
+            return None
+        if not isinstance(expires_at, (int, float)):
+            # Tokens without exp are never cached: there is no point at which to forget them
+            return subject, None
+        if self.cache_size > 0:
+            self._cache[digest] = (subject, float(expires_at))
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return subject, float(expires_at)
+
+    async def write_token(self, user: models.UP) -> str:
+        with span("jwt.sign"):
+            return await super().write_token(user)
+
+    async def read_token(self, token: str | None, user_manager: BaseUserManager[models.UP, models.ID]) -> models.UP | None:
+        if token is None:
+            return None
+        subject = self._subject(token)
+        if subject is None:
+            return None
+        try:
+            return await user_manager.get(user_manager.parse_id(subject))
+        except (UserNotExists, InvalidID):
+            return None
+        finally:
+            # Authentication is done with the database: give the connection back before the handler runs
+            session = getattr(user_manager.user_db, "session", None)
+            if isinstance(session, LazyAsyncSession):
+                await session.release()
+
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "size": len(self._cache),
+            "max_size": self.cache_size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+        }
+
+
+class ActivityTrackingJWTStrategy(CachedJWTStrategy[models.UP, models.ID]):
+    """JWTStrategy that records last_seen_at for every successfully authenticated request."""
+
+    async def read_token(self, token: str | None, user_manager: BaseUserManager[models.UP, models.ID]) -> models.UP | None:
+        user = await super().read_token(token, user_manager)
+        if user is not None:
+            activity_tracker.touch(user.id)
+        return user
+
+
+# One strategy per worker: the auth backend asks for it on every request
+jwt_strategy = ActivityTrackingJWTStrategy(secret=SECRET, lifetime_seconds=JWT_LIFETIME_SECONDS)
+
+
 def get_jwt_strategy() -> JWTStrategy[models.UP, models.ID]:
-    return JWTStrategy(secret=SECRET, lifetime_seconds=JWT_LIFETIME_SECONDS)
+    return jwt_strategy
 
 
 auth_backend = AuthenticationBackend(
@@ -104,3 +292,29 @@ auth_backend = AuthenticationBackend(
 fastapi_users = FastAPIUsers[User, uuid.UUID](get_user_manager, [auth_backend])
 
 current_active_user = fastapi_users.current_user(active=True)
+
+
+async def active_user_from_token(token: str | None) -> User | None:
+    """
+    The active user a bearer token belongs to, loaded with a short-lived session
+    of its own. For long-lived endpoints (streams) that must not hold a database
+    connection for as long as they are open, which Depends(current_active_user) would.
+    """
+    if not token:
+        return None
+    async with async_session_maker() as session:
+        async for user_db in get_user_db(session):
+            user = await jwt_strategy.read_token(token, UserManager(user_db, password_helper))
+    if user is None or not user.is_active:
+        return None
+    return user
+
+
+async def active_user_by_id(user_id: uuid.UUID) -> User | None:
+    """The active user with this id, loaded like active_user_from_token (for stream tickets)."""
+    async with async_session_maker() as session:
+        async for user_db in get_user_db(session):
+            user = await user_db.get(user_id)
+    if user is None or not user.is_active:
+        return None
+    return user
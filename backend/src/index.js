@@ -5,6 +5,7 @@ import { fileURLToPath } from 'url';
 import { dirname, join } from 'path';
 import { errorHandler } from './middleware/error.middleware.js';
 import { requestLogger } from './middleware/logger.middleware.js';
+import { traceContext } from './middleware/traceContext.middleware.js';
 import { validateEnv } from './config/env.js';
 import corsMiddleware from './middleware/cors.middleware.js';
 
@@ -39,6 +40,9 @@ app.use('/api/webhooks/stripe', express.raw({ type: 'application/json' }));
 app.use(express.json());
 app.use(express.urlencoded({ extended: true }));
 
+// W3C trace context (before the logger, which prints the trace id)
+app.use(traceContext);
+
 // Request logging middleware (must be after body parsers, before routes)
 app.use(requestLogger);
 
@@ -4,6 +4,7 @@
  */
 
 import jwt from 'jsonwebtoken';
+import * as authSocket from '../services/authSocket.service.js';
 
 /**
  * Authenticate middleware - validates JWT token from cookies
@@ -61,6 +62,53 @@ export const authenticate = async (req, res, next) => {
       _token: decoded
     };
 
+    // With AUTH_TOKEN_SOCKET set, take role/email from the user's current record
+    // (and turn away deactivated users) instead of trusting the token alone.
+    // CLAIMS is the only check that sees deactivation, so without an answer the
+    // request fails closed: a revoked admin must not keep access during an outage.
+    if (authSocket.isEnabled()) {
+      let answer;
+      try {
+        answer = await authSocket.getClaims(token);
+      } catch (socketError) {
+        console.error(`❌ Auth token socket unavailable, refusing request: ${socketError.message}`);
+        answer = { status: authSocket.STATUS.ERROR };
+      }
+      const { status, claims } = answer;
+      if (status === authSocket.STATUS.INACTIVE) {
+        return res.status(401).json({
+          success: false,
+          error: {
+            code: 'ACCOUNT_INACTIVE',
+            message: 'This account is no longer active.'
+          }
+        });
+      }
+      if (status === authSocket.STATUS.INVALID_TOKEN) {
+        return res.status(401).json({
+          success: false,
+          error: {
+            code: 'INVALID_TOKEN',
+            message: 'Invalid authentication token. Please log in again.'
+          }
+        });
+      }
+      if (status !== authSocket.STATUS.OK) {
+        res.set('Retry-After', '5');
+        return res.status(503).json({
+          success: false,
+          error: {
+            code: 'AUTH_SERVICE_UNAVAILABLE',
+            message: 'Authentication service is temporarily unavailable. Please try again.'
+          }
+        });
+      }
+      req.user.email = claims.email;
+      req.user.role = claims.role || req.user.role;
+      req.user.isVerified = claims.isVerified;
+      req.user.isSuperuser = claims.isSuperuser;
+    }
+
     // Continue to next middleware/route handler
     next();
   } catch (error) {
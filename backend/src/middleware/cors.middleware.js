@@ -103,11 +103,14 @@ export const corsOptions = {
     'Origin',
     'Access-Control-Request-Method',
     'Access-Control-Request-Headers',
+    'traceparent',
+    'tracestate',
   ],
   exposedHeaders: [
     'Content-Length',
     'Content-Type',
     'X-Total-Count',
+    'traceresponse',
   ],
   maxAge: 86400, // 24 hours - cache preflight requests
   optionsSuccessStatus: 200, // Some legacy browsers (IE11) choke on 204
@@ -38,6 +38,7 @@ export const requestLogger = (req, res, next) => {
       responseTime: `${responseTime}ms`,
       userId: userId || 'anonymous',
       ip: req.ip || req.connection?.remoteAddress || 'unknown',
+      traceId: req.traceContext?.traceId,
     };
 
     // Format log output
@@ -49,6 +50,7 @@ export const requestLogger = (req, res, next) => {
       `(${logEntry.responseTime})`,
       `User: ${logEntry.userId}`,
       `IP: ${logEntry.ip}`,
+      ...(logEntry.traceId ? [`Trace: ${logEntry.traceId}`] : []),
     ].join(' ');
 
     // Log based on status code
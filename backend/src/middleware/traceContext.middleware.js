@@ -0,0 +1,86 @@
+/**
+ * W3C Trace Context Middleware
+ * Continues the trace of an incoming `traceparent` header (or starts one) so
+ * requests can be correlated with the FastAPI auth service, which records
+ * spans for the same trace ids (see backend-auth/tracing.py)
+ */
+
+import crypto from 'crypto';
+
+const TRACEPARENT = /^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?$/;
+const INVALID_TRACE_ID = '0'.repeat(32);
+const INVALID_SPAN_ID = '0'.repeat(16);
+
+// Share of new traces marked as sampled; continued traces keep their parent's decision
+const sampleRate = Number.parseFloat(process.env.TRACING_SAMPLE_RATE || '0.01');
+
+/**
+ * Parse a traceparent header
+ *
+ * @param {string|undefined} header - traceparent header value
+ * @returns {{traceId: string, parentId: string, sampled: boolean}|null} Parent context, or null if missing/invalid
+ */
+export const parseTraceparent = (header) => {
+  const match = TRACEPARENT.exec((header || '').trim().toLowerCase());
+  if (!match) {
+    return null;
+  }
+  const [, version, traceId, parentId, flags, rest] = match;
+  if (version === 'ff' || (version === '00' && rest) || traceId === INVALID_TRACE_ID || parentId === INVALID_SPAN_ID) {
+    return null;
+  }
+  return { traceId, parentId, sampled: (Number.parseInt(flags, 16) & 1) === 1 };
+};
+
+/**
+ * Same rule as the auth service: low 56 bits of the trace id against the rate
+ */
+const isSampled = (traceId) => sampleRate >= 1 || Number.parseInt(traceId.slice(-14), 16) < sampleRate * 2 ** 56;
+
+/**
+ * Trace context middleware
+ * Sets req.traceContext ({traceId, spanId, parentId, sampled, tracestate}) and
+ * answers with a `traceresponse` header carrying this request's position in the trace
+ *
+ * @param {Object} req - Express request object
+ * @param {Object} res - Express response object
+ * @param {Function} next - Express next middleware function
+ */
+export const traceContext = (req, res, next) => {
+  const parent = parseTraceparent(req.headers.traceparent);
+  const traceId = parent ? parent.traceId : crypto.randomBytes(16).toString('hex');
+
+  req.traceContext = {
+    traceId,
+    spanId: crypto.randomBytes(8).toString('hex'),
+    parentId: parent ? parent.parentId : null,
+    sampled: parent ? parent.sampled : isSampled(traceId),
+    tracestate: parent ? req.headers.tracestate : undefined,
+  };
+
+  res.setHeader('traceresponse', formatTraceparent(req.traceContext));
+  next();
+};
+
+/**
+ * Format a trace context as a traceparent header value
+ */
+export const formatTraceparent = ({ traceId, spanId, sampled }) => `00-${traceId}-${spanId}-${sampled ? '01' : '00'}`;
+
+/**
+ * Headers that continue the request's trace on an outbound call
+ * (e.g. axios.get(url, { headers: { ...traceHeaders(req) } }) to the auth service)
+ *
+ * @param {Object} req - Express request object
+ * @returns {Object} traceparent (and tracestate) headers, empty outside a traced request
+ */
+export const traceHeaders = (req) => {
+  if (!req?.traceContext) {
+    return {};
+  }
+  const headers = { traceparent: formatTraceparent(req.traceContext) };
+  if (req.traceContext.tracestate) {
+    headers.tracestate = req.traceContext.tracestate;
+  }
+  return headers;
+};
@@ -0,0 +1,159 @@
+/**
+ * Auth Token Socket Service
+ * Pipelining client for the auth service's internal token socket
+ * (see backend-auth/token_socket.py for the framing), used to fetch a user's
+ * current claims without an HTTP round trip to FastAPI. Requests reject when the
+ * socket is unreachable or does not answer within AUTH_TOKEN_SOCKET_TIMEOUT_MS;
+ * auth.middleware.js then fails closed (503)
+ */
+
+import net from 'net';
+
+// Unix socket path, or host:port of the auth service's TOKEN_SOCKET_PORT; empty disables the socket
+const socketAddress = process.env.AUTH_TOKEN_SOCKET || '';
+const requestTimeoutMs = Number.parseInt(process.env.AUTH_TOKEN_SOCKET_TIMEOUT_MS || '200', 10);
+
+const OP_VALIDATE = 1;
+const OP_CLAIMS = 2;
+export const STATUS = { OK: 0, INVALID_TOKEN: 1, INACTIVE: 2, BAD_REQUEST: 3, ERROR: 4 };
+const FLAG_ACTIVE = 1;
+const FLAG_VERIFIED = 2;
+const FLAG_SUPERUSER = 4;
+
+let socket = null;
+let buffered = Buffer.alloc(0);
+let nextId = 0;
+const waiting = new Map();
+
+export const isEnabled = () => Boolean(socketAddress);
+
+const connectOptions = () => {
+  const separator = socketAddress.lastIndexOf(':');
+  if (socketAddress.startsWith('/') || separator === -1) {
+    return { path: socketAddress };
+  }
+  return { host: socketAddress.slice(0, separator), port: Number.parseInt(socketAddress.slice(separator + 1), 10) };
+};
+
+const failWaiting = (error) => {
+  for (const { reject, timer } of waiting.values()) {
+    clearTimeout(timer);
+    reject(error);
+  }
+  waiting.clear();
+};
+
+/**
+ * Split buffered bytes into response frames: u32 length | u8 status | u32 request id | body
+ */
+const onData = (chunk) => {
+  buffered = buffered.length ? Buffer.concat([buffered, chunk]) : chunk;
+  while (buffered.length >= 4) {
+    const length = buffered.readUInt32BE(0);
+    if (buffered.length < 4 + length) {
+      break;
+    }
+    const status = buffered.readUInt8(4);
+    const requestId = buffered.readUInt32BE(5);
+    const body = buffered.subarray(9, 4 + length);
+    buffered = buffered.subarray(4 + length);
+
+    const pending = waiting.get(requestId);
+    if (pending) {
+      waiting.delete(requestId);
+      clearTimeout(pending.timer);
+      pending.resolve({ status, body });
+    }
+  }
+};
+
+/**
+ * One shared connection; requests are pipelined on it and matched by request id
+ */
+const getSocket = () => {
+  if (socket && !socket.destroyed) {
+    return socket;
+  }
+  buffered = Buffer.alloc(0);
+  socket = net.createConnection(connectOptions());
+  socket.setNoDelay(true);
+  socket.on('data', onData);
+  socket.on('error', (error) => {
+    console.error(`❌ Auth token socket error: ${error.message}`);
+  });
+  socket.on('close', () => {
+    socket = null;
+    failWaiting(new Error('Auth token socket closed'));
+  });
+  return socket;
+};
+
+const request = (op, token) => new Promise((resolve, reject) => {
+  nextId = (nextId + 1) >>> 0;
+  const requestId = nextId;
+  const payload = Buffer.from(token, 'utf8');
+  const frame = Buffer.allocUnsafe(9 + payload.length);
+  frame.writeUInt32BE(5 + payload.length, 0);
+  frame.writeUInt8(op, 4);
+  frame.writeUInt32BE(requestId, 5);
+  payload.copy(frame, 9);
+
+  const timer = setTimeout(() => {
+    waiting.delete(requestId);
+    reject(new Error('Auth token socket request timed out'));
+  }, requestTimeoutMs);
+  waiting.set(requestId, { resolve, reject, timer });
+  getSocket().write(frame);
+});
+
+const formatUuid = (bytes) => {
+  const hex = bytes.toString('hex');
+  return `${hex.slice(0, 8)}-${hex.slice(8, 12)}-${hex.slice(12, 16)}-${hex.slice(16, 20)}-${hex.slice(20)}`;
+};
+
+/**
+ * Check a token's signature and expiry (no database lookup). OK does not mean
+ * the user still exists or is active: use getClaims for authorization decisions
+ *
+ * @param {string} token - Access token
+ * @returns {Promise<{status: number, id?: string, exp?: number|null}>}
+ */
+export const validateToken = async (token) => {
+  const { status, body } = await request(OP_VALIDATE, token);
+  if (status !== STATUS.OK) {
+    return { status };
+  }
+  const exp = Number(body.readBigUInt64BE(16));
+  return { status, id: formatUuid(body.subarray(0, 16)), exp: exp || null };
+};
+
+/**
+ * Current claims of the token's user; status INACTIVE for unknown or deactivated users
+ *
+ * @param {string} token - Access token
+ * @returns {Promise<{status: number, claims?: Object}>}
+ */
+export const getClaims = async (token) => {
+  const { status, body } = await request(OP_CLAIMS, token);
+  if (status !== STATUS.OK) {
+    return { status };
+  }
+  const exp = Number(body.readBigUInt64BE(16));
+  const flags = body.readUInt8(24);
+  const roleLength = body.readUInt8(29);
+  const emailOffset = 30 + roleLength;
+  const emailLength = body.readUInt16BE(emailOffset);
+  return {
+    status,
+    claims: {
+      id: formatUuid(body.subarray(0, 16)),
+      exp: exp || null,
+      isActive: (flags & FLAG_ACTIVE) !== 0,
+      isVerified: (flags & FLAG_VERIFIED) !== 0,
+      isSuperuser: (flags & FLAG_SUPERUSER) !== 0,
+      profileVersion: body.readUInt32BE(25),
+      role: body.toString('utf8', 30, emailOffset),
+      email: body.toString('utf8', emailOffset + 2, emailOffset + 2 + emailLength),
+    },
+  };
+};
@@ -1,6 +1,6 @@
 import React, { createContext, useContext, useState, useEffect } from 'react';
 import Cookies from 'js-cookie';
-import api from '@/services/api';
+import api, { idempotencyKey } from '@/services/api';
 
 const AuthContext = createContext();
 
@@ -248,7 +248,9 @@ export const AuthProvider = ({ children }) => {
   const register = async (userData) => {
     try {
       console.log("Register Payload →", userData);
-      const response = await api.post('/auth/register', userData);
+      const response = await api.post('/auth/register', userData, {
+        headers: { 'Idempotency-Key': idempotencyKey('register', userData) },
+      });
       console.log("Register response:", response.data);
       return { success: true, data: response.data };
     } catch (error) {
@@ -276,6 +278,70 @@ export const AuthProvider = ({ children }) => {
     setUser(prev => ({ ...prev, ...userData }));
   };
 
+  // Account changes are pushed by the backend (GET /users/me/events) instead of polling /users/me
+  useEffect(() => {
+    if (!isAuthenticated || !Cookies.get('access_token') || typeof EventSource === 'undefined') {
+      return undefined;
+    }
+    const apiUrl = import.meta.env.VITE_API_URL || 'http://localhost:8000';
+    let source = null;
+    let retryTimer = null;
+    let stopped = false;
+    let connected = false;
+
+    // EventSource cannot send the Authorization header, and the access token must not go in the URL:
+    // each connection uses a short-lived, single-use stream ticket instead
+    const connect = async () => {
+      let ticket;
+      try {
+        ticket = (await api.post('/users/me/events/ticket')).data.ticket;
+      } catch (error) {
+        if (!stopped) {
+          retryTimer = setTimeout(connect, 30000);
+        }
+        return;
+      }
+      if (stopped) {
+        return;
+      }
+      source = new EventSource(`${apiUrl}/users/me/events?ticket=${encodeURIComponent(ticket)}`);
+
+      source.addEventListener('ready', () => {
+        // After a reconnect, changes made while disconnected were not pushed
+        if (connected) {
+          checkAuth();
+        }
+        connected = true;
+      });
+      ['verified', 'role_changed', 'profile_updated'].forEach((type) => {
+        source.addEventListener(type, () => checkAuth());
+      });
+      ['deactivated', 'deleted', 'token_revoked', 'token_expired'].forEach((type) => {
+        source.addEventListener(type, () => {
+          stopped = true;
+          source.close();
+          logout();
+        });
+      });
+      source.onerror = () => {
+        // The ticket was used up by this connection: reconnect with a new one
+        source.close();
+        if (!stopped) {
+          retryTimer = setTimeout(connect, 5000);
+        }
+      };
+    };
+
+    connect();
+    return () => {
+      stopped = true;
+      clearTimeout(retryTimer);
+      if (source) {
+        source.close();
+      }
+    };
+  }, [isAuthenticated]);
+
   const loginWithProvider = (provider) => {
     const apiUrl = import.meta.env.VITE_API_URL || 'http://localhost:8000';
     window.location.href = `${apiUrl}/auth/${provider}`;
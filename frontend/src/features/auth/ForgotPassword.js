@@ -1,6 +1,6 @@
 import React, { useState } from 'react';
 import htm from 'htm';
-import api from '@/services/api.js';
+import api, { idempotencyKey } from '@/services/api.js';
 import AuthLayout from './AuthLayout.js';
 import { getErrorMessage } from '@/utils/errorHandler.js';
 
@@ -19,7 +19,9 @@ const ForgotPassword = () => {
     setLoading(true);
 
     try {
-      await api.post('/auth/forgot-password', { email });
+      await api.post('/auth/forgot-password', { email }, {
+        headers: { 'Idempotency-Key': idempotencyKey('forgot-password', { email }) },
+      });
       setMessage('If the email exists, a password reset link has been sent to your inbox.');
     } catch (err) {
       setError(getErrorMessage(err, 'NETWORK_ERROR'));
@@ -96,10 +96,50 @@ api.interceptors.request.use(
   }
 );
 
+// Idempotency-Key for a submission: repeating the same payload while it is still
+// unanswered (double-click, retry after a network error) reuses the key, so the backend
+// runs it once. Once a response arrives the key is released and the next submission
+// (e.g. asking for another reset email) is a new request.
+const pendingIdempotencyKeys = {};
+
+export const idempotencyKey = (scope, payload) => {
+  const fingerprint = JSON.stringify(payload);
+  const pending = pendingIdempotencyKeys[scope];
+  if (pending && pending.fingerprint === fingerprint) {
+    return pending.key;
+  }
+  const key = (window.crypto && window.crypto.randomUUID)
+    ? window.crypto.randomUUID()
+    : `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+  pendingIdempotencyKeys[scope] = { fingerprint, key };
+  return key;
+};
+
+const releaseIdempotencyKey = (config) => {
+  const key = config?.headers?.['Idempotency-Key'];
+  if (!key) {
+    return;
+  }
+  for (const scope of Object.keys(pendingIdempotencyKeys)) {
+    if (pendingIdempotencyKeys[scope].key === key) {
+      delete pendingIdempotencyKeys[scope];
+    }
+  }
+};
+
 // Response interceptor to handle 401 errors
 api.interceptors.response.use(
-  (response) => response,
+  (response) => {
+    releaseIdempotencyKey(response.config);
+    return response;
+  },
   async (error) => {
+    // Answered (even with an error status): the submission is over. No response
+    // (network error, timeout): keep the key so a retry is recognised as the same one
+    if (error.response) {
+      releaseIdempotencyKey(error.config);
+    }
+
     // FastAPI Users JWT doesn't use refresh tokens
     // If we get a 401, the token is invalid/expired - redirect to login
     if (error.response?.status === 401) {